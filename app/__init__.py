@@ -18,6 +18,25 @@ def create_app(config_class=Config):
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Veuillez vous connecter pour accéder à cette page.'
     
+    from app.helpers.audit_writer import audit_writer
+    audit_writer.init_app(app)
+    
+    from app.catalog_index import catalog_index
+    catalog_index.init_app(app)
+    from app.batch_stats import batch_stats
+    batch_stats.init_app(app)
+    
+    from app.user_cache import user_cache
+    user_cache.init_app(app)
+    
+    from app.helpers.notification_hub import notification_hub
+    notification_hub.init_app(app)
+    
+    # Tâches de maintenance (statuts des lots, codes, crédits) : app.maintenance
+    from app.helpers.maintenance_scheduler import maintenance_scheduler
+    from app import maintenance  # déclare les tâches
+    maintenance_scheduler.init_app(app)
+    
     @app.template_filter('format_datetime')
     def format_datetime(value, format='%d/%m/%Y %H:%M'):
         if value == 'now':
@@ -39,33 +58,20 @@ def create_app(config_class=Config):
     @app.template_filter('usd_to_cdf')
     def usd_to_cdf(amount_usd):
         """Convertir USD en CDF selon le taux de change actuel"""
-        from app.models import ExchangeRate, SystemConfig
-        if amount_usd is None:
-            return 0
-        amount_usd = float(amount_usd)
-        
-        # Récupérer le taux USD -> CDF depuis ExchangeRate
-        rate = ExchangeRate.query.filter_by(
-            from_currency='USD',
-            to_currency='CDF',
-            is_active=True
-        ).first()
-        
-        if rate:
-            return amount_usd * rate.rate
-        
-        # Sinon utiliser le taux par défaut dans SystemConfig
-        default_rate = SystemConfig.get('default_exchange_rate', 2800)
-        return amount_usd * float(default_rate)
+        from app.currency_utils import usd_to_cdf as convert
+        return convert(amount_usd)
+    
+    @app.template_filter('usd_to_cdf_batch')
+    def usd_to_cdf_batch(amounts_usd):
+        """Convertir une liste de montants USD en CDF (un seul accès au taux)"""
+        from app.currency_utils import usd_to_cdf_batch as convert_batch
+        return convert_batch(amounts_usd)
     
     @app.template_filter('format_price_dual')
     def format_price_dual(amount_usd):
         """Formater le prix en USD avec équivalent CDF en petit"""
-        if amount_usd is None:
-            return '$0.00<br><small class="text-muted">0 FC</small>'
-        amount_usd = float(amount_usd)
-        amount_cdf = usd_to_cdf(amount_usd)
-        return f'${amount_usd:,.2f}<br><small class="text-muted">{amount_cdf:,.0f} FC</small>'
+        from app.currency_utils import format_price_dual as format_dual
+        return format_dual(amount_usd)
     
     @app.template_filter('format_number')
     def format_number(value):
@@ -85,10 +91,7 @@ def create_app(config_class=Config):
             from flask_login import current_user
             if not current_user.is_authenticated:
                 return False
-            for perm in permissions:
-                if current_user.has_permission(perm):
-                    return True
-            return False
+            return current_user.auth_context.has_any_permission(*permissions)
         
         # Fournir la liste des utilisateurs actifs pour les modals
         from flask_login import current_user
@@ -105,15 +108,21 @@ def create_app(config_class=Config):
                        'currency_code', 'timezone', 'language']:
                 company_config[key] = SystemConfig.get(key, '')
         
+        from app.currency_utils import get_usd_cdf_rate
+        
         return dict(
             has_any_permission=has_any_permission, 
+            get_usd_cdf_rate=get_usd_cdf_rate,
             all_users=all_users,
-            config=company_config
+            config=company_config,
+            # `config` désigne la configuration société dans les templates
+            notification_sse_enabled=app.config.get('NOTIFICATION_SSE_ENABLED', False)
         )
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # Utilisateur, pharmacies et droits compilés depuis le cache du worker
+        return user_cache.load(int(user_id))
     
     from app.routes.auth import auth_bp
     from app.routes.dashboard import dashboard_bp
@@ -138,6 +147,7 @@ def create_app(config_class=Config):
     from app.routes.approvals import approvals_bp
     from app.routes.suppliers import suppliers_bp
     from app.routes.api_modals import api_modals_bp
+    from app.routes.jobs import jobs_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(dashboard_bp)
@@ -162,6 +172,65 @@ def create_app(config_class=Config):
     app.register_blueprint(approvals_bp)
     app.register_blueprint(suppliers_bp)
     app.register_blueprint(api_modals_bp)
+    app.register_blueprint(jobs_bp)
+    
+    import click
+    
+    @app.cli.command('rebuild-sales-summary')
+    @click.option('--date-from', default=None, help='Premier jour à reconstruire (AAAA-MM-JJ)')
+    @click.option('--date-to', default=None, help='Dernier jour à reconstruire (AAAA-MM-JJ)')
+    def rebuild_sales_summary_command(date_from, date_to):
+        """Reconstruire le récapitulatif journalier des ventes"""
+        from app.sales_summary import rebuild_sales_summary
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+        count = rebuild_sales_summary(date_from, date_to)
+        click.echo(f'✓ Récapitulatif des ventes reconstruit: {count} ligne(s)')
+    
+    @app.cli.command('archive-audits')
+    @click.option('--days', default=None, type=int, help='Jours à garder dans la table audits (défaut: AUDIT_HOT_RETENTION_DAYS)')
+    def archive_audits_command(days):
+        """Déplacer les anciens audits vers audits_archive"""
+        from datetime import timedelta
+        from app.audit_store import archive_audits
+        before = datetime.utcnow() - timedelta(days=days) if days is not None else None
+        count = archive_audits(before)
+        click.echo(f'✓ Audits archivés: {count}')
+    
+    @app.cli.command('create-search-indexes')
+    def create_search_indexes_command():
+        """Créer les index de recherche texte (FULLTEXT MySQL ou FTS5 SQLite)"""
+        from app.search import search_index
+        backend = search_index.create_indexes()
+        click.echo(f'✓ Index de recherche prêts ({backend.name}) ; redémarrer les workers')
+    
+    @app.cli.command('run-maintenance')
+    @click.option('--task', 'task_name', default=None, help='Exécuter seulement cette tâche')
+    @click.option('--force', is_flag=True, help='Exécuter même si la tâche n\'est pas encore due')
+    @click.option('--loop', is_flag=True, help='Continuer toutes les MAINTENANCE_TICK secondes')
+    def run_maintenance_command(task_name, force, loop):
+        """Exécuter les tâches de maintenance dues (à lancer par cron ou avec --loop)"""
+        import time
+        if task_name and task_name not in maintenance_scheduler.tasks:
+            raise click.BadParameter(f"tâches: {', '.join(maintenance_scheduler.tasks)}", param_hint='--task')
+        while True:
+            results = maintenance_scheduler.run_pending(only=task_name, force=force)
+            for name, result in results.items():
+                click.echo(f'✓ {name}: {result}')
+            if not loop:
+                break
+            force = False
+            time.sleep(maintenance_scheduler.tick)
+    
+    @app.cli.command('run-jobs')
+    @click.option('--once', is_flag=True, help='S\'arrêter quand la file est vide')
+    def run_jobs_command(once):
+        """Exécuter les tâches de fond (exports, imports) mises en file par l'application"""
+        from app.jobs import JobWorker
+        worker = JobWorker(app)
+        click.echo(f'Worker de tâches {worker.name} démarré')
+        count = worker.run(once=once)
+        click.echo(f'✓ Tâches exécutées: {count}')
     
     with app.app_context():
         db.create_all()
@@ -190,6 +259,53 @@ def create_app(config_class=Config):
             except:
                 pass
         
+        # Migration: créer les index déclarés dans les modèles qui manquent aux
+        # tables existantes (db.create_all ne crée que les nouvelles tables)
+        try:
+            inspector = inspect(db.engine)
+            for table in db.metadata.sorted_tables:
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        print(f"Création de l'index {index.name}...")
+                        index.create(bind=db.engine)
+        except Exception as e:
+            print(f"Note migration index: {e}")
+        
+        # Moteur de recherche texte (index créés par `flask create-search-indexes`)
+        from app.search import search_index
+        search_index.init_app(app)
+        
+        # Rejouer les audits restés dans le spool d'un processus arrêté
+        try:
+            count = audit_writer.recover()
+            if count:
+                print(f"✓ Audits récupérés depuis le spool: {count}")
+        except Exception as e:
+            print(f"Note récupération audits: {e}")
+        
+        # Migration: remplir les valeurs des filtres du journal d'audit
+        from app.models import AuditLookup
+        try:
+            if not AuditLookup.query.first() and Audit.query.first():
+                from app.audit_store import rebuild_lookups
+                rebuild_lookups()
+                print("✓ Valeurs des filtres d'audit initialisées")
+        except Exception as e:
+            print(f"Note migration filtres audits: {e}")
+            db.session.rollback()
+        
+        # Migration: remplir le récapitulatif journalier des ventes s'il est vide
+        from app.models import Sale, DailySalesSummary
+        try:
+            if not DailySalesSummary.query.first() and Sale.query.first():
+                from app.sales_summary import rebuild_sales_summary
+                count = rebuild_sales_summary()
+                print(f"✓ Récapitulatif des ventes initialisé: {count} ligne(s)")
+        except Exception as e:
+            print(f"Note migration récapitulatif ventes: {e}")
+            db.session.rollback()
+        
         from app.models import User, Setting, Pharmacy, UserPharmacy, SystemConfig
         
         # Initialiser les configurations système
@@ -0,0 +1,187 @@
+"""
+Stockage du journal d'audit : table chaude + archive
+
+La table audits ne garde que les AUDIT_HOT_RETENTION_DAYS derniers jours.
+archive_audits() déplace les lignes plus anciennes, par lots, vers
+audits_archive (mêmes colonnes, mêmes id). Les requêtes passent par
+audit_query(date_from, date_to), qui ne lit l'archive que si la période
+demandée la recouvre ; les lignes archivées sont renvoyées comme des objets
+Audit ordinaires.
+
+Les listes de modules / types d'action des filtres viennent de la petite
+table audit_lookups, alimentée à chaque écriture d'audits, au lieu d'un
+SELECT DISTINCT sur tout le journal.
+"""
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, insert, select, delete, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from app.models import db, Audit, AuditArchive, AuditLookup
+from app.search import search
+
+LOOKUP_KINDS = ('module', 'action_type')
+
+_known_lookups = set()
+_known_lookups_lock = threading.Lock()
+
+
+def _columns(table):
+    return [table.c[column.name] for column in Audit.__table__.columns]
+
+
+def archive_boundary():
+    """Date du plus récent audit archivé (None si l'archive est vide)"""
+    return db.session.query(func.max(AuditArchive.created_at)).scalar()
+
+
+def audit_query(date_from=None, date_to=None, search_text=None):
+    """
+    Requête sur le journal bornée à [date_from, date_to]
+
+    Sans date de début, seule la table chaude est lue. `search_text` est
+    cherché dans l'action et les détails via l'index texte de chaque table.
+
+    Returns:
+        Tuple (query, entity) : filtrer et trier avec les colonnes de `entity`
+    """
+    boundary = archive_boundary() if date_from else None
+
+    if boundary is None or date_from > boundary:
+        query = Audit.query
+        if date_from:
+            query = query.filter(Audit.created_at >= date_from)
+        if date_to:
+            query = query.filter(Audit.created_at <= date_to)
+        if search_text:
+            query = query.filter(search(Audit, search_text))
+        return query, Audit
+
+    # La période recouvre l'archive : UNION ALL des deux tables, bornes
+    # appliquées dans chaque branche pour utiliser les index de chaque table
+    branches = []
+    for table in (Audit.__table__, AuditArchive.__table__):
+        branch = select(*_columns(table)).where(table.c.created_at >= date_from)
+        if date_to:
+            branch = branch.where(table.c.created_at <= date_to)
+        if search_text:
+            branch = branch.where(search(table, search_text))
+        branches.append(branch)
+
+    entity = aliased(Audit, union_all(*branches).subquery('audits_all'))
+    return db.session.query(entity), entity
+
+
+def get_audit(audit_id):
+    """Audit par id, dans la table chaude ou l'archive (None si introuvable)"""
+    audit = db.session.get(Audit, audit_id)
+    if audit is None:
+        archived = select(*_columns(AuditArchive.__table__)).where(
+            AuditArchive.id == audit_id
+        ).subquery('audits_archived')
+        audit = db.session.query(aliased(Audit, archived)).first()
+    return audit
+
+
+def recent_audits(user_id, limit=50):
+    """Derniers audits d'un utilisateur, complétés par l'archive si besoin"""
+    audits = Audit.query.filter_by(user_id=user_id).order_by(
+        Audit.created_at.desc()
+    ).limit(limit).all()
+
+    if len(audits) < limit:
+        archived = select(*_columns(AuditArchive.__table__)).where(
+            AuditArchive.user_id == user_id
+        ).order_by(AuditArchive.created_at.desc()).limit(limit - len(audits)).subquery('audits_archived')
+        entity = aliased(Audit, archived)
+        audits += db.session.query(entity).order_by(entity.created_at.desc()).all()
+    return audits
+
+
+def archive_audits(before=None, batch_size=5000):
+    """
+    Déplacer les audits antérieurs à `before` vers audits_archive
+
+    Chaque lot (INSERT ... SELECT puis DELETE) est une transaction courte.
+
+    Returns:
+        Nombre d'audits archivés
+    """
+    if before is None:
+        days = current_app.config.get('AUDIT_HOT_RETENTION_DAYS', 90)
+        before = datetime.utcnow() - timedelta(days=days)
+
+    hot = Audit.__table__
+    archive = AuditArchive.__table__
+    moved = 0
+    while True:
+        with db.engine.begin() as conn:
+            ids = conn.execute(
+                select(hot.c.id).where(hot.c.created_at < before).order_by(hot.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(insert(archive).from_select(
+                [column.name for column in hot.columns],
+                select(*hot.columns).where(hot.c.id.in_(ids))
+            ))
+            conn.execute(delete(hot).where(hot.c.id.in_(ids)))
+        moved += len(ids)
+    return moved
+
+
+# ----------------------------------------------------------------------
+# Valeurs des filtres
+# ----------------------------------------------------------------------
+
+def lookup_values(kind):
+    """Valeurs connues pour un filtre ('module' ou 'action_type')"""
+    return [
+        value for (value,) in db.session.query(AuditLookup.value)
+        .filter(AuditLookup.kind == kind).order_by(AuditLookup.value)
+    ]
+
+
+def register_lookups(records):
+    """Enregistrer les nouvelles valeurs de filtre d'un lot d'audits
+
+    Appelé par audit_writer après chaque écriture, hors transaction de requête.
+    """
+    with _known_lookups_lock:
+        if not _known_lookups:
+            with db.engine.connect() as conn:
+                _known_lookups.update(
+                    (row.kind, row.value) for row in conn.execute(select(AuditLookup.kind, AuditLookup.value))
+                )
+        new_values = {
+            (kind, record.get(kind))
+            for record in records for kind in LOOKUP_KINDS
+            if record.get(kind)
+        } - _known_lookups
+
+    for kind, value in new_values:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(AuditLookup.__table__).values(
+                    kind=kind, value=value[:50], created_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Déjà enregistrée par un autre worker
+            pass
+        with _known_lookups_lock:
+            _known_lookups.add((kind, value))
+
+
+def rebuild_lookups():
+    """Remplir audit_lookups depuis les audits existants (migration)"""
+    records = []
+    for table in (Audit.__table__, AuditArchive.__table__):
+        for kind in LOOKUP_KINDS:
+            column = table.c[kind]
+            records += [
+                {kind: value} for (value,) in
+                db.session.execute(select(column).where(column.isnot(None)).distinct())
+            ]
+    register_lookups(records)
+    return len(records)
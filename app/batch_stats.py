@@ -0,0 +1,203 @@
+"""
+Statistiques des lots par pharmacie (pages lots, alertes de péremption, modal)
+
+stock.batches faisait cinq COUNT sur tous les lots (sans filtre de
+pharmacie) et stock.batches_expiring quatre COUNT par tranche de
+péremption. Tous les compteurs sont maintenant calculés en une requête
+(SUM(CASE ...) groupé par pharmacie) et gardés en mémoire par pharmacie :
+
+- une entrée est retirée après le commit d'une modification de lot par l'ORM
+  (ajout, modification, transfert) ou d'un décrément de lot d'une vente
+  (StockLedger) de cette pharmacie ;
+- les modifications faites par les autres workers sont vues au plus tard
+  après BATCH_STATS_CACHE_TTL secondes ;
+- les tranches dépendent de la date du jour : les entrées d'hier sont
+  recalculées.
+"""
+import threading
+import time
+from datetime import date, timedelta
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session, object_session
+from app.models import db, ProductBatch
+
+_PENDING_KEY = 'pending_batch_stats'
+# Lots sans pharmacie
+_NO_PHARMACY = 0
+
+COUNTERS = ('total', 'active', 'expired', 'depleted', 'expiring_soon',
+            'expired_stock', 'expiring_30', 'expiring_60', 'expiring_90')
+
+
+def _counter_columns(today):
+    """Colonnes SUM(CASE ...) de tous les compteurs"""
+    def count_if(*conditions):
+        return func.coalesce(func.sum(case((db.and_(*conditions), 1), else_=0)), 0)
+
+    expiry = ProductBatch.expiry_date
+    in_stock = ProductBatch.quantity > 0
+    day = lambda days: today + timedelta(days=days)
+    return (
+        func.count(ProductBatch.id).label('total'),
+        count_if(ProductBatch.status == 'active').label('active'),
+        count_if(ProductBatch.status == 'expired').label('expired'),
+        count_if(ProductBatch.status == 'depleted').label('depleted'),
+        # Lots actifs qui expirent dans les 90 jours
+        count_if(ProductBatch.status == 'active', expiry > today, expiry <= day(90)).label('expiring_soon'),
+        # Tranches de péremption des lots encore en stock
+        count_if(in_stock, expiry < today).label('expired_stock'),
+        count_if(in_stock, expiry > today, expiry <= day(30)).label('expiring_30'),
+        count_if(in_stock, expiry > day(30), expiry <= day(60)).label('expiring_60'),
+        count_if(in_stock, expiry > day(60), expiry <= day(90)).label('expiring_90'),
+    )
+
+
+class BatchStats:
+    """Compteurs des lots en cache, par pharmacie"""
+
+    def __init__(self):
+        self.ttl = 60
+        self._entries = {}
+        # Toutes les pharmacies chargées (portée admin 'all') : (jour, instant)
+        self._complete = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('BATCH_STATS_CACHE_TTL', 60)
+        if not event.contains(Session, 'after_commit', _after_commit):
+            event.listen(ProductBatch, 'after_insert', _batch_changed)
+            event.listen(ProductBatch, 'after_update', _batch_changed)
+            event.listen(ProductBatch, 'after_delete', _batch_changed)
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_transaction_end', _after_transaction_end)
+
+    def get(self, pharmacy_ids=None):
+        """
+        Compteurs additionnés sur les pharmacies `pharmacy_ids` (None = toutes)
+
+        Returns:
+            {compteur: nombre} (voir COUNTERS)
+        """
+        today = date.today()
+        now = time.monotonic()
+
+        def fresh(entry):
+            return entry is not None and entry[1] == today and now - entry[2] <= self.ttl
+
+        with self._lock:
+            entries = dict(self._entries)
+            complete = self._complete
+
+        if pharmacy_ids is None:
+            if complete is None or complete[0] != today or now - complete[1] > self.ttl:
+                self._load(None, today)
+                with self._lock:
+                    self._complete = (today, now)
+            else:
+                stale = [pharmacy_id for pharmacy_id, entry in entries.items() if not fresh(entry)]
+                if stale:
+                    self._load(stale, today)
+        else:
+            keys = [pharmacy_id or _NO_PHARMACY for pharmacy_id in pharmacy_ids]
+            missing = [key for key in keys if not fresh(entries.get(key))]
+            if missing:
+                self._load(missing, today)
+
+        with self._lock:
+            if pharmacy_ids is None:
+                selected = list(self._entries.values())
+            else:
+                selected = [self._entries.get(pharmacy_id or _NO_PHARMACY) for pharmacy_id in pharmacy_ids]
+        totals = dict.fromkeys(COUNTERS, 0)
+        for entry in selected:
+            if entry is not None:
+                for name in COUNTERS:
+                    totals[name] += entry[0][name]
+        return totals
+
+    def _load(self, keys, today):
+        """Compteurs des pharmacies `keys` (None = toutes) en une requête groupée"""
+        query = db.session.query(ProductBatch.pharmacy_id, *_counter_columns(today))
+        if keys is not None:
+            ids = [key for key in keys if key != _NO_PHARMACY]
+            conditions = [ProductBatch.pharmacy_id.in_(ids)] if ids else []
+            if _NO_PHARMACY in keys:
+                conditions.append(ProductBatch.pharmacy_id == None)
+            query = query.filter(or_(*conditions))
+        rows = query.group_by(ProductBatch.pharmacy_id).all()
+
+        now = time.monotonic()
+        # Pharmacies sans lot : compteurs à zéro, gardés en cache aussi
+        loaded = {key: (dict.fromkeys(COUNTERS, 0), today, now) for key in (keys or [])}
+        for row in rows:
+            counts = {name: int(getattr(row, name) or 0) for name in COUNTERS}
+            loaded[row.pharmacy_id or _NO_PHARMACY] = (counts, today, now)
+        with self._lock:
+            if keys is None:
+                self._entries = loaded
+            else:
+                self._entries.update(loaded)
+
+    def invalidate(self, pharmacy_ids):
+        """Oublier les compteurs des pharmacies modifiées (après le commit)"""
+        with self._lock:
+            for pharmacy_id in pharmacy_ids:
+                key = pharmacy_id or _NO_PHARMACY
+                if key in self._entries:
+                    # Relue à la prochaine demande, sans recharger toutes les pharmacies
+                    counts, day, loaded_at = self._entries[key]
+                    self._entries[key] = (counts, day, float('-inf'))
+                elif self._complete is not None:
+                    self._complete = None
+
+    def clear(self):
+        """Tout oublier (mise à jour groupée des statuts, voir app.maintenance)"""
+        with self._lock:
+            self._entries = {}
+            self._complete = None
+
+    def note_change(self, pharmacy_id):
+        """Oublier les compteurs de la pharmacie après le commit de la session courante"""
+        db.session.info.setdefault(_PENDING_KEY, set()).add(pharmacy_id)
+
+
+batch_stats = BatchStats()
+
+
+def scope_pharmacy_ids(pharmacy_filter='all'):
+    """Pharmacies prises en compte pour l'utilisateur courant (None = toutes)
+
+    Même portée que la liste des lots : l'admin choisit une pharmacie ou
+    toutes, les autres utilisateurs voient leurs pharmacies accessibles.
+    """
+    from app.pharmacy_utils import get_accessible_pharmacies, is_admin
+    if is_admin():
+        if pharmacy_filter and pharmacy_filter != 'all':
+            try:
+                return [int(pharmacy_filter)]
+            except (TypeError, ValueError):
+                return []
+        return None
+    return [pharmacy.id for pharmacy in get_accessible_pharmacies()]
+
+
+def _batch_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    pending.add(target.pharmacy_id)
+    # Transfert : l'ancienne pharmacie change aussi
+    history = db.inspect(target).attrs.pharmacy_id.history
+    pending.update(history.deleted or ())
+
+
+def _after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        batch_stats.invalidate(pending)
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
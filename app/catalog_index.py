@@ -0,0 +1,217 @@
+"""
+Catalogue produits en mémoire pour la caisse
+
+Chaque scan de code-barres appelait pos.search_product, donc
+get_primary_pharmacy() puis une requête LIKE. Chaque worker garde
+maintenant, par pharmacie, une copie des produits actifs :
+
+- un dict code-barres -> produit (scan exact, sans requête) ;
+- des tableaux triés de noms et de mots des noms, parcourus par bisect
+  pour la recherche par préfixe pendant la saisie.
+
+La copie est construite à la première recherche. Toute modification d'un
+produit par l'ORM (création, modification, import, activation...) incrémente
+après le commit le compteur 'catalog' de cache_versions ; chaque worker relit
+ce compteur au plus toutes les CATALOG_VERSION_CHECK_INTERVAL secondes et
+reconstruit ses copies s'il a changé. Les décréments de stock des ventes
+(StockLedger, UPDATE directs) sont reportés dans la copie du worker qui a
+vendu ; les autres workers les voient au plus tard après CATALOG_INDEX_TTL
+secondes. Le stock affiché reste indicatif : la vente le revérifie en base.
+"""
+import threading
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.models import db, Product, CacheVersion
+from app.search import normalize
+
+CATALOG_VERSION_NAME = 'catalog'
+_PENDING_KEY = 'pending_catalog'
+
+
+class PharmacyCatalog:
+    """Produits actifs d'une pharmacie (ou de toutes, pour l'admin)"""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.products = {}
+        self.by_barcode = {}
+        names = []
+        words = []
+        for row in rows:
+            product = {
+                'id': row.id,
+                'name': row.name,
+                'barcode': row.barcode,
+                'category': row.category,
+                'purchase_price': row.purchase_price,
+                'price': row.selling_price,
+                'wholesale_price': row.wholesale_price,
+                'stock': row.stock_quantity
+            }
+            self.products[row.id] = product
+            if row.barcode:
+                self.by_barcode[row.barcode] = product
+            name = normalize(row.name)
+            names.append((name, row.id))
+            words.extend((word, row.id) for word in set(name.split()[1:]))
+        names.sort()
+        words.sort()
+        self.names = names
+        self.words = words
+        self.barcodes = sorted((code, product['id']) for code, product in self.by_barcode.items())
+
+    def barcode(self, code):
+        """Produit dont le code-barres est exactement `code` (ou None)"""
+        return self.by_barcode.get(code)
+
+    def prefix(self, text, limit=20):
+        """Produits dont le nom, un mot du nom ou le code-barres commence par `text`
+
+        Les débuts de nom passent avant les débuts de mot, puis les codes-barres.
+        """
+        key = normalize(text)
+        found = []
+        seen = set()
+        for array, value_key in ((self.names, key), (self.words, key), (self.barcodes, text)):
+            index = bisect_left(array, (value_key,))
+            while index < len(array) and len(found) < limit:
+                value, product_id = array[index]
+                if not value.startswith(value_key):
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    found.append(self.products[product_id])
+                index += 1
+        return found
+
+    def apply_stock(self, deltas):
+        for product_id, delta in deltas.items():
+            product = self.products.get(product_id)
+            if product is not None:
+                product['stock'] = (product['stock'] or 0) + delta
+
+
+class CatalogIndex:
+    """Copies du catalogue du worker, une par pharmacie"""
+
+    def __init__(self):
+        self.ttl = 60
+        self.check_interval = 2
+        self._catalogs = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CATALOG_INDEX_TTL', 60)
+        self.check_interval = app.config.get('CATALOG_VERSION_CHECK_INTERVAL', 2)
+        if not event.contains(Session, 'after_commit', _after_commit):
+            event.listen(Product, 'after_insert', _product_changed)
+            event.listen(Product, 'after_update', _product_changed)
+            event.listen(Product, 'after_delete', _product_changed)
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_transaction_end', _after_transaction_end)
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    def for_user(self, user):
+        """Catalogue visible par l'utilisateur (même portée que filter_by_pharmacy)"""
+        return self.get(self._scope_key(user))
+
+    def get(self, pharmacy_id):
+        """Catalogue d'une pharmacie (None = tous les produits actifs)"""
+        version = self._current_version()
+        with self._lock:
+            catalog = self._catalogs.get(pharmacy_id)
+        if catalog is not None and catalog.version == version \
+                and time.monotonic() - catalog.built_at <= self.ttl:
+            return catalog
+
+        query = db.session.query(
+            Product.id, Product.name, Product.barcode, Product.category, Product.purchase_price,
+            Product.selling_price, Product.wholesale_price, Product.stock_quantity
+        ).filter(Product.is_active == True)
+        if pharmacy_id is not None:
+            query = query.filter(Product.pharmacy_id == pharmacy_id)
+        catalog = PharmacyCatalog(query.all(), version)
+        with self._lock:
+            self._catalogs[pharmacy_id] = catalog
+        return catalog
+
+    def _scope_key(self, user):
+        # Admin et utilisateurs sans pharmacie principale : pas de filtre
+        context = user.auth_context
+        if context.is_admin:
+            return None
+        return context.primary_pharmacy_id
+
+    def _current_version(self):
+        """Compteur 'catalog', relu au plus toutes les check_interval secondes"""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version
+        version = CacheVersion.current(CATALOG_VERSION_NAME)
+        with self._lock:
+            if version != self._version:
+                self._catalogs = {}
+            self._version = version
+            self._checked_at = now
+        return version
+
+    # ------------------------------------------------------------------
+    # Invalidation
+    # ------------------------------------------------------------------
+
+    def invalidate(self):
+        """Incrémenter le compteur 'catalog' (après un commit) et vider les copies locales
+
+        À appeler après les écritures qui ne passent pas par l'ORM
+        (UPDATE/INSERT groupés sur products).
+        """
+        CacheVersion.bump(CATALOG_VERSION_NAME)
+        with self._lock:
+            self._catalogs = {}
+            self._version = None
+
+    def note_stock_change(self, product_id, delta):
+        """Reporter un mouvement de stock dans les copies locales après le commit"""
+        pending = db.session.info.setdefault(_PENDING_KEY, {'changed': False, 'stock': {}})
+        pending['stock'][product_id] = pending['stock'].get(product_id, 0) + delta
+
+    def _apply_stock(self, deltas):
+        with self._lock:
+            catalogs = list(self._catalogs.values())
+        for catalog in catalogs:
+            catalog.apply_stock(deltas)
+
+
+catalog_index = CatalogIndex()
+
+
+def _product_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, {'changed': False, 'stock': {}})['changed'] = True
+
+
+def _after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if pending['changed']:
+        try:
+            catalog_index.invalidate()
+        except Exception as e:
+            print(f"Erreur invalidation catalogue: {str(e)}")
+    elif pending['stock']:
+        catalog_index._apply_stock(pending['stock'])
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
@@ -17,6 +17,82 @@ class Config:
     
     ITEMS_PER_PAGE = 20
     
+    # Nombre de numéros de facture réservés d'un coup par chaque worker
+    INVOICE_NUMBER_BLOCK_SIZE = int(os.environ.get('INVOICE_NUMBER_BLOCK_SIZE', 20))
+    
+    # Budget de latence (ms) du tableau de bord, au-delà un avertissement est journalisé
+    DASHBOARD_LATENCY_BUDGET_MS = int(os.environ.get('DASHBOARD_LATENCY_BUDGET_MS', 300))
+    
+    # Durée (secondes) de validité du cache SystemConfig dans chaque worker
+    SYSTEM_CONFIG_CACHE_TTL = int(os.environ.get('SYSTEM_CONFIG_CACHE_TTL', 30))
+    # Durée (secondes) de validité du taux de change USD -> CDF mis en cache
+    EXCHANGE_RATE_CACHE_TTL = int(os.environ.get('EXCHANGE_RATE_CACHE_TTL', 30))
+    # Durée (secondes) de validité des indicateurs par pharmacie (rapports, statistiques)
+    PHARMACY_METRICS_CACHE_TTL = int(os.environ.get('PHARMACY_METRICS_CACHE_TTL', 60))
+    # Durée (secondes) de validité des compteurs de lots par pharmacie (modifiés par un autre worker)
+    BATCH_STATS_CACHE_TTL = int(os.environ.get('BATCH_STATS_CACHE_TTL', 60))
+    
+    # Journal d'audit : écriture groupée en arrière-plan
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 100))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+    # Dossier des fichiers spool (par défaut: instance/audit_spool)
+    AUDIT_SPOOL_DIR = os.environ.get('AUDIT_SPOOL_DIR')
+    # Jours conservés dans la table audits avant archivage (flask archive-audits)
+    AUDIT_HOT_RETENTION_DAYS = int(os.environ.get('AUDIT_HOT_RETENTION_DAYS', 90))
+    
+    # Recherche texte sans FULLTEXT/FTS5 : durée (secondes) de l'index en mémoire
+    # avant reconstruction (prise en compte des modifications des autres workers)
+    SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 60))
+    
+    # Catalogue produits en mémoire de la caisse : durée de vie maximale d'une copie
+    # (secondes) et intervalle de relecture du compteur de version
+    CATALOG_INDEX_TTL = int(os.environ.get('CATALOG_INDEX_TTL', 60))
+    CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 2))
+    
+    # Import de produits : lignes écrites par INSERT groupé (un commit par paquet)
+    PRODUCT_IMPORT_CHUNK_SIZE = int(os.environ.get('PRODUCT_IMPORT_CHUNK_SIZE', 500))
+    
+    # Tâches de fond (flask run-jobs) : dossier des fichiers produits (par défaut:
+    # instance/job_results), intervalle de lecture de la file et délai sans
+    # heartbeat après lequel une tâche en cours est considérée interrompue
+    JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR')
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 600))
+    
+    # Maintenance périodique (app.maintenance) : thread dans chaque worker web
+    # (désactiver si `flask run-maintenance` tourne par cron), fréquence de
+    # vérification, durée du bail et intervalles des tâches (secondes)
+    MAINTENANCE_IN_PROCESS = os.environ.get('MAINTENANCE_IN_PROCESS', 'true').lower() in ('true', '1', 'yes')
+    MAINTENANCE_TICK = int(os.environ.get('MAINTENANCE_TICK', 60))
+    MAINTENANCE_LEASE = int(os.environ.get('MAINTENANCE_LEASE', 600))
+    MAINTENANCE_BATCH_STATUS_INTERVAL = int(os.environ.get('MAINTENANCE_BATCH_STATUS_INTERVAL', 300))
+    MAINTENANCE_VALIDATION_CODES_INTERVAL = int(os.environ.get('MAINTENANCE_VALIDATION_CODES_INTERVAL', 300))
+    MAINTENANCE_CREDIT_STATUS_INTERVAL = int(os.environ.get('MAINTENANCE_CREDIT_STATUS_INTERVAL', 3600))
+    MAINTENANCE_ARCHIVE_AUDITS_INTERVAL = int(os.environ.get('MAINTENANCE_ARCHIVE_AUDITS_INTERVAL', 86400))
+    MAINTENANCE_PURGE_JOBS_INTERVAL = int(os.environ.get('MAINTENANCE_PURGE_JOBS_INTERVAL', 86400))
+    MAINTENANCE_STOCK_SNAPSHOT_INTERVAL = int(os.environ.get('MAINTENANCE_STOCK_SNAPSHOT_INTERVAL', 3600))
+    MAINTENANCE_STALE_JOBS_INTERVAL = int(os.environ.get('MAINTENANCE_STALE_JOBS_INTERVAL', 300))
+    # Jours de conservation des tâches de fond terminées et de leurs fichiers
+    JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+    # Jours de conservation des photos journalières du stock (ensuite, une par mois)
+    STOCK_SNAPSHOT_DAILY_RETENTION_DAYS = int(os.environ.get('STOCK_SNAPSHOT_DAILY_RETENTION_DAYS', 35))
+    
+    # Utilisateurs connectés en cache dans chaque worker (voir app.user_cache)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 256))
+    USER_CACHE_CHECK_INTERVAL = float(os.environ.get('USER_CACHE_CHECK_INTERVAL', 2))
+    
+    # Notifications en temps réel (SSE) : chaque flux occupe un thread du worker
+    # jusqu'à NOTIFICATION_STREAM_TIMEOUT secondes. À n'activer qu'avec des workers
+    # threadés (gunicorn -k gthread --threads N, ou gevent) ; sinon les onglets
+    # interrogent /notifications/recent toutes les 30 secondes
+    NOTIFICATION_SSE_ENABLED = os.environ.get('NOTIFICATION_SSE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+    # Lecture des nouvelles lignes par worker, commentaire keepalive et durée
+    # maximale d'un flux (le navigateur se reconnecte)
+    NOTIFICATION_POLL_INTERVAL = float(os.environ.get('NOTIFICATION_POLL_INTERVAL', 1.0))
+    NOTIFICATION_KEEPALIVE = int(os.environ.get('NOTIFICATION_KEEPALIVE', 15))
+    NOTIFICATION_STREAM_TIMEOUT = int(os.environ.get('NOTIFICATION_STREAM_TIMEOUT', 300))
+    
     # 1. INFORMATIONS DE BASE
     COMPANY_NAME = 'MARCO PHARMA SARL'
     COMPANY_TYPE = 'SARL'
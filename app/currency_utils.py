@@ -0,0 +1,90 @@
+"""
+Service de taux de change USD -> CDF
+
+Le taux actif est mémorisé dans chaque worker (avec une durée de validité
+bornée par EXCHANGE_RATE_CACHE_TTL) et figé pour la durée d'une requête via
+flask.g. Les routes qui modifient les taux appellent invalidate_exchange_rate().
+"""
+import threading
+import time
+from flask import current_app, g, has_app_context, has_request_context
+
+DEFAULT_USD_CDF_RATE = 2800
+
+_rate_cache = {'rate': None, 'loaded_at': 0.0, 'version': 0}
+_rate_lock = threading.Lock()
+
+
+def _load_usd_cdf_rate():
+    """Lire le taux actif en base (ou le taux par défaut de SystemConfig)"""
+    from app.models import db, ExchangeRate, SystemConfig
+
+    rate = db.session.query(ExchangeRate.rate).filter_by(
+        from_currency='USD',
+        to_currency='CDF',
+        is_active=True
+    ).order_by(ExchangeRate.updated_at.desc()).first()
+
+    if rate:
+        return float(rate[0])
+
+    return float(SystemConfig.get('default_exchange_rate', DEFAULT_USD_CDF_RATE) or DEFAULT_USD_CDF_RATE)
+
+
+def get_usd_cdf_rate():
+    """Obtenir le taux USD -> CDF actif (cache requête + processus)"""
+    version = _rate_cache['version']
+    if has_request_context():
+        snapshot = getattr(g, '_usd_cdf_rate', None)
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+
+    ttl = 30
+    if has_app_context():
+        ttl = current_app.config.get('EXCHANGE_RATE_CACHE_TTL', ttl)
+
+    rate = _rate_cache['rate']
+    if rate is None or time.monotonic() - _rate_cache['loaded_at'] > ttl:
+        rate = _load_usd_cdf_rate()
+        with _rate_lock:
+            _rate_cache['rate'] = rate
+            _rate_cache['loaded_at'] = time.monotonic()
+            _rate_cache['version'] += 1
+            version = _rate_cache['version']
+
+    if has_request_context():
+        g._usd_cdf_rate = (version, rate)
+    return rate
+
+
+def invalidate_exchange_rate():
+    """Vider le cache du taux (à appeler après toute modification des taux)"""
+    with _rate_lock:
+        _rate_cache['rate'] = None
+        _rate_cache['version'] += 1
+    if has_request_context():
+        g.pop('_usd_cdf_rate', None)
+
+
+def usd_to_cdf(amount_usd, rate=None):
+    """Convertir un montant USD en CDF"""
+    if amount_usd is None:
+        return 0
+    if rate is None:
+        rate = get_usd_cdf_rate()
+    return float(amount_usd) * rate
+
+
+def usd_to_cdf_batch(amounts_usd):
+    """Convertir une colonne de montants USD en CDF avec une seule lecture du taux"""
+    rate = get_usd_cdf_rate()
+    return [usd_to_cdf(amount, rate) for amount in amounts_usd]
+
+
+def format_price_dual(amount_usd, rate=None):
+    """Formater le prix en USD avec équivalent CDF en petit"""
+    if amount_usd is None:
+        return '$0.00<br><small class="text-muted">0 FC</small>'
+    amount_usd = float(amount_usd)
+    amount_cdf = usd_to_cdf(amount_usd, rate)
+    return f'${amount_usd:,.2f}<br><small class="text-muted">{amount_cdf:,.0f} FC</small>'
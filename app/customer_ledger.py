@@ -0,0 +1,81 @@
+"""
+Relevé des clients : achats, payé et solde par client
+
+reports.customers chargeait toutes les ventes de chaque client pour les
+additionner en Python. Les totaux sont maintenant calculés par une seule
+requête groupée par client (ventes filtrées par filter_by_pharmacy),
+jointe aux clients, triée et paginée par la base, et lue par lots pour les
+exports.
+"""
+from sqlalchemy import func
+from app.models import db, Customer, Sale
+from app.pharmacy_utils import filter_by_pharmacy
+
+SORT_FIELDS = ('total_purchases', 'total_paid', 'balance', 'sales_count', 'name')
+
+
+def _sales_by_customer(pharmacy_filter='all'):
+    """Sous-requête: totaux des ventes par client selon le scope de l'utilisateur"""
+    query = db.session.query(
+        Sale.customer_id.label('customer_id'),
+        func.count(Sale.id).label('sales_count'),
+        func.coalesce(func.sum(Sale.total_amount), 0).label('total_purchases'),
+        func.coalesce(func.sum(Sale.paid_amount), 0).label('total_paid'),
+    ).filter(Sale.customer_id.isnot(None))
+    query = filter_by_pharmacy(query, Sale, pharmacy_filter)
+    return query.group_by(Sale.customer_id).subquery('customer_sales')
+
+
+def ledger_query(pharmacy_filter='all', sort='total_purchases', direction='desc', with_inactive=False,
+                 without_sales=False):
+    """
+    Une ligne par client: id, name, phone, email, customer_type, address,
+    is_active, sales_count, total_purchases, total_paid, balance
+
+    Args:
+        without_sales: inclure aussi les clients sans vente (exports)
+    """
+    sales = _sales_by_customer(pharmacy_filter)
+    balance = (sales.c.total_purchases - sales.c.total_paid).label('balance')
+
+    query = db.session.query(
+        Customer.id, Customer.name, Customer.phone, Customer.email, Customer.customer_type,
+        Customer.address, Customer.is_active,
+        func.coalesce(sales.c.sales_count, 0).label('sales_count'),
+        func.coalesce(sales.c.total_purchases, 0).label('total_purchases'),
+        func.coalesce(sales.c.total_paid, 0).label('total_paid'),
+        func.coalesce(balance, 0).label('balance'),
+    )
+    if without_sales:
+        query = query.outerjoin(sales, sales.c.customer_id == Customer.id)
+    else:
+        query = query.join(sales, sales.c.customer_id == Customer.id)
+    if not with_inactive:
+        query = query.filter(Customer.is_active == True)
+
+    if sort not in SORT_FIELDS:
+        sort = 'total_purchases'
+    column = Customer.name if sort == 'name' else {
+        'total_purchases': sales.c.total_purchases,
+        'total_paid': sales.c.total_paid,
+        'balance': balance,
+        'sales_count': sales.c.sales_count,
+    }[sort]
+    order = column.asc() if direction == 'asc' else column.desc()
+    # Id en second critère : pagination stable à total égal
+    return query.order_by(order, Customer.id)
+
+
+def ledger_totals(pharmacy_filter='all'):
+    """Nombre de clients avec achats, total des achats et des soldes"""
+    sales = _sales_by_customer(pharmacy_filter)
+    row = db.session.query(
+        func.count(Customer.id).label('customers_count'),
+        func.coalesce(func.sum(sales.c.total_purchases), 0).label('total_purchases'),
+        func.coalesce(func.sum(sales.c.total_purchases - sales.c.total_paid), 0).label('total_balance'),
+    ).join(sales, sales.c.customer_id == Customer.id).filter(Customer.is_active == True).one()
+    return {
+        'customers_count': int(row.customers_count or 0),
+        'total_purchases': float(row.total_purchases or 0),
+        'total_balance': float(row.total_balance or 0),
+    }
@@ -10,7 +10,7 @@ def require_permission(permission):
                 flash('Veuillez vous connecter pour accéder à cette page.', 'danger')
                 return redirect(url_for('auth.login'))
             
-            if not current_user.has_permission(permission):
+            if not current_user.auth_context.has_permission(permission):
                 return render_template('errors/403.html', permission=permission), 403
             
             return f(*args, **kwargs)
@@ -1,16 +1,36 @@
-from flask import Response
+from flask import Response, send_file, stream_with_context
+import codecs
 import csv
+import importlib.util
 import io
-from datetime import datetime
+import tempfile
+from datetime import date, datetime
+
+# Nombre de lignes lues par aller-retour lors des exports
+EXPORT_BATCH_SIZE = 1000
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Formats d'affichage des dates (CSV) et des cellules date (Excel)
+DATETIME_FORMAT = '%d/%m/%Y %H:%M'
+DATE_FORMAT = '%d/%m/%Y'
+EXCEL_DATETIME_FORMAT = 'DD/MM/YYYY HH:MM'
+EXCEL_DATE_FORMAT = 'DD/MM/YYYY'
+
+def iter_csv_file(file):
+    """
+    Lire un fichier CSV (envoyé ou ouvert en binaire) ligne par ligne, sans
+    le charger en mémoire
+
+    Retourne le csv.DictReader (fieldnames, line_num) ; le BOM UTF-8 éventuel
+    (fichiers enregistrés par Excel) est ignoré.
+    """
+    stream = getattr(file, 'stream', file)
+    return csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
 
 def parse_csv_file(file):
     """Parse un fichier CSV et retourne les donnees"""
-    stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-    csv_data = csv.DictReader(stream)
-    data = []
-    for row in csv_data:
-        data.append(row)
-    return data
+    return list(iter_csv_file(file))
 
 def validate_import_data(data, required_fields):
     """Valide les donnees importees"""
@@ -28,67 +48,178 @@ def validate_import_data(data, required_fields):
     
     return True, []
 
+def iter_query(query, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Parcourir une requête par lots sans charger tous les résultats
+
+    yield_per active un curseur côté serveur (stream_results) : la mémoire
+    utilisée dépend de la taille du lot, pas du nombre de lignes.
+    Utiliser de préférence une requête sur les seules colonnes exportées
+    (db.session.query(Model.col, ...)) plutôt que sur les objets complets.
+    """
+    return query.yield_per(batch_size)
+
+
+def export_filename(filename, extension):
+    return f'{filename}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+
+
 def export_to_csv(data, filename, headers=None):
-    """Exporter des données vers CSV"""
-    si = io.StringIO()
-    
-    if not data:
-        return Response('', mimetype='text/csv')
+    """
+    Exporter des données vers CSV
+
+    `data` peut être une liste ou un générateur de dicts : le fichier est
+    envoyé au fur et à mesure (Response en streaming), par paquets de
+    EXPORT_BATCH_SIZE lignes.
+    """
+    rows = iter(data)
     
     if headers is None:
-        headers = data[0].keys() if data else []
+        # Déduire les colonnes de la première ligne
+        first_row = next(rows, None)
+        if first_row is None:
+            return Response('', mimetype='text/csv')
+        headers = list(first_row.keys())
+        rows = _chain_first(first_row, rows)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=headers, extrasaction='ignore')
+        writer.writeheader()
+        
+        count = 0
+        for row in rows:
+            writer.writerow({key: _csv_value(value) for key, value in row.items()})
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        
+        yield buffer.getvalue()
+        buffer.close()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(filename, "csv")}'
     
-    writer = csv.DictWriter(si, fieldnames=headers)
+    return response
+
+
+def write_csv(rows, headers, output):
+    """Écrire des dicts dans un fichier CSV ouvert en texte (exports en tâche de fond)"""
+    writer = csv.DictWriter(output, fieldnames=headers, extrasaction='ignore')
     writer.writeheader()
+    for row in rows:
+        writer.writerow({key: _csv_value(value) for key, value in row.items()})
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    return value
+
+
+def _chain_first(first_row, rows):
+    yield first_row
+    yield from rows
+
+def write_excel(rows, headers, sheet_name='Sheet1', number_formats=None, column_width=15, output=None):
+    """
+    Écrire des lignes dans un classeur Excel en mode write-only
+
+    Les lignes sont écrites au fur et à mesure et le classeur est enregistré
+    dans un fichier temporaire plutôt qu'en mémoire : la mémoire utilisée ne
+    dépend pas du nombre de lignes. Les nombres et les dates restent typés.
+
+    Args:
+        rows: Itérable de dicts (clés = headers) ou de séquences
+        headers: En-têtes des colonnes
+        number_formats: {header: format Excel} (p. ex. {'Marge %': '0.0%'})
+        output: Fichier binaire ouvert où enregistrer le classeur (défaut:
+            fichier temporaire)
+
+    Returns:
+        Le fichier, positionné au début (fermé par l'appelant)
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
     
-    for row in data:
-        writer.writerow(row)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
     
-    output = si.getvalue()
-    si.close()
+    # Les largeurs doivent être définies avant la première ligne
+    for col_num in range(1, len(headers) + 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = column_width
     
-    response = Response(output, mimetype='text/csv')
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    number_formats = number_formats or {}
+    column_formats = [number_formats.get(header) for header in headers]
     
-    return response
+    def make_cell(value, number_format):
+        if isinstance(value, datetime):
+            number_format = number_format or EXCEL_DATETIME_FORMAT
+        elif isinstance(value, date):
+            number_format = number_format or EXCEL_DATE_FORMAT
+        elif value is None:
+            value = ''
+        if not number_format:
+            return value
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = number_format
+        return cell
+    
+    ws.append(list(headers))
+    for row in rows:
+        values = [row.get(header, '') for header in headers] if isinstance(row, dict) else row
+        ws.append([make_cell(value, fmt) for value, fmt in zip(values, column_formats)])
+    
+    if output is None:
+        output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
 
-def export_to_excel(data, filename, headers=None, sheet_name='Sheet1'):
-    """Exporter des données vers Excel"""
-    try:
-        import openpyxl
-        from openpyxl.utils import get_column_letter
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = sheet_name
-        
-        if not data:
-            return Response('', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        
-        if headers is None:
-            headers = list(data[0].keys()) if data else []
-        
-        for col_num, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col_num, value=header)
-        
-        for row_num, row_data in enumerate(data, 2):
-            for col_num, header in enumerate(headers, 1):
-                ws.cell(row=row_num, column=col_num, value=row_data.get(header, ''))
-        
-        for col_num in range(1, len(headers) + 1):
-            ws.column_dimensions[get_column_letter(col_num)].width = 15
-        
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        response = Response(
-            output.getvalue(),
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        return response
-        
-    except ImportError:
+
+def export_to_excel(data, filename, headers=None, sheet_name='Sheet1', download_name=None, number_formats=None):
+    """Exporter des données vers Excel (écriture en continu, voir write_excel)"""
+    # openpyxl absent : repli sur le CSV
+    if importlib.util.find_spec('openpyxl') is None:
         return export_to_csv(data, filename, headers)
+    
+    rows = iter(data)
+    if headers is None:
+        first_row = next(rows, None)
+        if first_row is None:
+            return Response('', mimetype=XLSX_MIMETYPE)
+        headers = list(first_row.keys())
+        rows = _chain_first(first_row, rows)
+    
+    output = write_excel(rows, headers, sheet_name, number_formats)
+    
+    # send_file envoie le fichier par blocs et le ferme à la fin de la réponse
+    return send_file(
+        output,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=download_name or export_filename(filename, 'xlsx')
+    )
+
+
+def export_response(export, export_format='excel'):
+    """
+    Réponse de téléchargement pour un export décrit par un dict
+    {'filename', 'headers', 'rows', 'sheet_name', 'number_formats', 'download_name'}
+    (le même dict sert aux exports en tâche de fond, voir app.jobs.register_export)
+    """
+    if export_format == 'csv':
+        return export_to_csv(export['rows'], export['filename'], export['headers'])
+    return export_to_excel(
+        export['rows'],
+        export['filename'],
+        export['headers'],
+        export.get('sheet_name', 'Sheet1'),
+        download_name=export.get('download_name'),
+        number_formats=export.get('number_formats')
+    )
@@ -5,7 +5,7 @@ Permet de capturer automatiquement toutes les actions utilisateur
 
 from flask import request, session
 from flask_login import current_user
-from app.models import db, Audit
+from app.helpers.audit_writer import audit_writer, enqueue_on_commit
 import json
 from datetime import datetime
 
@@ -15,7 +15,8 @@ class ActivityLogger:
     
     @staticmethod
     def log(action, module=None, action_type=None, entity_type=None, entity_id=None, 
-            details=None, old_value=None, new_value=None, result='success', user_id=None):
+            details=None, old_value=None, new_value=None, result='success', user_id=None,
+            on_commit=False):
         """
         Enregistrer une activité dans le journal d'audit
         
@@ -30,9 +31,14 @@ class ActivityLogger:
             new_value: Dict des valeurs APRÈS modification (sera converti en JSON)
             result: Résultat (success, failed, denied)
             user_id: ID utilisateur (si None, utilise current_user)
+            on_commit: Attendre le commit de la session courante (audit d'une
+                       modification en cours) ; sinon l'audit est mis en file
+                       immédiatement, sans toucher à la session
         
         Returns:
-            L'objet Audit créé ou None si erreur
+            Le dict de l'audit mis en file ou None si erreur
+        
+        L'écriture en base est faite par lots en arrière-plan (voir audit_writer).
         """
         try:
             # Récupérer l'utilisateur
@@ -57,7 +63,7 @@ class ActivityLogger:
                 new_value_json = json.dumps(new_value, default=str, ensure_ascii=False)
             
             # Créer l'audit
-            audit = Audit(
+            audit = dict(
                 user_id=user_id,
                 action=action,
                 module=module,
@@ -70,21 +76,20 @@ class ActivityLogger:
                 result=result,
                 ip_address=ip_address,
                 user_agent=user_agent,
-                session_id=session_id
+                session_id=session_id,
+                created_at=datetime.utcnow()
             )
             
-            db.session.add(audit)
-            db.session.commit()
+            if on_commit:
+                enqueue_on_commit(audit)
+            else:
+                audit_writer.enqueue(audit)
             
             return audit
             
         except Exception as e:
             # Ne pas bloquer l'application si le logging échoue
             print(f"Erreur logging activité: {str(e)}")
-            try:
-                db.session.rollback()
-            except:
-                pass
             return None
     
     @staticmethod
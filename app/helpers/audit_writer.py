@@ -0,0 +1,365 @@
+"""
+Écriture asynchrone et groupée du journal d'audit
+
+Les enregistrements d'audit ne passent plus par la session de la requête :
+ils sont mis en file en mémoire et écrits par un thread de fond en un seul
+INSERT multi-lignes dès que AUDIT_BATCH_SIZE enregistrements attendent ou
+toutes les AUDIT_FLUSH_INTERVAL secondes, dans une transaction séparée.
+
+Chaque enregistrement est d'abord ajouté à un fichier spool local (une ligne
+JSON) : si le processus s'arrête avant l'écriture en base, les fichiers
+restants sont rejoués au démarrage suivant.
+
+Les spools sont nommés audit-<pid>-<jeton>-<segment>.jsonl, le jeton étant
+tiré au hasard à chaque vie de processus : après un redémarrage, un nouveau
+worker qui reçoit le pid d'un worker arrêté n'écrit pas dans ses fichiers.
+Chaque vie de processus garde un verrou exclusif (flock) sur
+audit-<pid>-<jeton>.lock ; le système le libère à l'arrêt, même brutal, et
+c'est ce verrou (et non la vivacité du pid) qui signale les spools orphelins.
+
+Les audits liés à une modification (vente, stock...) sont mis en attente
+dans la session et ne partent dans la file qu'après son commit : une
+transaction annulée ne laisse pas d'audit.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows : vivacité du pid seulement
+    fcntl = None
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from app.models import db, Audit
+
+_AUDIT_COLUMNS = {column.name for column in Audit.__table__.columns} - {'id'}
+_PENDING_KEY = 'pending_audits'
+
+
+class AuditWriter:
+    """File d'audits en mémoire + spool disque, vidée par un thread de fond"""
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.spool_dir = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._spool = None
+        self._segment = 0
+        self._spooled_paths = []
+        self._token = None
+        self._token_pid = None
+        self._lock_file = None
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 100)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', 2.0)
+        self.spool_dir = app.config.get('AUDIT_SPOOL_DIR') or os.path.join(app.instance_path, 'audit_spool')
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        if not event.contains(Session, 'after_commit', _after_commit):
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_transaction_end', _after_transaction_end)
+            atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Mise en file
+    # ------------------------------------------------------------------
+
+    def enqueue(self, record):
+        """Ajouter un enregistrement (dict de colonnes Audit) à la file"""
+        # Mêmes clés pour tous les enregistrements : requis par l'INSERT groupé
+        record = {column: record.get(column) for column in _AUDIT_COLUMNS}
+        record['created_at'] = record['created_at'] or datetime.utcnow()
+        record['result'] = record['result'] or 'success'
+
+        if self.app is None:
+            # Writer non initialisé (script, shell) : écriture directe
+            self._insert([record])
+            return
+
+        with self._lock:
+            self._ensure_started()
+            self._spool_write(record)
+            self._buffer.append(record)
+            size = len(self._buffer)
+
+        if size >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        """Démarrer le thread (et le spool) dans le processus courant"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        # Après un fork, la file et le fichier du parent ne nous appartiennent pas
+        if self._pid != os.getpid():
+            self._buffer = []
+            self._spool = None
+            self._spooled_paths = []
+        self._pid = os.getpid()
+        self._ensure_lifetime()
+        self._open_spool()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Spool disque
+    # ------------------------------------------------------------------
+
+    def _ensure_lifetime(self):
+        """Jeton de cette vie du processus et verrou qui la signale active (sous verrou)"""
+        if self._token is not None and self._token_pid == os.getpid():
+            return
+        self._token_pid = os.getpid()
+        self._token = uuid.uuid4().hex[:12]
+        self._segment = 0
+        # Verrou pris avant le premier segment : un spool sans verrou est orphelin
+        self._lock_file = open(self._lock_path(os.getpid(), self._token), 'a')
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def _lock_path(self, pid, token):
+        return os.path.join(self.spool_dir, f'audit-{pid}-{token}.lock')
+
+    def _spool_path(self, suffix):
+        return os.path.join(self.spool_dir, f'audit-{os.getpid()}-{self._token}-{suffix}.jsonl')
+
+    def _open_spool(self):
+        if self._spool is None:
+            self._segment += 1
+            self._spool = open(self._spool_path(self._segment), 'a', encoding='utf-8')
+
+    def _spool_write(self, record):
+        try:
+            self._spool.write(json.dumps(record, default=_json_default, ensure_ascii=False) + '\n')
+            self._spool.flush()
+        except Exception as e:
+            print(f"Erreur spool audit: {str(e)}")
+
+    def _rotate(self):
+        """Détacher la file et les segments spool correspondants (sous verrou)"""
+        records, self._buffer = self._buffer, []
+        paths, self._spooled_paths = self._spooled_paths, []
+        if self._spool is not None:
+            paths.append(self._spool.name)
+            self._spool.close()
+            self._spool = None
+            self._open_spool()
+        return records, paths
+
+    # ------------------------------------------------------------------
+    # Écriture en base
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Écrire en base tout ce qui est en file"""
+        with self._lock:
+            if not self._buffer or self._pid != os.getpid():
+                return
+            records, paths = self._rotate()
+
+        if self._insert(records):
+            for path in paths:
+                _remove(path)
+        else:
+            # Base indisponible : remettre en file, les segments spool sont conservés
+            with self._lock:
+                self._buffer = records + self._buffer
+                self._spooled_paths = paths + self._spooled_paths
+
+    def _insert(self, records):
+        if self.app is not None:
+            with self.app.app_context():
+                return self._insert_records(records)
+        return self._insert_records(records)
+
+    def _insert_records(self, records):
+        from app.audit_store import register_lookups
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(Audit.__table__), records)
+        except Exception as e:
+            print(f"Erreur écriture audits ({len(records)}): {str(e)}")
+            return False
+
+        # Nouvelles valeurs pour les filtres du journal
+        try:
+            register_lookups(records)
+        except Exception as e:
+            print(f"Erreur valeurs filtres audits: {str(e)}")
+        return True
+
+    def recover(self):
+        """
+        Rejouer les spools laissés par des processus arrêtés
+
+        Un spool est orphelin si le verrou de sa vie de processus est libre
+        (voir le module). Plusieurs workers démarrent en même temps : chaque
+        fichier est d'abord réservé par un renommage atomique
+        (<spool>.recovering-<pid>-<jeton du worker>) ; un worker dont le
+        renommage échoue laisse le fichier à celui qui l'a obtenu, les audits
+        ne sont donc rejoués qu'une fois. Une réservation laissée par un
+        worker arrêté pendant la reprise est reprise de la même façon.
+
+        Returns:
+            Nombre d'enregistrements rejoués
+        """
+        with self._lock:
+            self._ensure_lifetime()
+        count = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'audit-*.jsonl*'))):
+            name = os.path.basename(path)
+            base, _, claim = name.partition('.recovering-')
+            try:
+                owner = _spool_owner(base)
+                claimer = _owner(claim) if claim else None
+            except (IndexError, ValueError):
+                continue
+            if self._owner_alive(*owner) or (claimer is not None and self._owner_alive(*claimer)):
+                continue
+
+            original = os.path.join(self.spool_dir, base)
+            claimed = f'{original}.recovering-{os.getpid()}-{self._token}'
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # Réservé entre-temps par un autre processus
+                continue
+
+            records = []
+            with open(claimed, encoding='utf-8') as spool:
+                for line in spool:
+                    try:
+                        records.append(_from_json(json.loads(line)))
+                    except ValueError:
+                        # Dernière ligne tronquée par l'arrêt brutal
+                        continue
+
+            if not records or self._insert(records):
+                _remove(claimed)
+                count += len(records)
+            else:
+                # Base indisponible : rendre le fichier pour le prochain démarrage
+                try:
+                    os.rename(claimed, original)
+                except OSError:
+                    pass
+
+        # Verrous des vies terminées dont il ne reste aucun spool
+        for path in glob.glob(os.path.join(self.spool_dir, 'audit-*.lock')):
+            try:
+                pid, token = _owner(os.path.basename(path)[len('audit-'):-len('.lock')])
+            except (IndexError, ValueError):
+                continue
+            if self._owner_alive(pid, token):
+                continue
+            if not glob.glob(os.path.join(self.spool_dir, f'audit-{pid}-{token}-*')):
+                _remove(path)
+        return count
+
+    def _owner_alive(self, pid, token):
+        """La vie de processus (pid, jeton) qui a écrit ou réservé un spool est-elle active ?"""
+        if token is not None and token == self._token:
+            return True
+        if token is None or fcntl is None:
+            # Spool d'une version précédente (sans jeton), ou pas de flock :
+            # un fichier à notre pid vient forcément d'une vie antérieure
+            return pid != os.getpid() and _pid_alive(pid)
+        try:
+            lock_file = open(self._lock_path(pid, token), 'r')
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+        finally:
+            lock_file.close()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return str(value)
+
+
+def _from_json(record):
+    created_at = record.get('created_at')
+    if isinstance(created_at, dict) and '__datetime__' in created_at:
+        record['created_at'] = datetime.fromisoformat(created_at['__datetime__'])
+    return record
+
+
+def _owner(value):
+    """(pid, jeton) d'un suffixe '<pid>-<jeton>' ; jeton None pour '<pid>' (ancien format)"""
+    pid, _, token = value.partition('-')
+    return int(pid), token or None
+
+
+def _spool_owner(name):
+    """(pid, jeton) d'un spool audit-<pid>-<jeton>-<n>.jsonl (ou ancien audit-<pid>-<n>.jsonl)"""
+    parts = name[:-len('.jsonl')].split('-')
+    if parts[0] != 'audit' or len(parts) not in (3, 4) or not name.endswith('.jsonl'):
+        raise ValueError(name)
+    return int(parts[1]), parts[2] if len(parts) == 4 else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ----------------------------------------------------------------------
+# Audits attachés à la transaction de la session
+# ----------------------------------------------------------------------
+
+def _after_commit(session):
+    records = session.info.pop(_PENDING_KEY, None)
+    if records:
+        for record in records:
+            audit_writer.enqueue(record)
+
+
+def _after_transaction_end(session, transaction):
+    # Fin de la transaction principale sans commit : abandonner les audits
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def enqueue_on_commit(record):
+    """Mettre un audit en attente du commit de la session courante"""
+    db.session.info.setdefault(_PENDING_KEY, []).append(record)
+
+
+audit_writer = AuditWriter()
@@ -0,0 +1,153 @@
+"""
+Planificateur des tâches de maintenance périodiques
+
+Les statuts calculés (lots expirés, codes de validation expirés, crédits en
+retard) étaient recalculés pendant les requêtes GET, ou jamais. Les tâches
+déclarées avec @maintenance_scheduler.task sont maintenant exécutées
+périodiquement, soit par un thread dans chaque worker (MAINTENANCE_IN_PROCESS,
+démarré à la première requête), soit par `flask run-maintenance` (cron ou
+--loop).
+
+Chaque tâche a une ligne dans maintenance_runs. Pour l'exécuter, un processus
+prend le bail par un UPDATE conditionnel (bail libre ou expiré, tâche due) :
+avec plusieurs workers gunicorn et plusieurs serveurs, une seule exécution a
+lieu par intervalle. Le bail expire après MAINTENANCE_LEASE secondes si le
+processus s'arrête pendant la tâche.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app.models import db, MaintenanceRun
+
+
+class MaintenanceScheduler:
+    """Tâches de maintenance déclarées et thread d'exécution du worker"""
+
+    def __init__(self):
+        self.app = None
+        self.tasks = {}
+        self.tick = 60
+        self.lease = 600
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.tick = app.config.get('MAINTENANCE_TICK', 60)
+        self.lease = app.config.get('MAINTENANCE_LEASE', 600)
+        if app.config.get('MAINTENANCE_IN_PROCESS', True):
+            app.before_request(self._ensure_started)
+
+    def task(self, name, interval_key, default_interval):
+        """Déclarer une tâche exécutée toutes les config[interval_key] secondes"""
+        def decorator(func):
+            self.tasks[name] = (func, interval_key, default_interval)
+            return func
+        return decorator
+
+    @property
+    def owner(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def interval(self, name):
+        func, interval_key, default_interval = self.tasks[name]
+        return self.app.config.get(interval_key, default_interval)
+
+    # ------------------------------------------------------------------
+    # Exécution (contexte d'application requis)
+    # ------------------------------------------------------------------
+
+    def run_pending(self, only=None, force=False):
+        """
+        Exécuter les tâches dues dont ce processus obtient le bail
+
+        Args:
+            only: nom d'une tâche (toutes par défaut)
+            force: ignorer l'échéance (le bail reste requis)
+
+        Returns:
+            {nom: résultat} des tâches exécutées
+        """
+        results = {}
+        for name, (func, interval_key, default_interval) in self.tasks.items():
+            if only and name != only:
+                continue
+            if not self._acquire(name, force):
+                continue
+            result = error = None
+            try:
+                result = func()
+            except Exception as e:
+                db.session.rollback()
+                error = str(e)
+                print(f"Erreur maintenance {name}: {error}")
+            self._release(name, result, error)
+            results[name] = result if error is None else f'erreur: {error}'
+        return results
+
+    def _acquire(self, name, force=False):
+        table = MaintenanceRun.__table__
+        now = datetime.utcnow()
+        condition = or_(table.c.locked_until == None, table.c.locked_until < now)
+        if not force:
+            condition = and_(condition, or_(table.c.next_run_at == None, table.c.next_run_at <= now))
+        lease = {'owner': self.owner, 'locked_until': now + timedelta(seconds=self.lease)}
+
+        with db.engine.begin() as conn:
+            if conn.execute(update(table).where(table.c.name == name, condition).values(**lease)).rowcount == 1:
+                return True
+            if conn.execute(select(table.c.id).where(table.c.name == name)).first() is not None:
+                return False
+        try:
+            # Première exécution : créer la ligne avec le bail
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(name=name, **lease))
+            return True
+        except IntegrityError:
+            # Créée en même temps par un autre processus
+            return False
+
+    def _release(self, name, result, error):
+        table = MaintenanceRun.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.name == name, table.c.owner == self.owner).values(
+                owner=None,
+                locked_until=None,
+                last_run_at=now,
+                next_run_at=now + timedelta(seconds=self.interval(name)),
+                last_result=str(result)[:255] if result is not None else None,
+                last_error=error
+            ))
+
+    # ------------------------------------------------------------------
+    # Thread du worker
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """Démarrer le thread dans le processus courant (après le fork gunicorn)"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+            except Exception as e:
+                print(f"Erreur planificateur maintenance: {str(e)}")
+            time.sleep(self.tick)
+
+
+maintenance_scheduler = MaintenanceScheduler()
@@ -0,0 +1,181 @@
+"""
+Diffusion des notifications en temps réel (Server-Sent Events)
+
+Chaque onglet ouvert interrogeait /notifications/recent toutes les 30
+secondes. Si NOTIFICATION_SSE_ENABLED est vrai (workers threadés), les
+onglets ouvrent un flux SSE (/notifications/stream) et ne reçoivent que les
+nouvelles notifications ; sinon ils gardent l'interrogation périodique.
+
+La table notifications sert de journal entre les workers : dans chaque
+worker, un seul thread lit les lignes dont l'id dépasse la dernière vue
+(requête sur la clé primaire, toutes les NOTIFICATION_POLL_INTERVAL secondes
+et seulement s'il y a des abonnés) et les distribue aux flux ouverts du
+worker. Un commit qui crée une notification réveille immédiatement le thread
+du worker local. À la reconnexion, le navigateur envoie Last-Event-ID et le
+flux renvoie d'abord les notifications manquées.
+"""
+import os
+import queue
+import threading
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, object_session
+from app.models import db, Notification
+
+_PENDING_KEY = 'pending_notifications'
+# Notifications en attente par abonné avant d'abandonner les plus récentes
+_QUEUE_SIZE = 100
+_BATCH_SIZE = 200
+
+
+def notification_payload(row):
+    """Données envoyées au navigateur (même format que /notifications/recent)"""
+    return {
+        'id': row.id,
+        'title': row.title,
+        'message': row.message,
+        'type': row.type,
+        'priority': row.priority,
+        'read': row.read_at is not None,
+        'created_at': row.created_at.strftime('%d/%m/%Y %H:%M') if row.created_at else ''
+    }
+
+
+def _columns():
+    return (
+        Notification.id, Notification.title, Notification.message, Notification.type,
+        Notification.priority, Notification.read_at, Notification.created_at,
+        Notification.target_admin_id
+    )
+
+
+class NotificationHub:
+    """Abonnés du worker + thread de lecture des nouvelles notifications"""
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self._subscribers = {}
+        self._last_id = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('NOTIFICATION_POLL_INTERVAL', 1.0)
+        if not event.contains(Session, 'after_commit', _after_commit):
+            event.listen(Notification, 'after_insert', _notification_created)
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_transaction_end', _after_transaction_end)
+
+    # ------------------------------------------------------------------
+    # Abonnements
+    # ------------------------------------------------------------------
+
+    def subscribe(self, user_id):
+        """File des notifications destinées à `user_id` (à lire dans le flux SSE)"""
+        subscription = queue.Queue(maxsize=_QUEUE_SIZE)
+        with self._lock:
+            self._ensure_started()
+            if self._last_id is None:
+                # Point de départ : rien de ce qui existe déjà n'est renvoyé
+                self._last_id = db.session.query(func.max(Notification.id)).scalar() or 0
+            self._subscribers[subscription] = user_id
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.pop(subscription, None)
+            if not self._subscribers:
+                # Plus personne n'écoute : repartir de la fin au prochain abonnement
+                self._last_id = None
+
+    def since(self, last_id, user_id, limit=50):
+        """Notifications de l'utilisateur postérieures à `last_id` (reconnexion)"""
+        rows = db.session.query(*_columns()).filter(
+            Notification.id > last_id,
+            db.or_(Notification.target_admin_id == user_id, Notification.target_admin_id == None)
+        ).order_by(Notification.id).limit(limit).all()
+        return [notification_payload(row) for row in rows]
+
+    def wakeup(self):
+        """Lire tout de suite les nouvelles notifications (après un commit local)"""
+        self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Thread de lecture
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """Démarrer le thread dans le processus courant (sous verrou)"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        # Après un fork, les abonnés du parent ne nous appartiennent pas
+        if self._pid != os.getpid():
+            self._subscribers = {}
+            self._last_id = None
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='notification-hub', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                last_id = self._last_id if self._subscribers else None
+            if last_id is None:
+                continue
+            try:
+                self._dispatch(self._fetch(last_id))
+            except Exception as e:
+                print(f"Erreur diffusion notifications: {str(e)}")
+
+    def _fetch(self, last_id):
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                return conn.execute(
+                    select(*_columns()).where(Notification.id > last_id)
+                    .order_by(Notification.id).limit(_BATCH_SIZE)
+                ).all()
+
+    def _dispatch(self, rows):
+        if not rows:
+            return
+        with self._lock:
+            if self._last_id is None:
+                return
+            self._last_id = max(self._last_id, rows[-1].id)
+            subscribers = list(self._subscribers.items())
+        for row in rows:
+            payload = notification_payload(row)
+            for subscription, user_id in subscribers:
+                if row.target_admin_id not in (None, user_id):
+                    continue
+                try:
+                    subscription.put_nowait(payload)
+                except queue.Full:
+                    # Onglet qui ne lit plus : il rattrapera via Last-Event-ID
+                    pass
+        if len(rows) == _BATCH_SIZE:
+            self._wakeup.set()
+
+
+notification_hub = NotificationHub()
+
+
+def _notification_created(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_PENDING_KEY] = True
+
+
+def _after_commit(session):
+    if session.info.pop(_PENDING_KEY, None):
+        notification_hub.wakeup()
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,340 @@
+"""
+Tâches de fond : exports, imports et rapports longs hors des requêtes HTTP
+
+Les exports complets, les imports et les rapports multi-pharmacies tournaient
+dans la requête : ils bloquaient un worker gunicorn et dépassaient le délai
+du proxy. En mode async (paramètre async=1), la route enregistre une ligne
+dans la table jobs et répond aussitôt ; un processus séparé
+(`flask run-jobs`) exécute les tâches une par une, sans broker externe :
+
+- prise d'une tâche : UPDATE jobs SET status='running' WHERE id=:id AND
+  status='pending' ; deux workers ne peuvent pas prendre la même tâche ;
+- la tâche s'exécute dans un contexte de requête où l'utilisateur qui l'a
+  demandée est connecté (mêmes droits et même filtre de pharmacie) ;
+- avancement, message et heartbeat écrits dans une transaction séparée ;
+- fichiers produits dans JOB_RESULTS_DIR, téléchargés via /jobs/<id>/download ;
+- une notification est envoyée au demandeur à la fin de la tâche.
+
+Une tâche 'running' dont le heartbeat a plus de JOB_STALE_AFTER secondes
+(worker arrêté) est marquée en échec au démarrage d'un worker et par la
+tâche de maintenance 'stale_jobs' (app.maintenance), même si aucun worker
+ne redémarre.
+"""
+import json
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app, flash, jsonify, redirect, request, url_for
+from flask_login import login_user
+from sqlalchemy import select, update
+from werkzeug.utils import secure_filename
+from app.models import db, Job, User, Notification
+from app.export_utils import EXPORT_BATCH_SIZE, export_filename, write_csv, write_excel
+
+# Fonctions exécutées par le worker, par type de tâche
+JOB_HANDLERS = {}
+# Exports disponibles en tâche de fond, par nom (voir register_export)
+EXPORTS = {}
+
+
+def job_handler(kind):
+    """Déclarer la fonction exécutée pour les tâches de type `kind`
+
+    La fonction reçoit le JobContext puis les paramètres de la tâche.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def register_export(name):
+    """
+    Déclarer une fonction d'export utilisable dans la requête et en tâche de fond
+
+    La fonction reçoit les paramètres de la requête (dict) et retourne un dict
+    {'filename', 'headers', 'rows', 'sheet_name', 'number_formats'}.
+    """
+    def decorator(func):
+        EXPORTS[name] = func
+        return func
+    return decorator
+
+
+def results_dir(app=None):
+    """Dossier des fichiers produits par les tâches (créé si besoin)"""
+    app = app or current_app
+    path = app.config.get('JOB_RESULTS_DIR') or os.path.join(app.instance_path, 'job_results')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# ----------------------------------------------------------------------
+# Côté application web
+# ----------------------------------------------------------------------
+
+def wants_async():
+    """La requête demande une exécution en tâche de fond (async=1)"""
+    return request.values.get('async') == '1'
+
+
+def enqueue(kind, params=None, label=None, user_id=None):
+    """Mettre une tâche en file d'attente (commit immédiat)"""
+    job = Job(
+        kind=kind,
+        label=label,
+        params=json.dumps(params or {}),
+        status='pending',
+        progress=0,
+        message='En attente',
+        user_id=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def enqueue_export(name, export_format, args, label, user_id):
+    """Mettre en file l'export `name` avec les paramètres de la requête"""
+    args = {key: value for key, value in args.items() if key != 'async'}
+    return enqueue('export', {'name': name, 'format': export_format, 'args': args}, label, user_id)
+
+
+def job_payload(job):
+    """État d'une tâche (format de /jobs/<id>)"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'label': job.label,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+        'created_at': job.created_at.strftime('%d/%m/%Y %H:%M') if job.created_at else '',
+        'finished_at': job.finished_at.strftime('%d/%m/%Y %H:%M') if job.finished_at else '',
+        'download_url': url_for('jobs.download', id=job.id) if job.result_file else None,
+    }
+
+
+def job_started_response(job):
+    """Réponse d'une route en mode async : 202 JSON pour les appels AJAX, sinon redirection"""
+    if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest' \
+            or request.accept_mimetypes.best == 'application/json':
+        response = jsonify(dict(job_payload(job), status_url=url_for('jobs.status', id=job.id)))
+        return response, 202
+    flash(f'Tâche #{job.id} en file d\'attente : {job.label}. '
+          f'Le résultat sera disponible dans "Traitements en arrière-plan".', 'info')
+    return redirect(url_for('jobs.index'))
+
+
+# ----------------------------------------------------------------------
+# Côté worker
+# ----------------------------------------------------------------------
+
+class JobContext:
+    """Ce que voit la fonction d'une tâche : paramètres, avancement, fichier résultat"""
+
+    def __init__(self, job, results_path):
+        self.job_id = job.id
+        self.results_path = results_path
+        self.params = json.loads(job.params or '{}')
+        self.user_id = job.user_id
+        self.message = None
+        self.result_file = None
+        self.result_name = None
+
+    def progress(self, percent=None, message=None):
+        """Enregistrer l'avancement (transaction séparée, sans toucher à la session)"""
+        values = {'heartbeat_at': datetime.utcnow()}
+        if percent is not None:
+            values['progress'] = max(0, min(100, int(percent)))
+        if message is not None:
+            values['message'] = message[:255]
+            self.message = message
+        with db.engine.begin() as conn:
+            conn.execute(update(Job.__table__).where(Job.__table__.c.id == self.job_id).values(**values))
+
+    def result_path(self, download_name):
+        """Chemin du fichier résultat de la tâche (un seul par tâche)"""
+        self.result_name = download_name
+        self.result_file = f'job_{self.job_id}_{secure_filename(download_name)}'
+        return os.path.join(self.results_path, self.result_file)
+
+    def count_rows(self, rows, every=EXPORT_BATCH_SIZE):
+        """Parcourir des lignes en signalant leur nombre tous les `every`"""
+        count = 0
+        for row in rows:
+            yield row
+            count += 1
+            if count % every == 0:
+                self.progress(message=f'{count} lignes')
+        self.message = f'{count} lignes'
+
+
+class JobWorker:
+    """Boucle d'exécution des tâches (commande `flask run-jobs`)"""
+
+    def __init__(self, app, name=None):
+        self.app = app
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 2.0)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', 600)
+
+    def run(self, once=False):
+        """Exécuter les tâches en attente ; avec once, s'arrêter quand la file est vide"""
+        self.fail_stale()
+        processed = 0
+        while True:
+            job_id = self.claim()
+            if job_id is None:
+                if once:
+                    return processed
+                time.sleep(self.poll_interval)
+                continue
+            self.execute(job_id)
+            processed += 1
+
+    def claim(self):
+        """Prendre la plus ancienne tâche en attente (None si la file est vide)"""
+        table = Job.__table__
+        with self.app.app_context():
+            while True:
+                with db.engine.begin() as conn:
+                    job_id = conn.execute(
+                        select(table.c.id).where(table.c.status == 'pending').order_by(table.c.id).limit(1)
+                    ).scalar()
+                    if job_id is None:
+                        return None
+                    now = datetime.utcnow()
+                    claimed = conn.execute(
+                        update(table).where(table.c.id == job_id, table.c.status == 'pending').values(
+                            status='running', worker=self.name, started_at=now, heartbeat_at=now,
+                            message='En cours'
+                        )
+                    ).rowcount == 1
+                if claimed:
+                    return job_id
+                # Prise par un autre worker entre-temps : suivante
+
+    def execute(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            context = JobContext(job, results_dir(self.app))
+            try:
+                handler = JOB_HANDLERS.get(job.kind)
+                if handler is None:
+                    raise ValueError(f'Type de tâche inconnu: {job.kind}')
+                user = db.session.get(User, job.user_id) if job.user_id else None
+                with self.app.test_request_context():
+                    # Même portée (pharmacies, permissions) que le demandeur
+                    if user is not None and not login_user(user):
+                        raise ValueError(f'Utilisateur inactif: {user.username}')
+                    handler(context, **context.params)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                error = traceback.format_exc()
+                print(f"Erreur tâche #{job_id} ({job.kind}): {error}")
+                self.finish(job_id, 'failed', context, error)
+            else:
+                self.finish(job_id, 'done', context)
+            finally:
+                db.session.remove()
+
+    def finish(self, job_id, status, context, error=None):
+        values = {
+            'status': status,
+            'finished_at': datetime.utcnow(),
+            'heartbeat_at': datetime.utcnow(),
+            'result_file': context.result_file,
+            'result_name': context.result_name,
+            'error': error,
+        }
+        if status == 'done':
+            values['progress'] = 100
+            values['message'] = (context.message or 'Terminé')[:255]
+        else:
+            values['message'] = 'Échec'
+        with db.engine.begin() as conn:
+            conn.execute(update(Job.__table__).where(Job.__table__.c.id == job_id).values(**values))
+
+        job = db.session.get(Job, job_id)
+        if job is None or not job.user_id:
+            return
+        try:
+            db.session.add(Notification(
+                type='job',
+                title='Traitement terminé' if status == 'done' else 'Traitement en échec',
+                message=f'{job.label or job.kind} : {job.message}',
+                target_admin_id=job.user_id,
+                priority='medium' if status == 'done' else 'high',
+                reference_type='job',
+                reference_id=job.id
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Erreur notification tâche #{job_id}: {str(e)}")
+
+    def fail_stale(self):
+        """Marquer en échec les tâches d'un worker arrêté (heartbeat trop ancien)"""
+        table = Job.__table__
+        limit = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                count = conn.execute(
+                    update(table).where(table.c.status == 'running', table.c.heartbeat_at < limit).values(
+                        status='failed', message='Interrompu', error='Worker arrêté pendant la tâche',
+                        finished_at=datetime.utcnow()
+                    )
+                ).rowcount
+        if count:
+            print(f"Tâches interrompues marquées en échec: {count}")
+        return count
+
+
+# ----------------------------------------------------------------------
+# Tâches
+# ----------------------------------------------------------------------
+
+@job_handler('export')
+def export_job(context, name, format='excel', args=None):
+    """Export déclaré par register_export, écrit dans JOB_RESULTS_DIR"""
+    build = EXPORTS.get(name)
+    if build is None:
+        raise ValueError(f'Export inconnu: {name}')
+    export = build(args or {})
+    rows = context.count_rows(export['rows'])
+
+    if format == 'csv':
+        path = context.result_path(export_filename(export['filename'], 'csv'))
+        # BOM : accents lisibles à l'ouverture dans Excel
+        with open(path, 'w', newline='', encoding='utf-8-sig') as output:
+            write_csv(rows, export['headers'], output)
+    else:
+        path = context.result_path(export_filename(export['filename'], 'xlsx'))
+        with open(path, 'wb') as output:
+            write_excel(rows, export['headers'], export.get('sheet_name', 'Sheet1'),
+                        export.get('number_formats'), output=output)
+    context.message = f"{context.message or '0 lignes'} exportées"
+
+
+def purge_jobs(before):
+    """Supprimer les tâches terminées avant `before` et leurs fichiers
+
+    Returns:
+        Nombre de tâches supprimées
+    """
+    jobs = Job.query.filter(Job.finished_at < before, Job.status.in_(('done', 'failed'))).all()
+    directory = results_dir()
+    for job in jobs:
+        if job.result_file:
+            try:
+                os.remove(os.path.join(directory, job.result_file))
+            except FileNotFoundError:
+                pass
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
@@ -0,0 +1,121 @@
+"""
+Tâches de maintenance périodiques (voir app.helpers.maintenance_scheduler)
+
+stock.batches et stock.batches_expiring chargeaient tous les lots affichables
+pour appeler update_status() sur chacun et valider, à chaque affichage ; les
+codes de validation n'expiraient qu'à l'appel de /validation/cleanup et le
+statut des crédits n'était jamais recalculé. Ces statuts sont maintenant mis
+à jour par des UPDATE ensemblistes (UPDATE ... WHERE expiry_date < :today),
+exécutés par le planificateur ; les pages ne font plus que lire.
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_, update
+from app.models import db, ProductBatch, SaleCredit
+from app.helpers.maintenance_scheduler import maintenance_scheduler
+
+
+def _changed(column, status):
+    # Les lignes au statut NULL sont aussi mises à jour
+    return or_(column == None, column != status)
+
+
+@maintenance_scheduler.task('batch_status', 'MAINTENANCE_BATCH_STATUS_INTERVAL', 300)
+def refresh_batch_status(today=None):
+    """
+    Statut des lots, mêmes règles que ProductBatch.update_status :
+    épuisé, sinon expiré, sinon rappelé (inactif), sinon actif
+
+    Returns:
+        {statut: nombre de lots passés à ce statut}
+    """
+    today = today or datetime.now().date()
+    table = ProductBatch.__table__
+    c = table.c
+    usable = and_(c.quantity > 0, or_(c.expiry_date == None, c.expiry_date >= today))
+    rules = (
+        ('depleted', c.quantity <= 0),
+        ('expired', and_(c.quantity > 0, c.expiry_date < today)),
+        ('recalled', and_(usable, or_(c.is_active == False, c.is_active == None))),
+        ('active', and_(usable, c.is_active == True)),
+    )
+    counts = {}
+    with db.engine.begin() as conn:
+        for status, condition in rules:
+            counts[status] = conn.execute(
+                update(table).where(condition, _changed(c.status, status))
+                .values(status=status, updated_at=datetime.utcnow())
+            ).rowcount
+    if any(counts.values()):
+        # UPDATE hors ORM : les compteurs en cache ne le voient pas
+        from app.batch_stats import batch_stats
+        batch_stats.clear()
+    return counts
+
+
+@maintenance_scheduler.task('validation_codes', 'MAINTENANCE_VALIDATION_CODES_INTERVAL', 300)
+def expire_validation_codes():
+    """Codes de validation actifs dont la date d'expiration est passée"""
+    from app.validation_helper import clean_expired_codes
+    count = clean_expired_codes()
+    if count is None:
+        raise RuntimeError('nettoyage des codes de validation impossible')
+    return count
+
+
+@maintenance_scheduler.task('credit_status', 'MAINTENANCE_CREDIT_STATUS_INTERVAL', 3600)
+def refresh_credit_status(today=None):
+    """
+    Statut des crédits, mêmes règles que SaleCredit.update_status :
+    soldé si plus rien n'est dû, en retard après l'échéance
+
+    Returns:
+        {statut: nombre de crédits passés à ce statut}
+    """
+    today = today or datetime.now().date()
+    table = SaleCredit.__table__
+    c = table.c
+    counts = {}
+    with db.engine.begin() as conn:
+        counts['paid'] = conn.execute(
+            update(table).where(c.remaining_amount <= 0, c.status.in_(('active', 'overdue')))
+            .values(status='paid', updated_at=datetime.utcnow())
+        ).rowcount
+        counts['overdue'] = conn.execute(
+            update(table).where(c.remaining_amount > 0, c.due_date < today, c.status == 'active')
+            .values(status='overdue', updated_at=datetime.utcnow())
+        ).rowcount
+    return counts
+
+
+@maintenance_scheduler.task('archive_audits', 'MAINTENANCE_ARCHIVE_AUDITS_INTERVAL', 86400)
+def archive_old_audits():
+    """Audits plus anciens que AUDIT_HOT_RETENTION_DAYS vers audits_archive"""
+    from app.audit_store import archive_audits
+    return archive_audits()
+
+
+@maintenance_scheduler.task('purge_jobs', 'MAINTENANCE_PURGE_JOBS_INTERVAL', 86400)
+def purge_old_jobs():
+    """Tâches de fond terminées depuis plus de JOB_RETENTION_DAYS et leurs fichiers"""
+    from app.jobs import purge_jobs
+    days = current_app.config.get('JOB_RETENTION_DAYS', 7)
+    return purge_jobs(datetime.utcnow() - timedelta(days=days))
+
+
+@maintenance_scheduler.task('stale_jobs', 'MAINTENANCE_STALE_JOBS_INTERVAL', 300)
+def fail_stale_jobs():
+    """Tâches de fond 'running' sans heartbeat depuis JOB_STALE_AFTER secondes (worker arrêté)"""
+    from app.jobs import JobWorker
+    return JobWorker(current_app._get_current_object()).fail_stale()
+
+
+@maintenance_scheduler.task('stock_snapshot', 'MAINTENANCE_STOCK_SNAPSHOT_INTERVAL', 3600)
+def snapshot_stock():
+    """Photo du stock du jour (une fois par jour) et purge des anciennes photos"""
+    from app.stock_snapshots import purge_snapshots, take_snapshot
+    days = current_app.config.get('STOCK_SNAPSHOT_DAILY_RETENTION_DAYS', 35)
+    return {
+        'products': take_snapshot(),
+        'purged': purge_snapshots(datetime.utcnow().date() - timedelta(days=days))
+    }
@@ -1,11 +1,123 @@
 from datetime import datetime
+from flask import current_app, g, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+import threading
+import time
 
 db = SQLAlchemy()
 
+# Cache processus des configurations système (partagé par les threads d'un worker)
+_system_config_cache = {'values': None, 'loaded_at': 0.0, 'version': 0}
+_system_config_lock = threading.Lock()
+
+# Mapping de compatibilité : ancienne permission -> nouvelles permissions qui l'accordent
+PERMISSION_MAPPING = {
+    'view_dashboard': ['dashboard_stats', 'products_view', 'sales_view', 'customers_view', 'reports_view'],
+    'manage_products': ['products_view', 'products_create', 'products_edit', 'products_delete'],
+    'manage_sales': ['sales_view', 'sales_create', 'sales_edit', 'sales_delete', 'sales_print', 'sales_validate'],
+    'manage_customers': ['customers_view', 'customers_create', 'customers_edit', 'customers_delete'],
+    'manage_users': ['users_view', 'users_create', 'users_edit', 'users_delete', 'users_permissions'],
+    'manage_stock': ['stock_view', 'stock_movements', 'stock_adjust', 'stock_transfer', 'stock_lots'],
+    'manage_hr': ['hr_view', 'hr_create', 'hr_edit', 'hr_delete', 'hr_salaries', 'evaluations_view'],
+    'manage_payments': ['payments_view', 'payments_create', 'payments_edit'],
+    'manage_cashier': ['cashier_access', 'cashier_open', 'cashier_close', 'cashier_view_history', 'sales_validate', 'sales_view'],
+    'view_reports': ['reports_view', 'reports_sales', 'reports_stock', 'reports_products'],
+    'view_audits': ['audits_view'],
+    'manage_settings': ['settings_view', 'settings_edit', 'settings_exchange_rates', 'pharmacies_view', 'pharmacies_create', 'validation_request'],
+    'view_tasks': ['tasks_view'],
+    'create_task': ['tasks_create'],
+    'edit_task': ['tasks_edit'],
+    'delete_task': ['tasks_delete'],
+    'view_approvals': ['approvals_view'],
+    'approve_requests': ['approvals_approve', 'approvals_reject'],
+    'manage_suppliers': ['suppliers_view', 'suppliers_create', 'suppliers_edit', 'suppliers_delete'],
+    'edit_sales': ['sales_edit'],
+    'delete_sales': ['sales_delete'],
+}
+
+
+class AuthContext:
+    """
+    Droits compilés d'un utilisateur
+
+    Construit au chargement de l'utilisateur (et gardé avec lui dans
+    app.user_cache) : les permissions JSON sont décodées et les anciennes
+    permissions du PERMISSION_MAPPING déjà ajoutées, les pharmacies sont lues
+    en une requête.
+    Sert à has_permission, require_permission, filter_by_pharmacy et au
+    filtrage du tableau de bord.
+    """
+    __slots__ = ('user_id', 'role', 'raw_permissions', 'permissions', 'primary_pharmacy_id', 'pharmacy_ids')
+
+    def __init__(self, user_id, role, raw_permissions, permissions, primary_pharmacy_id, pharmacy_ids):
+        self.user_id = user_id
+        self.role = role
+        self.raw_permissions = raw_permissions
+        self.permissions = permissions
+        self.primary_pharmacy_id = primary_pharmacy_id
+        self.pharmacy_ids = pharmacy_ids
+
+    @classmethod
+    def build(cls, user, assignments=None):
+        """
+        Args:
+            assignments: (pharmacy_id, is_primary) déjà chargés ; sinon une requête
+        """
+        granted = {name for name, value in user.get_permissions().items() if value}
+        granted |= {
+            legacy for legacy, permissions in PERMISSION_MAPPING.items()
+            if granted.intersection(permissions)
+        }
+
+        if assignments is None:
+            assignments = db.session.query(UserPharmacy.pharmacy_id, UserPharmacy.is_primary).filter(
+                UserPharmacy.user_id == user.id
+            ).all()
+        primary = next((pharmacy_id for pharmacy_id, is_primary in assignments if is_primary), None)
+
+        return cls(
+            user_id=user.id,
+            role=user.role,
+            raw_permissions=user.permissions,
+            permissions=frozenset(granted),
+            primary_pharmacy_id=primary,
+            pharmacy_ids=frozenset(pharmacy_id for pharmacy_id, _ in assignments)
+        )
+
+    def matches(self, user):
+        """Toujours valable pour cet utilisateur (rôle et permissions inchangés)"""
+        return self.user_id == user.id and self.role == user.role and self.raw_permissions == user.permissions
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+    @property
+    def scope(self):
+        """Portée des données : 'all', 'pharmacy' ou 'personal'"""
+        if self.role == 'admin':
+            return 'all'
+        if self.role in ('manager', 'pharmacien'):
+            return 'pharmacy'
+        return 'personal'
+
+    def has_permission(self, permission):
+        # Les administrateurs ont accès à toutes les permissions
+        return self.role == 'admin' or permission in self.permissions
+
+    def has_any_permission(self, *permissions):
+        return self.role == 'admin' or not self.permissions.isdisjoint(permissions)
+
+    def has_pharmacy_access(self, pharmacy_id):
+        try:
+            return int(pharmacy_id) in self.pharmacy_ids
+        except (TypeError, ValueError):
+            return False
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -38,48 +150,16 @@ class User(UserMixin, db.Model):
         self.permissions = json.dumps(perms_dict)
     
     def has_permission(self, permission):
-        # Les administrateurs ont accès à toutes les permissions
-        if self.role == 'admin':
-            return True
-        
-        perms = self.get_permissions()
-        
-        # Vérification directe
-        if perms.get(permission, False):
-            return True
-        
-        # Mapping de compatibilité pour anciennes permissions
-        permission_mapping = {
-            'view_dashboard': ['dashboard_stats', 'products_view', 'sales_view', 'customers_view', 'reports_view'],
-            'manage_products': ['products_view', 'products_create', 'products_edit', 'products_delete'],
-            'manage_sales': ['sales_view', 'sales_create', 'sales_edit', 'sales_delete', 'sales_print', 'sales_validate'],
-            'manage_customers': ['customers_view', 'customers_create', 'customers_edit', 'customers_delete'],
-            'manage_users': ['users_view', 'users_create', 'users_edit', 'users_delete', 'users_permissions'],
-            'manage_stock': ['stock_view', 'stock_movements', 'stock_adjust', 'stock_transfer', 'stock_lots'],
-            'manage_hr': ['hr_view', 'hr_create', 'hr_edit', 'hr_delete', 'hr_salaries', 'evaluations_view'],
-            'manage_payments': ['payments_view', 'payments_create', 'payments_edit'],
-            'manage_cashier': ['cashier_access', 'cashier_open', 'cashier_close', 'cashier_view_history', 'sales_validate', 'sales_view'],
-            'view_reports': ['reports_view', 'reports_sales', 'reports_stock', 'reports_products'],
-            'view_audits': ['audits_view'],
-            'manage_settings': ['settings_view', 'settings_edit', 'settings_exchange_rates', 'pharmacies_view', 'pharmacies_create', 'validation_request'],
-            'view_tasks': ['tasks_view'],
-            'create_task': ['tasks_create'],
-            'edit_task': ['tasks_edit'],
-            'delete_task': ['tasks_delete'],
-            'view_approvals': ['approvals_view'],
-            'approve_requests': ['approvals_approve', 'approvals_reject'],
-            'manage_suppliers': ['suppliers_view', 'suppliers_create', 'suppliers_edit', 'suppliers_delete'],
-            'edit_sales': ['sales_edit'],
-            'delete_sales': ['sales_delete'],
-        }
-        
-        # Si c'est une ancienne permission, vérifier si l'utilisateur a l'une des nouvelles permissions correspondantes
-        if permission in permission_mapping:
-            for new_perm in permission_mapping[permission]:
-                if perms.get(new_perm, False):
-                    return True
-        
-        return False
+        return self.auth_context.has_permission(permission)
+    
+    @property
+    def auth_context(self):
+        """Droits compilés de l'utilisateur (construits une fois par requête)"""
+        context = getattr(self, '_auth_context', None)
+        if context is None or not context.matches(self):
+            context = AuthContext.build(self)
+            self._auth_context = context
+        return context
     
     @property
     def full_name(self):
@@ -88,17 +168,15 @@ class User(UserMixin, db.Model):
     @property
     def primary_pharmacy(self):
         """Obtenir la pharmacie principale de l'utilisateur (propriété)"""
-        assignment = UserPharmacy.query.filter_by(user_id=self.id, is_primary=True).first()
-        if assignment and assignment.pharmacy:
-            return assignment.pharmacy
-        return None
+        return self.get_primary_pharmacy()
     
     def get_primary_pharmacy(self):
         """Obtenir la pharmacie principale de l'utilisateur (méthode)"""
-        assignment = UserPharmacy.query.filter_by(user_id=self.id, is_primary=True).first()
-        if assignment and assignment.pharmacy:
-            return assignment.pharmacy
-        return None
+        pharmacy_id = self.auth_context.primary_pharmacy_id
+        if pharmacy_id is None:
+            return None
+        # Carte d'identité de la session : une seule requête par requête HTTP
+        return db.session.get(Pharmacy, pharmacy_id)
     
     def get_all_pharmacies(self):
         """Obtenir toutes les pharmacies de l'utilisateur"""
@@ -106,10 +184,13 @@ class User(UserMixin, db.Model):
     
     def has_pharmacy_access(self, pharmacy_id):
         """Vérifier si l'utilisateur a accès à une pharmacie"""
-        return UserPharmacy.query.filter_by(user_id=self.id, pharmacy_id=pharmacy_id).first() is not None
+        return self.auth_context.has_pharmacy_access(pharmacy_id)
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_pharmacy_active', 'pharmacy_id', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, index=True)
@@ -147,6 +228,10 @@ class Product(db.Model):
 
 class ProductBatch(db.Model):
     __tablename__ = 'product_batches'
+    # Sélection FEFO : lots d'un produit dans une pharmacie, par statut et péremption
+    __table_args__ = (
+        db.Index('ix_product_batches_fefo', 'product_id', 'pharmacy_id', 'status', 'expiry_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -220,6 +305,10 @@ class BatchMovement(db.Model):
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        # Compteur des clients actifs du tableau de bord (index couvrant)
+        db.Index('ix_customers_active', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, index=True)
@@ -238,6 +327,13 @@ class Customer(db.Model):
 
 class Sale(db.Model):
     __tablename__ = 'sales'
+    # Filtres fréquents : portée pharmacie + période, crédits, statut de paiement, client
+    __table_args__ = (
+        db.Index('ix_sales_pharmacy_date', 'pharmacy_id', 'sale_date'),
+        db.Index('ix_sales_payment_type_credit', 'payment_type', 'credit_status'),
+        db.Index('ix_sales_payment_status_date', 'payment_status', 'sale_date'),
+        db.Index('ix_sales_customer_date', 'customer_id', 'sale_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -290,6 +386,29 @@ class Sale(db.Model):
                 self.credit_status = 'unpaid'
                 self.payment_status = 'pending'
 
+class DailySalesSummary(db.Model):
+    """Récapitulatif journalier des ventes (pharmacie, jour, vendeur, statut de paiement)
+    
+    Maintenu de façon incrémentale par app.sales_summary à chaque écriture
+    sur une vente ; reconstruit avec la commande `flask rebuild-sales-summary`.
+    """
+    __tablename__ = 'daily_sales_summary'
+    __table_args__ = (
+        db.UniqueConstraint('summary_date', 'pharmacy_id', 'user_id', 'payment_status',
+                            name='uq_daily_sales_summary_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    summary_date = db.Column(db.Date, nullable=False, index=True)
+    pharmacy_id = db.Column(db.Integer, db.ForeignKey('pharmacies.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    payment_status = db.Column(db.String(20))
+    sales_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)
+    paid_amount = db.Column(db.Float, default=0.0, nullable=False)
+    discount_amount = db.Column(db.Float, default=0.0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class SaleItem(db.Model):
     __tablename__ = 'sale_items'
     
@@ -333,6 +452,9 @@ class SalePayment(db.Model):
 
 class StockMovement(db.Model):
     __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_product_created', 'product_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -346,6 +468,29 @@ class StockMovement(db.Model):
     
     user = db.relationship('User', foreign_keys=[created_by], backref='stock_movements_created')
 
+class StockSnapshot(db.Model):
+    """Photo du stock d'un produit (quantité et valeur au prix d'achat)
+
+    Écrite une fois par jour pour tous les produits par app.stock_snapshots ;
+    après STOCK_SNAPSHOT_DAILY_RETENTION_DAYS seule la dernière photo de chaque
+    mois est gardée. Le stock à une date passée part de la photo la plus
+    proche et rejoue les mouvements enregistrés après taken_at.
+    """
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('snapshot_date', 'product_id', name='uq_stock_snapshots_date_product'),
+        db.Index('ix_stock_snapshots_date_pharmacy', 'snapshot_date', 'pharmacy_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    pharmacy_id = db.Column(db.Integer, db.ForeignKey('pharmacies.id'))
+    quantity = db.Column(db.Integer, default=0, nullable=False)
+    unit_cost = db.Column(db.Float, default=0.0, nullable=False)
+    value = db.Column(db.Float, default=0.0, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+
 class Employee(db.Model):
     __tablename__ = 'employees'
     
@@ -519,6 +664,42 @@ class Audit(db.Model):
         
         return changes
 
+class AuditArchive(db.Model):
+    """Audits anciens déplacés hors de la table audits (voir audit_store)"""
+    __tablename__ = 'audits_archive'
+    __table_args__ = (
+        db.Index('ix_audits_archive_user_created', 'user_id', 'created_at'),
+    )
+    
+    # Même id que dans audits : les lignes sont déplacées, pas renumérotées
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer)
+    action = db.Column(db.String(100), nullable=False)
+    entity_type = db.Column(db.String(50))
+    entity_id = db.Column(db.Integer)
+    details = db.Column(db.Text)
+    ip_address = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, index=True)
+    module = db.Column(db.String(50))
+    action_type = db.Column(db.String(20))
+    result = db.Column(db.String(20))
+    old_value = db.Column(db.Text)
+    new_value = db.Column(db.Text)
+    user_agent = db.Column(db.String(255))
+    session_id = db.Column(db.String(100))
+
+class AuditLookup(db.Model):
+    """Valeurs connues des filtres du journal d'audit (module, action_type)"""
+    __tablename__ = 'audit_lookups'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value', name='uq_audit_lookup_kind_value'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Setting(db.Model):
     __tablename__ = 'settings'
     
@@ -550,28 +731,82 @@ class SystemConfig(db.Model):
     @staticmethod
     def get(key, default=None):
         """Récupérer une valeur de configuration"""
-        config = SystemConfig.query.filter_by(key=key, is_active=True).first()
-        if config:
-            return config.get_value()
-        return default
+        entry = SystemConfig.get_all().get(key)
+        if entry is None:
+            return default
+        return SystemConfig.convert_value(*entry)
     
-    def get_value(self):
-        """Convertir la valeur selon son type"""
-        if self.data_type == 'number':
+    @staticmethod
+    def get_all():
+        """Récupérer toutes les configurations actives {key: (value, data_type)}
+        
+        Les lignes sont chargées en une seule requête puis gardées en mémoire
+        dans le worker pendant SYSTEM_CONFIG_CACHE_TTL secondes, ce qui borne
+        le délai de propagation d'une modification faite par un autre worker.
+        Chaque requête HTTP garde une copie figée via flask.g.
+        """
+        version = _system_config_cache['version']
+        if has_request_context():
+            snapshot = getattr(g, '_system_config', None)
+            if snapshot is not None and snapshot[0] == version:
+                return snapshot[1]
+        
+        ttl = 30
+        if has_app_context():
+            ttl = current_app.config.get('SYSTEM_CONFIG_CACHE_TTL', ttl)
+        
+        values = _system_config_cache['values']
+        if values is None or time.monotonic() - _system_config_cache['loaded_at'] > ttl:
+            rows = db.session.query(
+                SystemConfig.key, SystemConfig.value, SystemConfig.data_type
+            ).filter(SystemConfig.is_active == True).all()
+            values = {row.key: (row.value, row.data_type) for row in rows}
+            with _system_config_lock:
+                _system_config_cache['values'] = values
+                _system_config_cache['loaded_at'] = time.monotonic()
+                _system_config_cache['version'] += 1
+                version = _system_config_cache['version']
+        
+        if has_request_context():
+            g._system_config = (version, values)
+        return values
+    
+    @staticmethod
+    def invalidate_cache():
+        """Vider le cache des configurations (à appeler après chaque écriture)"""
+        with _system_config_lock:
+            _system_config_cache['values'] = None
+            _system_config_cache['version'] += 1
+        if has_request_context():
+            g.pop('_system_config', None)
+    
+    @staticmethod
+    def cache_version():
+        """Numéro de version du cache processus"""
+        return _system_config_cache['version']
+    
+    @staticmethod
+    def convert_value(value, data_type):
+        """Convertir une valeur brute selon son type"""
+        if data_type == 'number':
             try:
-                if '.' in self.value:
-                    return float(self.value)
-                return int(self.value)
+                if '.' in value:
+                    return float(value)
+                return int(value)
             except (ValueError, TypeError):
                 return 0
-        elif self.data_type == 'boolean':
-            return self.value.lower() in ('true', '1', 'yes', 'on')
-        elif self.data_type == 'json':
+        elif data_type == 'boolean':
+            return value.lower() in ('true', '1', 'yes', 'on')
+        elif data_type == 'json':
             try:
-                return json.loads(self.value)
+                return json.loads(value)
             except:
                 return {}
-        return self.value
+        return value
+    
+    def get_value(self):
+        """Convertir la valeur selon son type"""
+        return SystemConfig.convert_value(self.value, self.data_type)
     
     @staticmethod
     def set(key, value, category='general', data_type='string', description=None):
@@ -592,8 +827,119 @@ class SystemConfig(db.Model):
             )
             db.session.add(config)
         db.session.commit()
+        SystemConfig.invalidate_cache()
         return config
 
+class DocumentSequence(db.Model):
+    """Compteurs des numéros de documents (factures, ventes temporaires, proformas)
+    
+    Une ligne par (nom, portée, période), p. ex. ('INV', 'pharmacy-3', '20261018').
+    next_value est le prochain numéro non réservé ; les workers réservent des
+    blocs de numéros (voir app.numbering).
+    """
+    __tablename__ = 'document_sequences'
+    __table_args__ = (
+        db.UniqueConstraint('name', 'scope', 'period', name='uq_document_sequence_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), nullable=False)
+    scope = db.Column(db.String(50), nullable=False, default='global')
+    period = db.Column(db.String(20), nullable=False)
+    next_value = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CacheVersion(db.Model):
+    """Compteurs de version des caches en mémoire des workers
+    
+    Un worker qui modifie les données d'un cache incrémente son compteur ;
+    les autres comparent périodiquement le compteur à la version de leur
+    copie et la reconstruisent si elle a changé (voir app.catalog_index,
+    app.user_cache).
+    """
+    __tablename__ = 'cache_versions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @staticmethod
+    def current(name):
+        """Valeur actuelle du compteur (0 s'il n'existe pas encore)"""
+        return db.session.query(CacheVersion.version).filter(CacheVersion.name == name).scalar() or 0
+    
+    @staticmethod
+    def bump(name):
+        """Incrémenter le compteur dans une transaction séparée (après le commit des données)"""
+        from sqlalchemy import insert, update
+        from sqlalchemy.exc import IntegrityError
+        table = CacheVersion.__table__
+        increment = update(table).where(table.c.name == name).values(
+            version=table.c.version + 1, updated_at=datetime.utcnow()
+        )
+        try:
+            with db.engine.begin() as conn:
+                if conn.execute(increment).rowcount == 0:
+                    conn.execute(insert(table).values(name=name, version=1, updated_at=datetime.utcnow()))
+        except IntegrityError:
+            # Compteur créé en même temps par un autre worker
+            with db.engine.begin() as conn:
+                conn.execute(increment)
+
+class Job(db.Model):
+    """Tâche de fond (export, import, rapport) exécutée par `flask run-jobs`
+    
+    La table sert de file d'attente : un worker prend la plus ancienne tâche
+    'pending' par un UPDATE conditionnel sur le statut (voir app.jobs).
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_id', 'status', 'id'),
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    label = db.Column(db.String(200))
+    params = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    progress = db.Column(db.Integer, default=0)  # 0-100, None si inconnu
+    message = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    result_file = db.Column(db.String(255))  # nom du fichier dans JOB_RESULTS_DIR
+    result_name = db.Column(db.String(255))  # nom proposé au téléchargement
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    user = db.relationship('User', backref='jobs')
+    
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+class MaintenanceRun(db.Model):
+    """Planification et bail (lease) des tâches de maintenance périodiques
+    
+    Une ligne par tâche : le processus qui prend le bail (UPDATE conditionnel
+    sur locked_until et next_run_at) est le seul à l'exécuter, même avec
+    plusieurs workers gunicorn (voir app.maintenance).
+    """
+    __tablename__ = 'maintenance_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    owner = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    next_run_at = db.Column(db.DateTime)
+    last_run_at = db.Column(db.DateTime)
+    last_result = db.Column(db.String(255))
+    last_error = db.Column(db.Text)
+
 class ExchangeRate(db.Model):
     __tablename__ = 'exchange_rates'
     
@@ -676,6 +1022,9 @@ class Pharmacy(db.Model):
 
 class UserPharmacy(db.Model):
     __tablename__ = 'user_pharmacies'
+    __table_args__ = (
+        db.Index('ix_user_pharmacies_user_primary', 'user_id', 'is_primary'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -690,6 +1039,9 @@ class UserPharmacy(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_target_read_status', 'target_admin_id', 'read_at', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50), default='system_alert')
@@ -891,8 +1243,8 @@ class SaleCredit(db.Model):
     
     @property
     def is_overdue(self):
-        """Vérifier si le crédit est en retard"""
-        return self.due_date < datetime.now().date() and self.status == 'active'
+        """Vérifier si le crédit est en retard (statut 'overdue' posé par la maintenance)"""
+        return self.due_date < datetime.now().date() and self.status in ('active', 'overdue')
     
     @property
     def days_overdue(self):
@@ -957,6 +1309,9 @@ class CreditTerms(db.Model):
 
 class TempSale(db.Model):
     __tablename__ = 'temp_sales'
+    __table_args__ = (
+        db.Index('ix_temp_sales_status_created', 'status', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     reference = db.Column(db.String(50), unique=True, nullable=False, index=True)
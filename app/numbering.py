@@ -0,0 +1,138 @@
+"""
+Numérotation des documents sans collision
+
+Les numéros viennent de compteurs en base (table document_sequences) par
+nom, portée (pharmacie) et période (jour ou année). Chaque worker réserve
+un bloc de numéros dans une transaction courte et indépendante de celle de
+la vente, puis les distribue en mémoire : pas d'aller-retour en base pour
+chaque vente, et un numéro n'est jamais attribué deux fois (une vente
+annulée ou un worker arrêté laisse seulement un trou dans la séquence).
+"""
+import os
+import threading
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import and_, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app.models import db, DocumentSequence, Proforma
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+_blocks_pid = [os.getpid()]
+
+
+def _reserve_block(name, scope, period, size, seed=None):
+    """Réserver les numéros [start, end) dans une transaction séparée"""
+    table = DocumentSequence.__table__
+    key = and_(table.c.name == name, table.c.scope == scope, table.c.period == period)
+
+    for _ in range(3):
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table).where(key).values(
+                    next_value=table.c.next_value + size,
+                    updated_at=datetime.utcnow()
+                )
+            )
+            if result.rowcount == 1:
+                end = conn.execute(select(table.c.next_value).where(key)).scalar()
+                return end - size, end
+
+        # Premier numéro de la période : créer le compteur
+        start = (seed() if seed else 0) + 1
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(
+                    name=name,
+                    scope=scope,
+                    period=period,
+                    next_value=start + size,
+                    updated_at=datetime.utcnow()
+                ))
+            return start, start + size
+        except IntegrityError:
+            # Un autre worker a créé le compteur entre-temps : réessayer l'UPDATE
+            continue
+
+    raise RuntimeError(f'Impossible de réserver un numéro pour {name}/{scope}/{period}')
+
+
+def next_number(name, scope, period, block_size=1, seed=None):
+    """
+    Obtenir le prochain numéro d'une séquence
+
+    Args:
+        name: Nom de la séquence (INV, TMP, PROFORMA)
+        scope: Portée du compteur (p. ex. 'pharmacy-3' ou 'global')
+        period: Période du compteur (p. ex. '20261018' ou '2026')
+        block_size: Nombre de numéros réservés à la fois par ce worker
+        seed: Fonction retournant le dernier numéro déjà utilisé, appelée
+              seulement à la création du compteur
+
+    Returns:
+        Entier unique pour (name, scope, period)
+    """
+    key = (name, scope, period)
+    with _blocks_lock:
+        # Après un fork (gunicorn --preload), ne pas réutiliser les blocs du parent
+        if _blocks_pid[0] != os.getpid():
+            _blocks.clear()
+            _blocks_pid[0] = os.getpid()
+
+        block = _blocks.get(key)
+        if block and block[0] < block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+
+    start, end = _reserve_block(name, scope, period, block_size, seed)
+
+    with _blocks_lock:
+        # Oublier les blocs des périodes précédentes de la même séquence
+        for old_key in [k for k in _blocks if k[:2] == key[:2] and k != key]:
+            del _blocks[old_key]
+        _blocks[key] = [start + 1, end]
+    return start
+
+
+def _invoice_block_size():
+    if has_app_context():
+        return current_app.config.get('INVOICE_NUMBER_BLOCK_SIZE', 20)
+    return 20
+
+
+def generate_invoice_number(pharmacy_id=None):
+    """Numéro de facture INV-AAAAMMJJ-<pharmacie>-NNNN, compteur par pharmacie et par jour"""
+    date_str = datetime.now().strftime('%Y%m%d')
+    pharmacy_part = pharmacy_id or 0
+    number = next_number('INV', f'pharmacy-{pharmacy_part}', date_str, _invoice_block_size())
+    return f'INV-{date_str}-{pharmacy_part}-{number:04d}'
+
+
+def generate_temp_sale_reference(pharmacy_id=None):
+    """Référence de vente temporaire TMP-AAAAMMJJ-<pharmacie>-NNNN"""
+    date_str = datetime.now().strftime('%Y%m%d')
+    pharmacy_part = pharmacy_id or 0
+    number = next_number('TMP', f'pharmacy-{pharmacy_part}', date_str, _invoice_block_size())
+    return f'TMP-{date_str}-{pharmacy_part}-{number:04d}'
+
+
+def _last_proforma_number(year):
+    """Plus grand numéro PROFORMA-<year>-NNN déjà attribué"""
+    prefix = f'PROFORMA-{year}-'
+    numbers = db.session.query(Proforma.proforma_number).filter(
+        Proforma.proforma_number.like(f'{prefix}%')
+    ).all()
+    last = 0
+    for (number,) in numbers:
+        suffix = number[len(prefix):]
+        if suffix.isdigit():
+            last = max(last, int(suffix))
+    return last
+
+
+def generate_proforma_number():
+    """Numéro de proforma PROFORMA-AAAA-NNN, séquentiel sur l'année"""
+    year = datetime.now().year
+    number = next_number('PROFORMA', 'global', str(year), 1, seed=lambda: _last_proforma_number(year))
+    return f'PROFORMA-{year}-{str(number).zfill(3)}'
@@ -0,0 +1,118 @@
+"""
+Indicateurs par pharmacie (rapports, statistiques, export Excel)
+
+reports.pharmacies, pharmacies.stats et reports.export_pharmacies_excel
+faisaient plusieurs requêtes d'agrégat par pharmacie. Tous les indicateurs
+sont maintenant calculés en trois requêtes GROUP BY pharmacy_id (ventes
+depuis daily_sales_summary, produits, utilisateurs affectés), gardées en
+mémoire dans le worker pendant PHARMACY_METRICS_CACHE_TTL secondes.
+"""
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import case, func
+from app.models import db, Pharmacy, Product, UserPharmacy
+from app.sales_summary import summary_by_pharmacy
+
+_metrics_cache = {'values': None, 'loaded_at': 0.0}
+_metrics_lock = threading.Lock()
+
+
+class PharmacyMetrics:
+    """Indicateurs d'une pharmacie"""
+    __slots__ = ('pharmacy', 'sales_count', 'total_sales', 'total_paid', 'products_count',
+                 'low_stock_count', 'stock_value', 'users_count')
+
+    def __init__(self, pharmacy, sales_count=0, total_sales=0.0, total_paid=0.0, products_count=0,
+                 low_stock_count=0, stock_value=0.0, users_count=0):
+        self.pharmacy = pharmacy
+        self.sales_count = sales_count
+        self.total_sales = total_sales
+        self.total_paid = total_paid
+        self.products_count = products_count
+        self.low_stock_count = low_stock_count
+        self.stock_value = stock_value
+        self.users_count = users_count
+
+    @property
+    def total_revenue(self):
+        return self.total_sales
+
+    @property
+    def total_pending(self):
+        return self.total_sales - self.total_paid
+
+    @property
+    def target_ratio(self):
+        """Part de l'objectif de CA atteinte (0.5 = 50 %)"""
+        target = self.pharmacy.revenue_target or 0
+        return self.total_sales / target if target > 0 else 0
+
+    @property
+    def target_progress(self):
+        """Progression vers l'objectif, en pourcentage"""
+        return self.target_ratio * 100
+
+
+def _load_values():
+    """{pharmacy_id: {indicateur: valeur}} en trois requêtes groupées"""
+    values = {}
+
+    def entry(pharmacy_id):
+        return values.setdefault(pharmacy_id, {})
+
+    for pharmacy_id, totals in summary_by_pharmacy().items():
+        entry(pharmacy_id).update(
+            sales_count=totals['sales_count'],
+            total_sales=totals['total_amount'],
+            total_paid=totals['paid_amount'],
+        )
+
+    product_rows = db.session.query(
+        Product.pharmacy_id,
+        func.count(Product.id).label('products_count'),
+        func.coalesce(func.sum(
+            case((Product.stock_quantity <= Product.min_stock_level, 1), else_=0)
+        ), 0).label('low_stock_count'),
+        func.coalesce(func.sum(Product.stock_quantity * Product.purchase_price), 0).label('stock_value')
+    ).filter(Product.is_active == True).group_by(Product.pharmacy_id)
+    for row in product_rows:
+        entry(row.pharmacy_id).update(
+            products_count=int(row.products_count or 0),
+            low_stock_count=int(row.low_stock_count or 0),
+            stock_value=float(row.stock_value or 0),
+        )
+
+    user_rows = db.session.query(
+        UserPharmacy.pharmacy_id, func.count(UserPharmacy.id).label('users_count')
+    ).group_by(UserPharmacy.pharmacy_id)
+    for row in user_rows:
+        entry(row.pharmacy_id)['users_count'] = int(row.users_count or 0)
+
+    return values
+
+
+def pharmacy_metrics(use_cache=True):
+    """
+    Indicateurs des pharmacies actives, triés par CA décroissant
+
+    Returns:
+        Liste de PharmacyMetrics
+    """
+    ttl = 60
+    if has_app_context():
+        ttl = current_app.config.get('PHARMACY_METRICS_CACHE_TTL', ttl)
+
+    values = _metrics_cache['values'] if use_cache else None
+    if values is None or time.monotonic() - _metrics_cache['loaded_at'] > ttl:
+        values = _load_values()
+        with _metrics_lock:
+            _metrics_cache['values'] = values
+            _metrics_cache['loaded_at'] = time.monotonic()
+
+    metrics = [
+        PharmacyMetrics(pharmacy, **values.get(pharmacy.id, {}))
+        for pharmacy in Pharmacy.query.filter_by(is_active=True).all()
+    ]
+    metrics.sort(key=lambda item: item.total_sales, reverse=True)
+    return metrics
@@ -0,0 +1,387 @@
+"""
+Import de produits depuis un fichier CSV ou Excel
+
+products.import_products lisait tout le fichier dans une liste, ajoutait les
+produits un par un à la session et validait le tout à la fin : un code-barres
+déjà présent faisait échouer tout le fichier sur l'index unique.
+
+Le fichier est maintenant lu ligne par ligne (csv.DictReader sur le flux,
+openpyxl en lecture seule) et traité par paquets de PRODUCT_IMPORT_CHUNK_SIZE
+lignes :
+
+- conversion et validation du paquet, les lignes invalides sont collectées
+  dans `errors` avec leur numéro de ligne ;
+- les codes-barres existants sont lus une seule fois au début (dict
+  code-barres -> pharmacie) : doublons du fichier, produits d'une autre
+  pharmacie et produits existants (hors mode mise à jour) sont refusés sans
+  requête supplémentaire ;
+- écriture du paquet en un INSERT multi-lignes (INSERT ... ON DUPLICATE KEY
+  UPDATE sous MySQL, ON CONFLICT DO UPDATE sous SQLite en mode mise à jour),
+  puis commit : les lignes valides d'un paquet sont conservées même si un
+  paquet suivant échoue.
+
+En mise à jour, le stock n'est pas modifié (il passe par les mouvements de
+stock) ; il n'est repris du fichier que pour les nouveaux produits.
+"""
+import os
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import insert, select, update, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from app.models import db, Product
+from app.catalog_index import catalog_index
+from app.export_utils import export_filename, iter_csv_file, write_csv
+from app.helpers import ActivityLogger
+from app.jobs import job_handler, results_dir
+from app.search import search_index
+
+REQUIRED_FIELDS = ('Nom', 'Prix Vente')
+
+# En-têtes acceptés -> nom de colonne du template
+COLUMN_MAPPING = {
+    'Nom': 'Nom',
+    'nom': 'Nom',
+    'Description': 'Description',
+    'description': 'Description',
+    'Code-barres': 'Code-barres',
+    'Code barres': 'Code-barres',
+    'Forme': 'Forme',
+    'forme': 'Forme',
+    'Unité': 'Unité',
+    'Unite': 'Unité',
+    'Prix Achat (USD)': 'Prix Achat',
+    'Prix Achat': 'Prix Achat',
+    'Prix Vente (USD)': 'Prix Vente',
+    'Prix Vente': 'Prix Vente',
+    'Prix Gros (USD)': 'Prix Gros',
+    'Prix Gros': 'Prix Gros',
+    'Stock': 'Stock',
+    'Stock Min': 'Stock Min',
+    'Fabricant': 'Fabricant',
+    'Fournisseur': 'Fournisseur'
+}
+
+# Colonnes remplacées quand le code-barres existe déjà (mode mise à jour)
+UPDATE_FIELDS = ('name', 'description', 'category', 'unit', 'purchase_price', 'selling_price',
+                 'wholesale_price', 'min_stock_level', 'manufacturer', 'supplier', 'updated_at')
+
+
+def normalize_header(header):
+    header = str(header).replace(' *', '').strip()
+    return COLUMN_MAPPING.get(header, header)
+
+
+def _check_headers(headers):
+    missing = [field for field in REQUIRED_FIELDS if field not in headers]
+    if missing:
+        raise ValueError(f"Champs manquants: {', '.join(missing)}")
+
+
+def iter_csv_rows(file):
+    """(numéro de ligne, {colonne: valeur}) pour chaque ligne non vide du CSV"""
+    reader = iter_csv_file(file)
+    try:
+        headers = reader.fieldnames or []
+    except UnicodeDecodeError:
+        raise ValueError('Le fichier CSV doit être encodé en UTF-8')
+    mapping = {header: normalize_header(header) for header in headers if header}
+    _check_headers(mapping.values())
+
+    for row in reader:
+        values = {mapping[key]: value for key, value in row.items() if key in mapping}
+        if any(values.values()):
+            yield reader.line_num, values
+
+
+def iter_excel_rows(file):
+    """
+    (numéro de ligne, {colonne: valeur}) pour chaque ligne non vide de la feuille active
+
+    Les en-têtes sont cherchés dans les 10 premières lignes (le template
+    contient un titre et des instructions au-dessus).
+    """
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValueError('Le module openpyxl n\'est pas installé. Veuillez l\'installer pour importer des fichiers Excel.')
+
+    try:
+        wb = load_workbook(file, read_only=True, data_only=True)
+    except InvalidFileException:
+        raise ValueError('Le fichier Excel est corrompu ou dans un format non supporté.')
+    except Exception as e:
+        raise ValueError(f'Erreur lors de la lecture du fichier Excel: {str(e)}')
+
+    try:
+        headers = None
+        for row_number, row in enumerate(wb.active.iter_rows(values_only=True), start=1):
+            if headers is None:
+                if row_number > 10:
+                    break
+                normalized = [normalize_header(value) if value else None for value in row]
+                if 'Nom' in normalized:
+                    _check_headers(normalized)
+                    headers = normalized
+                continue
+
+            values = {}
+            for header, value in zip(headers, row):
+                if header is None:
+                    continue
+                values[header] = value.strip() if isinstance(value, str) else value
+            if any(value not in (None, '') for value in values.values()):
+                yield row_number, values
+
+        if headers is None:
+            raise ValueError('Format de fichier Excel invalide. Veuillez utiliser le template fourni.')
+    finally:
+        wb.close()
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _number(row, column, default, cast=float):
+    """Valeur numérique d'une colonne (virgule décimale acceptée)"""
+    value = row.get(column)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    try:
+        if isinstance(value, str):
+            value = value.strip().replace(',', '.')
+        return cast(float(value))
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} invalide: "{value}"')
+
+
+def _barcode(value):
+    # Les nombres lus dans Excel arrivent en float (1234567890.0)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return _text(value) or None
+
+
+class ProductImport:
+    """
+    Import d'un fichier de produits dans une pharmacie
+
+    Exemple:
+        result = ProductImport(pharmacy_id, upsert=True).run(iter_csv_rows(file))
+        result.inserted, result.updated, result.errors
+    """
+
+    def __init__(self, pharmacy_id, upsert=False, chunk_size=None, on_chunk=None):
+        self.pharmacy_id = pharmacy_id
+        self.upsert = upsert
+        # Appelé avec l'import après chaque paquet (avancement d'une tâche de fond)
+        self.on_chunk = on_chunk
+        if chunk_size is None:
+            chunk_size = 500
+            if has_app_context():
+                chunk_size = current_app.config.get('PRODUCT_IMPORT_CHUNK_SIZE', chunk_size)
+        self.chunk_size = max(1, int(chunk_size))
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+        # Codes-barres connus : existants en base puis ajoutés par cet import
+        self._barcodes = {}
+        self._seen = {}
+
+    def _fail(self, line, product_name, message):
+        self.errors.append({'line': line, 'product': product_name, 'message': message})
+
+    def summary(self):
+        return (f'{self.inserted} produits importés, {self.updated} mis à jour, '
+                f'{len(self.errors)} lignes ignorées')
+
+    def run(self, rows):
+        """Importer les lignes (itérable de (numéro de ligne, dict)), paquet par paquet"""
+        self._barcodes = dict(db.session.execute(
+            select(Product.barcode, Product.pharmacy_id).where(Product.barcode.isnot(None))
+        ).all())
+
+        chunk = []
+        try:
+            for line, row in rows:
+                chunk.append((line, row))
+                if len(chunk) >= self.chunk_size:
+                    self._process(chunk)
+                    chunk = []
+                    if self.on_chunk:
+                        self.on_chunk(self)
+            if chunk:
+                self._process(chunk)
+        finally:
+            if self.inserted or self.updated:
+                # INSERT/UPDATE groupés : pas d'événement ORM pour les caches
+                try:
+                    catalog_index.invalidate()
+                    search_index.invalidate('products')
+                except Exception as e:
+                    print(f"Erreur invalidation catalogue après import: {str(e)}")
+        return self
+
+    # ------------------------------------------------------------------
+    # Conversion et contrôle d'un paquet
+    # ------------------------------------------------------------------
+
+    def _convert(self, row, now):
+        name = _text(row.get('Nom'))
+        if not name:
+            raise ValueError('Nom manquant')
+        selling_price = _number(row, 'Prix Vente', 0.0)
+        if selling_price <= 0:
+            raise ValueError('Le prix de vente doit être supérieur à 0')
+        return {
+            'name': name[:200],
+            'description': _text(row.get('Description')),
+            'barcode': _barcode(row.get('Code-barres')),
+            'category': _text(row.get('Forme')),
+            'unit': _text(row.get('Unité')) or 'piece',
+            'purchase_price': _number(row, 'Prix Achat', 0.0),
+            'selling_price': selling_price,
+            'wholesale_price': _number(row, 'Prix Gros', 0.0),
+            'stock_quantity': _number(row, 'Stock', 0, int),
+            'min_stock_level': _number(row, 'Stock Min', 10, int),
+            'manufacturer': _text(row.get('Fabricant')),
+            'supplier': _text(row.get('Fournisseur')),
+            'pharmacy_id': self.pharmacy_id,
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+        }
+
+    def _check_barcode(self, line, values):
+        """'insert', 'update' ou message d'erreur pour le code-barres de la ligne"""
+        barcode = values['barcode']
+        if barcode is None:
+            return 'insert'
+        if barcode in self._seen:
+            return f'Code-barres {barcode} en double dans le fichier (ligne {self._seen[barcode]})'
+        self._seen[barcode] = line
+        if barcode not in self._barcodes:
+            return 'insert'
+        if self._barcodes[barcode] != self.pharmacy_id:
+            return f'Code-barres {barcode} déjà utilisé par un produit d\'une autre pharmacie'
+        if not self.upsert:
+            return f'Code-barres {barcode} déjà existant'
+        return 'update'
+
+    def _process(self, chunk):
+        now = datetime.utcnow()
+        accepted = []
+        for line, row in chunk:
+            product_name = _text(row.get('Nom')) or '?'
+            try:
+                values = self._convert(row, now)
+            except ValueError as e:
+                self._fail(line, product_name, str(e))
+                continue
+            action = self._check_barcode(line, values)
+            if action in ('insert', 'update'):
+                accepted.append((line, values, action == 'update'))
+            else:
+                self._fail(line, product_name, action)
+
+        if not accepted:
+            return
+        try:
+            self._write(accepted)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            # Paquet refusé (code-barres créé entre-temps...) : ligne par ligne
+            # pour ne perdre que les lignes fautives
+            for item in accepted:
+                try:
+                    self._write([item])
+                    db.session.commit()
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    self._fail(item[0], item[1]['name'], str(getattr(e, 'orig', e)))
+                    continue
+                self._written([item])
+            return
+        self._written(accepted)
+
+    def _written(self, accepted):
+        for line, values, is_update in accepted:
+            if is_update:
+                self.updated += 1
+                continue
+            self.inserted += 1
+            if values['barcode'] is not None:
+                self._barcodes[values['barcode']] = self.pharmacy_id
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+
+    def _write(self, accepted):
+        """Écrire un paquet : nouveaux produits et produits à mettre à jour"""
+        inserts = [values for _, values, is_update in accepted if not is_update]
+        updates = [values for _, values, is_update in accepted if is_update]
+        table = Product.__table__
+        dialect = db.engine.dialect.name
+
+        if updates and dialect in ('mysql', 'sqlite'):
+            # Un seul INSERT multi-lignes ; les codes-barres existants (ou créés
+            # depuis la lecture des codes-barres) sont mis à jour
+            if dialect == 'mysql':
+                from sqlalchemy.dialects.mysql import insert as dialect_insert
+                stmt = dialect_insert(table)
+                stmt = stmt.on_duplicate_key_update({field: stmt.inserted[field] for field in UPDATE_FIELDS})
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+                stmt = dialect_insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.barcode],
+                    set_={field: stmt.excluded[field] for field in UPDATE_FIELDS}
+                )
+            db.session.execute(stmt, inserts + updates)
+            return
+
+        if inserts:
+            db.session.execute(insert(table), inserts)
+        if updates:
+            stmt = update(table).where(table.c.barcode == bindparam('b_barcode')).values(
+                {field: bindparam(field) for field in UPDATE_FIELDS}
+            )
+            db.session.execute(stmt, [
+                dict({field: values[field] for field in UPDATE_FIELDS}, b_barcode=values['barcode'])
+                for values in updates
+            ])
+
+
+@job_handler('import_products')
+def import_products_job(context, upload, file_ext, pharmacy_id, upsert=False):
+    """Import en tâche de fond ; les lignes refusées sont rendues dans un CSV"""
+    path = os.path.join(results_dir(), 'uploads', upload)
+    importer = ProductImport(pharmacy_id, upsert=upsert,
+                             on_chunk=lambda importer: context.progress(message=importer.summary()))
+    try:
+        with open(path, 'rb') as file:
+            importer.run(iter_csv_rows(file) if file_ext == 'csv' else iter_excel_rows(file))
+    finally:
+        os.remove(path)
+
+    if importer.errors:
+        result = context.result_path(export_filename('erreurs_import_produits', 'csv'))
+        with open(result, 'w', newline='', encoding='utf-8-sig') as output:
+            write_csv(({'Ligne': error['line'], 'Produit': error['product'], 'Erreur': error['message']}
+                       for error in importer.errors), ['Ligne', 'Produit', 'Erreur'], output)
+
+    ActivityLogger.log(
+        action='import_products',
+        module='products',
+        entity_type='product',
+        details=importer.summary(),
+        user_id=context.user_id,
+        on_commit=True
+    )
+    db.session.commit()
+    context.message = importer.summary()
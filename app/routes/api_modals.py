@@ -6,6 +6,8 @@ from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
 from app.models import db, Sale, Product, StockMovement, Task, Notification, Proforma, Supplier, ProductBatch
 from app.decorators import require_permission
+from app.sales_summary import sale_snapshot, apply_sale_change
+from app.batch_stats import batch_stats
 from datetime import datetime
 
 api_modals_bp = Blueprint('api_modals', __name__, url_prefix='/api')
@@ -17,10 +19,12 @@ def quick_edit_sale(id):
     try:
         data = request.get_json()
         sale = Sale.query.get_or_404(id)
+        summary_before = sale_snapshot(sale)
         
         sale.discount = float(data.get('discount', 0))
         sale.notes = data.get('notes', '')
         sale.total_amount = sum(item.total for item in sale.items) - sale.discount
+        apply_sale_change(summary_before, sale_snapshot(sale))
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Vente modifiée'})
@@ -107,7 +111,9 @@ def batch_details(id):
             'expiry_date': batch.expiry_date.strftime('%d/%m/%Y') if batch.expiry_date else 'N/A',
             'supplier': batch.supplier or 'N/A',
             'purchase_price': batch.purchase_price,
-            'status': batch.status
+            'status': batch.status,
+            # Compteurs des lots de la même pharmacie (en cache, voir app.batch_stats)
+            'pharmacy_stats': batch_stats.get([batch.pharmacy_id])
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -225,11 +231,12 @@ def convert_proforma(id):
             return jsonify({'success': False, 'message': 'Proforma déjà convertie'}), 400
         
         from app.models import SaleItem
-        from random import randint
+        from app.numbering import generate_invoice_number
         
         # Créer la vente
+        primary_pharmacy = current_user.get_primary_pharmacy()
         sale = Sale(
-            invoice_number=f"INV{datetime.now().strftime('%Y%m%d')}{randint(1000, 9999)}",
+            invoice_number=generate_invoice_number(primary_pharmacy.id if primary_pharmacy else None),
             customer_id=proforma.customer_id,
             user_id=current_user.id,
             total_amount=proforma.total_ttc,
@@ -238,6 +245,7 @@ def convert_proforma(id):
         )
         db.session.add(sale)
         db.session.flush()
+        apply_sale_change(None, sale_snapshot(sale))
         
         # Copier les items
         for item in proforma.items:
@@ -1,15 +1,23 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, abort
 from flask_login import login_required, current_user
 from app.models import Audit, User, db
 from app.decorators import require_permission
 from datetime import datetime, timedelta
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel
+from app.export_utils import export_to_csv, export_to_excel, iter_query
+from app.audit_store import audit_query, archive_boundary, get_audit, lookup_values
 from sqlalchemy import func, and_
 
 audits_bp = Blueprint('audits', __name__, url_prefix='/audits')
 
 
+def _date_bounds(date_from, date_to):
+    """Bornes datetime des filtres date_from / date_to (AAAA-MM-JJ, inclusifs)"""
+    start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+    end = datetime.strptime(date_to + ' 23:59:59', '%Y-%m-%d %H:%M:%S') if date_to else None
+    return start, end
+
+
 @audits_bp.route('/')
 @require_permission('view_audits')
 def index():
@@ -24,32 +32,21 @@ def index():
     date_to = request.args.get('date_to')
     search = request.args.get('search', '')
     
-    query = Audit.query
+    # Table chaude seule, sauf si la période demandée recouvre l'archive
+    query, entity = audit_query(*_date_bounds(date_from, date_to), search_text=search)
     
     # Filtres
     if user_id:
-        query = query.filter_by(user_id=user_id)
+        query = query.filter(entity.user_id == user_id)
     if action:
-        query = query.filter(Audit.action.ilike(f'%{action}%'))
+        query = query.filter(entity.action.ilike(f'%{action}%'))
     if module and module != 'all':
-        query = query.filter_by(module=module)
+        query = query.filter(entity.module == module)
     if action_type and action_type != 'all':
-        query = query.filter_by(action_type=action_type)
+        query = query.filter(entity.action_type == action_type)
     if result and result != 'all':
-        query = query.filter_by(result=result)
-    if date_from:
-        query = query.filter(Audit.created_at >= datetime.strptime(date_from, '%Y-%m-%d'))
-    if date_to:
-        query = query.filter(Audit.created_at <= datetime.strptime(date_to + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
-    if search:
-        query = query.filter(
-            db.or_(
-                Audit.action.ilike(f'%{search}%'),
-                Audit.details.ilike(f'%{search}%')
-            )
-        )
-    
-    audits = query.order_by(Audit.created_at.desc()).paginate(
+        query = query.filter(entity.result == result)
+    audits = query.order_by(entity.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
     )
     
@@ -124,13 +121,9 @@ def index():
         'manage': 'Gérer'
     }
     
-    # Récupérer TOUS les modules uniques depuis la table - sans aucun filtre
-    modules_query = db.session.query(Audit.module).distinct().filter(Audit.module.isnot(None)).order_by(Audit.module)
-    modules_db = [m[0] for m in modules_query.all()] if modules_query else []
-    
-    # Récupérer TOUS les types d'action uniques depuis la table - sans aucun filtre
-    action_types_query = db.session.query(Audit.action_type).distinct().filter(Audit.action_type.isnot(None)).order_by(Audit.action_type)
-    action_types_db = [a[0] for a in action_types_query.all()] if action_types_query else []
+    # Modules et types d'action déjà rencontrés (table audit_lookups)
+    modules_db = lookup_values('module')
+    action_types_db = lookup_values('action_type')
     
     # Combiner les valeurs de la DB avec les valeurs possibles (sans doublons)
     modules = sorted(list(set(ALL_POSSIBLE_MODULES + modules_db)))
@@ -143,6 +136,7 @@ def index():
                          action_types=action_types,
                          module_translations=MODULE_TRANSLATIONS,
                          action_type_translations=ACTION_TYPE_TRANSLATIONS,
+                         archive_boundary=None if date_from else archive_boundary(),
                          filters={
                              'user_id': user_id,
                              'action': action,
@@ -242,7 +236,9 @@ def dashboard():
 @require_permission('view_audits')
 def view(id):
     """Vue détaillée d'un audit avec comparaison avant/après"""
-    audit = Audit.query.get_or_404(id)
+    audit = get_audit(id)
+    if audit is None:
+        abort(404)
     
     # Récupérer les changements si c'est une modification
     changes = None
@@ -339,39 +335,40 @@ def export(format):
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    query = Audit.query
+    # Mêmes tables que la liste, seulement les colonnes exportées, lues par lots
+    query, entity = audit_query(*_date_bounds(date_from, date_to))
+    query = query.with_entities(
+        entity.id, entity.created_at, entity.module, entity.action, entity.action_type,
+        entity.entity_type, entity.entity_id, entity.details, entity.result, entity.ip_address,
+        User.username
+    ).outerjoin(User, User.id == entity.user_id)
     
     if user_id:
-        query = query.filter_by(user_id=user_id)
+        query = query.filter(entity.user_id == user_id)
     if module and module != 'all':
-        query = query.filter_by(module=module)
+        query = query.filter(entity.module == module)
     if action_type and action_type != 'all':
-        query = query.filter_by(action_type=action_type)
+        query = query.filter(entity.action_type == action_type)
     if result and result != 'all':
-        query = query.filter_by(result=result)
-    if date_from:
-        query = query.filter(Audit.created_at >= datetime.strptime(date_from, '%Y-%m-%d'))
-    if date_to:
-        query = query.filter(Audit.created_at <= datetime.strptime(date_to + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
+        query = query.filter(entity.result == result)
     
-    audits = query.order_by(Audit.created_at.desc()).all()
+    query = query.order_by(entity.created_at.desc())
     
     headers = ['ID', 'Date/Heure', 'Utilisateur', 'Module', 'Action', 'Type', 'Entité', 'Détails', 'Résultat', 'IP']
-    data = []
-    
-    for audit in audits:
-        data.append({
-            'ID': audit.id,
-            'Date/Heure': audit.created_at.strftime('%d/%m/%Y %H:%M:%S'),
-            'Utilisateur': audit.user.username if audit.user else 'Système',
-            'Module': audit.module or '-',
-            'Action': audit.action,
-            'Type': audit.action_type or '-',
-            'Entité': f"{audit.entity_type} #{audit.entity_id}" if audit.entity_id else '-',
-            'Détails': audit.details or '-',
-            'Résultat': audit.result,
-            'IP': audit.ip_address or '-'
-        })
+    
+    # Date/Heure à la seconde près, en texte dans les deux formats
+    data = ({
+        'ID': audit.id,
+        'Date/Heure': audit.created_at.strftime('%d/%m/%Y %H:%M:%S'),
+        'Utilisateur': audit.username or 'Système',
+        'Module': audit.module or '-',
+        'Action': audit.action,
+        'Type': audit.action_type or '-',
+        'Entité': f"{audit.entity_type} #{audit.entity_id}" if audit.entity_id else '-',
+        'Détails': audit.details or '-',
+        'Résultat': audit.result,
+        'IP': audit.ip_address or '-'
+    } for audit in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'audits', headers)
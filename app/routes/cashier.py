@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from app.decorators import require_permission
 from flask_login import login_required, current_user
-from app.models import db, CashTransaction, Sale, Payment, Audit
+from app.models import db, CashTransaction, Sale, Payment
+from app.helpers import ActivityLogger
 from datetime import datetime
 from sqlalchemy import func
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
@@ -57,14 +58,14 @@ def add_transaction():
             
             db.session.add(transaction)
             
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='cash_transaction',
+                module='cashier',
                 entity_type='cash',
                 details=f'Transaction caisse: {transaction.transaction_type}, {transaction.amount}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             
@@ -6,6 +6,7 @@ from datetime import datetime
 from sqlalchemy import func
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
 from app.export_utils import export_to_csv, export_to_excel
+from app.sales_summary import sale_snapshot, apply_sale_change
 
 credit_sales_bp = Blueprint('credit_sales', __name__, url_prefix='/credit-sales')
 
@@ -62,6 +63,7 @@ def add_payment(sale_id):
     sale = Sale.query.filter_by(id=sale_id, payment_type='credit').first_or_404()
     
     try:
+        summary_before = sale_snapshot(sale)
         data = request.get_json() if request.is_json else request.form
         
         amount = float(data.get('amount', 0))
@@ -97,6 +99,7 @@ def add_payment(sale_id):
         
         sale.calculate_remaining()
         sale.update_credit_status()
+        apply_sale_change(summary_before, sale_snapshot(sale))
         
         audit = Audit(
             user_id=current_user.id,
@@ -3,7 +3,8 @@ from app.decorators import require_permission
 from flask_login import login_required, current_user
 from app.models import db, Customer, Sale, Payment, Audit, SaleItem
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel
+from app.export_utils import export_to_csv, export_to_excel, iter_query
+from app.search import search as text_search
 from sqlalchemy import func
 
 customers_bp = Blueprint('customers', __name__, url_prefix='/customers')
@@ -102,13 +103,7 @@ def index():
     query = filter_by_pharmacy(query, Customer, pharmacy_filter)
     
     if search:
-        query = query.filter(
-            db.or_(
-                Customer.name.ilike(f'%{search}%'),
-                Customer.email.ilike(f'%{search}%'),
-                Customer.phone.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(text_search(Customer, search))
     
     if type_filter:
         query = query.filter(Customer.customer_type == type_filter)
@@ -132,34 +127,31 @@ def export(format):
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     search = request.args.get('search', '')
     
-    query = Customer.query
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Customer.id, Customer.name, Customer.email, Customer.phone, Customer.customer_type,
+        Customer.credit_limit, Customer.address
+    )
     query = filter_by_pharmacy(query, Customer, pharmacy_filter)
     
     if search:
-        query = query.filter(
-            db.or_(
-                Customer.name.ilike(f'%{search}%'),
-                Customer.email.ilike(f'%{search}%'),
-                Customer.phone.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(text_search(Customer, search))
     
-    customers = query.order_by(Customer.name).all()
+    query = query.order_by(Customer.name)
     
     headers = ['ID', 'Nom', 'Email', 'Téléphone', 'Type', 'Limite Crédit', 'Adresse', 'Pharmacie']
     
-    data = []
-    for c in customers:
-        data.append({
-            'ID': c.id,
-            'Nom': c.name,
-            'Email': c.email or '',
-            'Téléphone': c.phone or '',
-            'Type': c.customer_type,
-            'Limite Crédit': c.credit_limit,
-            'Adresse': c.address or '',
-            'Pharmacie': c.pharmacy.name if c.pharmacy else 'N/A'
-        })
+    data = ({
+        'ID': c.id,
+        'Nom': c.name,
+        'Email': c.email or '',
+        'Téléphone': c.phone or '',
+        'Type': c.customer_type,
+        'Limite Crédit': c.credit_limit,
+        'Adresse': c.address or '',
+        # Les clients ne sont pas rattachés à une pharmacie
+        'Pharmacie': 'N/A'
+    } for c in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'clients', headers)
@@ -1,20 +1,23 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, make_response, current_app, g
 from flask_login import login_required, current_user
 from app.models import db, Product, Sale, Customer, User, StockMovement
 from app.decorators import require_permission
-from sqlalchemy import func
+from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
+import time
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
 def get_user_scope():
     """Déterminer le scope d'accès de l'utilisateur"""
-    if current_user.role == 'admin':
-        return 'all'
-    elif current_user.role in ['manager', 'pharmacien']:
-        return 'pharmacy'
-    else:
-        return 'personal'
+    return current_user.auth_context.scope
+
+def get_scope_pharmacy():
+    """Pharmacie principale de l'utilisateur, chargée une seule fois par requête"""
+    if '_scope_pharmacy' not in g:
+        g._scope_pharmacy = current_user.get_primary_pharmacy()
+    return g._scope_pharmacy
 
 def filter_by_scope(query, model):
     """Filtrer une requête selon le scope de l'utilisateur"""
@@ -23,69 +26,83 @@ def filter_by_scope(query, model):
     if scope == 'all':
         return query
     
-    primary_pharmacy = current_user.get_primary_pharmacy()
+    primary_pharmacy_id = current_user.auth_context.primary_pharmacy_id
     
-    if scope == 'pharmacy' and primary_pharmacy:
+    if scope == 'pharmacy' and primary_pharmacy_id:
         if hasattr(model, 'pharmacy_id'):
-            return query.filter(model.pharmacy_id == primary_pharmacy.id)
+            return query.filter(model.pharmacy_id == primary_pharmacy_id)
     
     if scope == 'personal':
         if hasattr(model, 'user_id'):
             return query.filter(model.user_id == current_user.id)
-        elif hasattr(model, 'pharmacy_id') and primary_pharmacy:
-            return query.filter(model.pharmacy_id == primary_pharmacy.id)
+        elif hasattr(model, 'pharmacy_id') and primary_pharmacy_id:
+            return query.filter(model.pharmacy_id == primary_pharmacy_id)
     
     return query
 
-@dashboard_bp.route('/')
-@require_permission('view_dashboard')
-def index():
-    today = datetime.now().date()
-    month_start = datetime(today.year, today.month, 1).date()
-    scope = get_user_scope()
-    primary_pharmacy = current_user.get_primary_pharmacy()
+def count_if(condition):
+    """Équivalent portable de COUNT(*) FILTER (WHERE condition)"""
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+def sum_if(condition, column):
+    """Équivalent portable de SUM(column) FILTER (WHERE condition)"""
+    return func.coalesce(func.sum(case((condition, column), else_=0)), 0)
+
+def compute_kpis(today):
+    """Calculer les indicateurs du tableau de bord avec des agrégats SQL"""
+    today_start = datetime.combine(today, datetime.min.time())
+    tomorrow_start = today_start + timedelta(days=1)
+    month_start = datetime(today.year, today.month, 1)
     
-    # Requêtes filtrées selon le scope
-    products_query = Product.query.filter_by(is_active=True)
-    products_query = filter_by_scope(products_query, Product)
-    total_products = products_query.count()
+    # Produits : total, stock bas et expirés en une seule requête
+    low_stock = Product.stock_quantity <= Product.min_stock_level
+    products_query = db.session.query(
+        func.count(Product.id).label('total_products'),
+        count_if(low_stock).label('low_stock_products'),
+        count_if(Product.expiry_date < today).label('expired_products'),
+    ).filter(Product.is_active == True)
+    products_row = filter_by_scope(products_query, Product).one()
     
-    low_stock_query = Product.query.filter(
-        Product.is_active == True,
-        Product.stock_quantity <= Product.min_stock_level
-    )
-    low_stock_query = filter_by_scope(low_stock_query, Product)
-    low_stock_products = low_stock_query.count()
+    # Ventes du jour et du mois en une seule requête (plage indexée sur sale_date)
+    sales_query = db.session.query(
+        sum_if(Sale.sale_date >= today_start, Sale.total_amount).label('today_revenue'),
+        func.coalesce(func.sum(Sale.total_amount), 0).label('month_revenue'),
+    ).filter(Sale.sale_date >= month_start, Sale.sale_date < tomorrow_start)
+    sales_row = filter_by_scope(sales_query, Sale).one()
     
-    expired_query = Product.query.filter(
-        Product.is_active == True,
-        Product.expiry_date < today
+    # Paiements en attente (toutes périodes confondues)
+    pending_query = db.session.query(func.count(Sale.id)).filter(
+        Sale.payment_status.in_(['pending', 'partial'])
     )
-    expired_query = filter_by_scope(expired_query, Product)
-    expired_products = expired_query.count()
-    
-    customers_query = Customer.query.filter_by(is_active=True)
-    total_customers = customers_query.count()
+    pending_payments = filter_by_scope(pending_query, Sale).scalar()
     
-    # Ventes du jour
-    today_sales_query = Sale.query.filter(func.date(Sale.sale_date) == today)
-    today_sales_query = filter_by_scope(today_sales_query, Sale)
-    today_sales = today_sales_query.all()
-    today_revenue = sum(sale.total_amount for sale in today_sales)
+    total_customers = db.session.query(func.count(Customer.id)).filter(
+        Customer.is_active == True
+    ).scalar()
     
-    # Ventes du mois
-    month_sales_query = Sale.query.filter(func.date(Sale.sale_date) >= month_start)
-    month_sales_query = filter_by_scope(month_sales_query, Sale)
-    month_sales = month_sales_query.all()
-    month_revenue = sum(sale.total_amount for sale in month_sales)
+    return {
+        'total_products': int(products_row.total_products or 0),
+        'low_stock_products': int(products_row.low_stock_products or 0),
+        'expired_products': int(products_row.expired_products or 0),
+        'total_customers': int(total_customers or 0),
+        'today_revenue': float(sales_row.today_revenue or 0),
+        'month_revenue': float(sales_row.month_revenue or 0),
+        'pending_payments': int(pending_payments or 0),
+    }
+
+@dashboard_bp.route('/')
+@require_permission('view_dashboard')
+def index():
+    started = time.perf_counter()
+    today = datetime.now().date()
+    scope = get_user_scope()
+    primary_pharmacy = get_scope_pharmacy()
     
-    # Paiements en attente
-    pending_query = Sale.query.filter(Sale.payment_status.in_(['pending', 'partial']))
-    pending_query = filter_by_scope(pending_query, Sale)
-    pending_payments = pending_query.count()
+    kpis = compute_kpis(today)
+    kpis_ms = (time.perf_counter() - started) * 1000
     
     # Ventes récentes
-    recent_sales_query = Sale.query
+    recent_sales_query = Sale.query.options(joinedload(Sale.customer))
     recent_sales_query = filter_by_scope(recent_sales_query, Sale)
     recent_sales = recent_sales_query.order_by(Sale.sale_date.desc()).limit(10).all()
     
@@ -96,16 +113,23 @@ def index():
     )
     low_stock_items_query = filter_by_scope(low_stock_items_query, Product)
     low_stock_items = low_stock_items_query.order_by(Product.stock_quantity).limit(10).all()
+    queries_ms = (time.perf_counter() - started) * 1000
     
-    return render_template('dashboard/index.html',
-                         total_products=total_products,
-                         low_stock_products=low_stock_products,
-                         expired_products=expired_products,
-                         total_customers=total_customers,
-                         today_revenue=today_revenue,
-                         month_revenue=month_revenue,
-                         pending_payments=pending_payments,
+    response = make_response(render_template('dashboard/index.html',
                          recent_sales=recent_sales,
                          low_stock_items=low_stock_items,
                          scope=scope,
-                         pharmacy_name=primary_pharmacy.name if primary_pharmacy else 'Toutes')
+                         pharmacy_name=primary_pharmacy.name if primary_pharmacy else 'Toutes',
+                         **kpis))
+    total_ms = (time.perf_counter() - started) * 1000
+    
+    # Instrumentation : durées exposées au navigateur et alerte si budget dépassé
+    response.headers['Server-Timing'] = (
+        f'kpis;dur={kpis_ms:.1f}, queries;dur={queries_ms:.1f}, total;dur={total_ms:.1f}'
+    )
+    budget_ms = current_app.config.get('DASHBOARD_LATENCY_BUDGET_MS', 300)
+    if total_ms > budget_ms:
+        current_app.logger.warning(
+            f'Dashboard lent: {total_ms:.1f} ms (budget {budget_ms} ms, kpis {kpis_ms:.1f} ms)'
+        )
+    return response
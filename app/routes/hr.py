@@ -1,10 +1,11 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from app.decorators import require_permission
 from flask_login import login_required, current_user
-from app.models import db, Employee, Absence, SalaryPayment, LeaveRequest, CreditRequest, User, Audit, ExchangeRate
+from app.models import db, Employee, Absence, SalaryPayment, LeaveRequest, CreditRequest, User, Audit
 from datetime import datetime, date
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
 from app.export_utils import export_to_csv, export_to_excel
+from app.currency_utils import get_usd_cdf_rate
 
 hr_bp = Blueprint('hr', __name__, url_prefix='/hr')
 
@@ -451,8 +452,7 @@ def salaries():
     payments = payments_query.paginate(page=page, per_page=6, error_out=False)
     employees = get_accessible_employees()
     # Taux de change pour affichage équivalents
-    exchange_rate = ExchangeRate.query.filter_by(from_currency='USD', to_currency='CDF').first()
-    rate = exchange_rate.rate if exchange_rate else 2800
+    rate = get_usd_cdf_rate()
     return render_template('hr/salaries.html', payments=payments, employees=employees, exchange_rate=rate)
 
 @hr_bp.route('/pay-salary', methods=['GET', 'POST'])
@@ -511,8 +511,7 @@ def pay_salary():
     current_period = datetime.now().strftime('%Y-%m')
     today = datetime.now().strftime('%Y-%m-%d')
     # Taux de change pour équivalents
-    exchange_rate = ExchangeRate.query.filter_by(from_currency='USD', to_currency='CDF').first()
-    rate = exchange_rate.rate if exchange_rate else 2800
+    rate = get_usd_cdf_rate()
     return render_template('hr/pay_salary.html', employees=employees, current_period=current_period, today=today, exchange_rate=rate)
 
 @hr_bp.route('/leave-requests')
@@ -615,8 +614,7 @@ def credit_requests():
     requests = requests_query.paginate(page=page, per_page=6, error_out=False)
     employees = get_accessible_employees()
     # Taux de change pour équivalents
-    exchange_rate = ExchangeRate.query.filter_by(from_currency='USD', to_currency='CDF').first()
-    rate = exchange_rate.rate if exchange_rate else 2800
+    rate = get_usd_cdf_rate()
     return render_template('hr/credit_requests.html', requests=requests, employees=employees, exchange_rate=rate)
 
 @hr_bp.route('/add-credit-request', methods=['GET', 'POST'])
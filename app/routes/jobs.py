@@ -0,0 +1,42 @@
+from flask import Blueprint, render_template, jsonify, send_file, abort
+from flask_login import login_required, current_user
+from app.models import db, Job
+from app.jobs import job_payload, results_dir
+import os
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+def get_job_or_404(id):
+    """Tâche de l'utilisateur courant (l'admin voit toutes les tâches)"""
+    job = db.session.get(Job, id)
+    if job is None:
+        abort(404)
+    if job.user_id != current_user.id and not current_user.auth_context.is_admin:
+        abort(403)
+    return job
+
+
+@jobs_bp.route('/')
+@login_required
+def index():
+    """Traitements en arrière-plan de l'utilisateur (50 plus récents)"""
+    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.id.desc()).limit(50).all()
+    return render_template('jobs/index.html', jobs=[job_payload(job) for job in jobs])
+
+
+@jobs_bp.route('/<int:id>')
+@login_required
+def status(id):
+    """État d'une tâche (interrogé par la page jusqu'à la fin de la tâche)"""
+    return jsonify(job_payload(get_job_or_404(id)))
+
+
+@jobs_bp.route('/<int:id>/download')
+@login_required
+def download(id):
+    job = get_job_or_404(id)
+    path = os.path.join(results_dir(), job.result_file) if job.result_file else None
+    if job.status != 'done' or path is None or not os.path.exists(path):
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=job.result_name or job.result_file)
@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app, Response
 from flask_login import login_required, current_user
 from app.models import db, Notification, User, Audit
 from app.decorators import require_permission
+from app.helpers.notification_hub import notification_hub, notification_payload
 from datetime import datetime
+import json
+import queue
+import time
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
 from app.export_utils import export_to_csv, export_to_excel
 
@@ -86,15 +90,61 @@ def recent():
         )
     ).order_by(Notification.created_at.desc()).limit(5).all()
     
-    return jsonify([{
-        'id': n.id,
-        'title': n.title,
-        'message': n.message,
-        'type': n.type,
-        'priority': n.priority,
-        'read': n.read_at is not None,
-        'created_at': n.created_at.strftime('%d/%m/%Y %H:%M')
-    } for n in notifications])
+    return jsonify([notification_payload(n) for n in notifications])
+
+@notifications_bp.route('/stream')
+@login_required
+def stream():
+    """Flux SSE des nouvelles notifications de l'utilisateur
+
+    Le flux est fermé après NOTIFICATION_STREAM_TIMEOUT secondes ; le
+    navigateur se reconnecte seul en envoyant Last-Event-ID. Nécessite des
+    workers threadés (gunicorn --threads / gthread ou gevent) : désactivé
+    tant que NOTIFICATION_SSE_ENABLED n'est pas vrai.
+    """
+    if not current_app.config.get('NOTIFICATION_SSE_ENABLED'):
+        # 204 : EventSource arrête de se reconnecter
+        return '', 204
+    
+    user_id = current_user.id
+    keepalive = current_app.config.get('NOTIFICATION_KEEPALIVE', 15)
+    timeout = current_app.config.get('NOTIFICATION_STREAM_TIMEOUT', 300)
+    
+    subscription = notification_hub.subscribe(user_id)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    backlog = notification_hub.since(last_event_id, user_id) if last_event_id else []
+    
+    def format_event(payload):
+        return f"id: {payload['id']}\nevent: notification\ndata: {json.dumps(payload)}\n\n"
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            sent = last_event_id or 0
+            for payload in backlog:
+                sent = payload['id']
+                yield format_event(payload)
+            
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    payload = subscription.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                # Déjà envoyée depuis le rattrapage
+                if payload['id'] <= sent:
+                    continue
+                sent = payload['id']
+                yield format_event(payload)
+        finally:
+            notification_hub.unsubscribe(subscription)
+    
+    # Le générateur n'utilise pas la session : la connexion est rendue dès la réponse
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @notifications_bp.route('/mark-read/<int:id>', methods=['POST'])
 @login_required
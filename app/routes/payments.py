@@ -1,9 +1,11 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from app.decorators import require_permission
 from flask_login import login_required, current_user
-from app.models import db, Payment, Sale, Customer, Audit, SalePayment, ExchangeRate
+from app.models import db, Payment, Sale, Customer, Audit, SalePayment, Pharmacy
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel
+from app.export_utils import export_to_csv, export_to_excel, iter_query
+from app.currency_utils import get_usd_cdf_rate
+from app.sales_summary import sale_snapshot, apply_sale_change
 
 payments_bp = Blueprint('payments', __name__, url_prefix='/payments')
 
@@ -38,11 +40,13 @@ def quick_record():
         db.session.add(payment)
         
         # Mettre à jour le statut de la vente
+        summary_before = sale_snapshot(sale)
         sale.paid_amount += amount
         if sale.paid_amount >= sale.total_amount:
             sale.payment_status = 'paid'
         else:
             sale.payment_status = 'partial'
+        apply_sale_change(summary_before, sale_snapshot(sale))
         
         # Audit
         audit = Audit(
@@ -90,22 +94,26 @@ def index():
 def export(format):
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     
-    query = Payment.query.join(Sale)
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Payment.payment_date, Payment.amount, Payment.payment_method, Payment.reference,
+        Sale.invoice_number, Customer.name.label('customer_name'), Pharmacy.name.label('pharmacy_name')
+    ).join(Sale, Sale.id == Payment.sale_id).outerjoin(
+        Customer, Customer.id == Payment.customer_id
+    ).outerjoin(Pharmacy, Pharmacy.id == Sale.pharmacy_id)
     query = filter_by_pharmacy(query, Sale, pharmacy_filter)
-    payments = query.order_by(Payment.payment_date.desc()).all()
+    query = query.order_by(Payment.payment_date.desc())
     
     headers = ['Date', 'Facture', 'Client', 'Montant', 'Méthode', 'Référence', 'Pharmacie']
-    data = []
-    for p in payments:
-        data.append({
-            'Date': p.payment_date.strftime('%d/%m/%Y %H:%M'),
-            'Facture': p.sale.invoice_number,
-            'Client': p.customer.name if p.customer else 'Anonyme',
-            'Montant': p.amount,
-            'Méthode': p.payment_method,
-            'Référence': p.reference or '',
-            'Pharmacie': p.sale.pharmacy.name if p.sale.pharmacy else 'N/A'
-        })
+    data = ({
+        'Date': p.payment_date,
+        'Facture': p.invoice_number,
+        'Client': p.customer_name or 'Anonyme',
+        'Montant': p.amount,
+        'Méthode': p.payment_method,
+        'Référence': p.reference or '',
+        'Pharmacie': p.pharmacy_name or 'N/A'
+    } for p in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'paiements', headers)
@@ -147,6 +155,7 @@ def record(sale_id):
             )
             
             # Mettre à jour les montants
+            summary_before = sale_snapshot(sale)
             sale.paid_amount += amount
             sale.remaining_amount = sale.total_amount - sale.paid_amount
             
@@ -158,6 +167,7 @@ def record(sale_id):
             else:
                 sale.payment_status = 'partial'
                 sale.credit_status = 'partially_paid'
+            apply_sale_change(summary_before, sale_snapshot(sale))
             
             db.session.add(payment)
             
@@ -186,8 +196,7 @@ def record(sale_id):
             flash(f'Erreur: {str(e)}', 'danger')
     
     # Taux de change actif pour l'affichage
-    exchange_rate = ExchangeRate.query.filter_by(from_currency='USD', to_currency='CDF').first()
-    rate = exchange_rate.rate if exchange_rate else 2800
+    rate = get_usd_cdf_rate()
     return render_template('payments/record.html', sale=sale, exchange_rate=rate)
 
 @payments_bp.route('/view/<int:id>')
@@ -6,6 +6,7 @@ from datetime import datetime
 from sqlalchemy import func
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
 from app.export_utils import export_to_csv, export_to_excel
+from app.pharmacy_metrics import pharmacy_metrics
 
 pharmacies_bp = Blueprint('pharmacies', __name__, url_prefix='/pharmacies')
 
@@ -260,27 +261,7 @@ def remove_user(pharmacy_id, user_id):
 @pharmacies_bp.route('/stats')
 @require_permission('view_reports')
 def stats():
-    pharmacies = Pharmacy.query.filter_by(is_active=True).all()
-    
-    pharmacy_stats = []
-    for pharmacy in pharmacies:
-        total_sales = db.session.query(func.sum(Sale.total_amount)).filter_by(pharmacy_id=pharmacy.id).scalar() or 0
-        sales_count = Sale.query.filter_by(pharmacy_id=pharmacy.id).count()
-        products_count = Product.query.filter_by(pharmacy_id=pharmacy.id, is_active=True).count()
-        users_count = UserPharmacy.query.filter_by(pharmacy_id=pharmacy.id).count()
-        
-        pharmacy_stats.append({
-            'pharmacy': pharmacy,
-            'total_revenue': total_sales,
-            'sales_count': sales_count,
-            'products_count': products_count,
-            'users_count': users_count,
-            'target_progress': (total_sales / pharmacy.revenue_target * 100) if pharmacy.revenue_target > 0 else 0
-        })
-    
-    pharmacy_stats.sort(key=lambda x: x['total_revenue'], reverse=True)
-    
-    return render_template('pharmacies/stats.html', pharmacy_stats=pharmacy_stats)
+    return render_template('pharmacies/stats.html', pharmacy_stats=pharmacy_metrics())
 
 @pharmacies_bp.route('/toggle-status/<int:id>', methods=['POST'])
 @require_permission('manage_settings')
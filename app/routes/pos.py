@@ -1,73 +1,64 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from flask_login import login_required, current_user
-from app.models import db, Product, Customer, Sale, SaleItem, Payment, StockMovement, Audit, TempSale, ProductBatch, BatchMovement, ExchangeRate
+from app.models import db, Product, Customer, Sale, SaleItem, Payment, StockMovement, TempSale, BatchMovement, \
+    User, UserPharmacy, Notification, AuthContext
+from app.helpers import ActivityLogger
 from app.decorators import require_permission
 from app.pharmacy_utils import filter_by_pharmacy
-from datetime import datetime
-from sqlalchemy import and_
-import random
-import string
+from app.currency_utils import get_usd_cdf_rate
+from app.sales_summary import sale_snapshot, apply_sale_change
+from app.stock_utils import FefoAllocator, StockLedger
+from app.search import search as text_search
+from app.catalog_index import catalog_index
+from app import numbering
 import json
 
 pos_bp = Blueprint('pos', __name__, url_prefix='/pos')
 
-def generate_invoice_number():
-    date_str = datetime.now().strftime('%Y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f'INV-{date_str}-{random_str}'
+def generate_invoice_number(pharmacy_id=None):
+    return numbering.generate_invoice_number(pharmacy_id)
+
+
+def notify_temp_sale_validators(temp_sale):
+    """Notifier les validateurs (manage_cashier) de la pharmacie d'une vente en attente"""
+    if not temp_sale.pharmacy_id:
+        return
+    
+    users = User.query.join(UserPharmacy, UserPharmacy.user_id == User.id).filter(
+        UserPharmacy.pharmacy_id == temp_sale.pharmacy_id,
+        User.is_active == True,
+        User.id != temp_sale.created_by
+    ).all()
+    
+    for user in users:
+        # Permissions seules : pas besoin des pharmacies de chaque utilisateur
+        if not AuthContext.build(user, assignments=()).has_permission('manage_cashier'):
+            continue
+        db.session.add(Notification(
+            type='temp_sale',
+            title='Vente en attente de validation',
+            message=f'{current_user.full_name or current_user.username} a créé la vente {temp_sale.reference} '
+                    f'({temp_sale.total_amount:.2f} $)',
+            requester_id=temp_sale.created_by,
+            target_admin_id=user.id,
+            priority='high',
+            reference_type='temp_sale',
+            reference_id=temp_sale.id
+        ))
 
 
 def get_best_batch_fefo(product_id, pharmacy_id, quantity_needed):
     """
     Sélectionner les meilleurs lots selon FEFO (First Expired First Out)
     
-    Args:
-        product_id: ID du produit
-        pharmacy_id: ID de la pharmacie
-        quantity_needed: Quantité nécessaire
+    Pour un panier complet, utiliser directement FefoAllocator qui charge
+    les lots de tous les produits en une seule requête.
     
     Returns:
         Liste de tuples (batch, quantity_to_take) ou None si stock insuffisant
     """
-    # Récupérer tous les lots actifs du produit, triés par date d'expiration (FEFO)
-    available_batches = ProductBatch.query.filter(
-        and_(
-            ProductBatch.product_id == product_id,
-            ProductBatch.pharmacy_id == pharmacy_id,
-            ProductBatch.status == 'active',
-            ProductBatch.quantity > 0,
-            ProductBatch.is_active == True
-        )
-    ).order_by(
-        ProductBatch.expiry_date.asc(),  # Plus ancien expire en premier
-        ProductBatch.received_date.asc()  # Si même expiration, plus ancien reçu en premier
-    ).all()
-    
-    if not available_batches:
-        return None
-    
-    # Calculer quantité totale disponible
-    total_available = sum(batch.quantity for batch in available_batches)
-    if total_available < quantity_needed:
-        return None  # Stock insuffisant
-    
-    # Répartir la quantité sur les lots selon FEFO
-    batches_to_use = []
-    remaining_quantity = quantity_needed
-    
-    for batch in available_batches:
-        if remaining_quantity <= 0:
-            break
-        
-        # Ne pas utiliser les lots expirés
-        if batch.is_expired:
-            continue
-        
-        quantity_from_batch = min(batch.quantity, remaining_quantity)
-        batches_to_use.append((batch, quantity_from_batch))
-        remaining_quantity -= quantity_from_batch
-    
-    return batches_to_use if remaining_quantity <= 0 else None
+    allocator = FefoAllocator([product_id], pharmacy_id, lock=False)
+    return allocator.allocate(product_id, quantity_needed)
 
 @pos_bp.route('/')
 @require_permission('manage_sales')
@@ -80,39 +71,46 @@ def index():
     customers = Customer.query.filter_by(is_active=True).all()
     
     # Récupérer le taux de change actif
-    exchange_rate = ExchangeRate.query.filter_by(
-        from_currency='USD',
-        to_currency='CDF'
-    ).first()
-    
-    rate = exchange_rate.rate if exchange_rate else 2800  # Valeur par défaut
+    rate = get_usd_cdf_rate()
     
     return render_template('pos/index.html', products=products, customers=customers, exchange_rate=rate)
 
 @pos_bp.route('/search-product')
 @require_permission('manage_sales')
 def search_product():
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
     
     if not query:
         return jsonify([])
     
-    # Créer la requête de base
+    # Catalogue en mémoire du worker (même portée que filter_by_pharmacy)
+    catalog = catalog_index.for_user(current_user)
+    
+    # Scan de code-barres : réponse sans requête
+    product = catalog.barcode(query)
+    if product is not None:
+        return jsonify([product])
+    
+    # Saisie : débuts de nom / de mot / de code-barres
+    found = catalog.prefix(query, limit=20)
+    if len(found) >= 20:
+        return jsonify(found)
+    
+    # Compléter avec la recherche texte (milieu de nom, catégorie)
     products_query = Product.query.filter(
         Product.is_active == True,
-        db.or_(
-            Product.name.ilike(f'%{query}%'),
-            Product.barcode.ilike(f'%{query}%')
-        )
+        text_search(Product, query)
     )
+    if found:
+        products_query = products_query.filter(Product.id.notin_([p['id'] for p in found]))
     
     # Filtrer selon le scope utilisateur (pharmacy ou personal)
     products_query = filter_by_pharmacy(products_query, Product)
     
     # Appliquer la limite APRÈS le filtrage
-    products = products_query.limit(20).all()
+    products = products_query.limit(20 - len(found)).all()
     
-    return jsonify([{
+    return jsonify(found + [{
         'id': p.id,
         'name': p.name,
         'barcode': p.barcode,
@@ -141,10 +139,11 @@ def create_sale():
             return jsonify({'success': False, 'message': 'Aucun article dans la vente'}), 400
         
         primary_pharmacy = current_user.get_primary_pharmacy()
+        pharmacy_id = primary_pharmacy.id if primary_pharmacy else None
         
         # Si vendeur : créer vente temporaire en attente de validation
         if current_user.role == 'vendeur':
-            reference = generate_invoice_number()
+            reference = numbering.generate_temp_sale_reference(pharmacy_id)
             
             total_amount = sum(item['quantity'] * item['price'] for item in items)
             
@@ -162,6 +161,10 @@ def create_sale():
             )
             
             db.session.add(temp_sale)
+            db.session.flush()
+            
+            # Poussée aux validateurs connectés (flux SSE) après le commit
+            notify_temp_sale_validators(temp_sale)
             db.session.commit()
             
             return jsonify({
@@ -173,7 +176,7 @@ def create_sale():
             })
         
         # Caissier/Manager/Admin : créer vente directement
-        invoice_number = generate_invoice_number()
+        invoice_number = generate_invoice_number(pharmacy_id)
         
         sale = Sale(
             invoice_number=invoice_number,
@@ -185,14 +188,24 @@ def create_sale():
             notes=notes
         )
         
-        total_amount = 0
-        for item_data in items:
-            product = Product.query.get(item_data['product_id'])
+        # Charger produits et lots (verrouillés) de tout le panier en deux requêtes
+        allocator = FefoAllocator([item['product_id'] for item in items], pharmacy_id)
+        ledger = StockLedger()
+        batch_movements = []
+        
+        lines = []
+        for line, item_data in enumerate(items, start=1):
+            product = allocator.get_product(item_data['product_id'])
             if not product:
                 return jsonify({'success': False, 'message': f'Produit introuvable'}), 404
-            
-            if product.stock_quantity < item_data['quantity']:
-                return jsonify({'success': False, 'message': f'Stock insuffisant pour {product.name}'}), 400
+            lines.append((line, product, item_data['quantity']))
+        
+        # Déduire le stock des produits (UPDATE conditionnels atomiques, par id croissant)
+        decremented = ledger.decrement_products(lines)
+        
+        total_amount = 0
+        for line, item_data in enumerate(items, start=1):
+            product = allocator.get_product(item_data['product_id'])
             
             item_total = item_data['quantity'] * item_data['price']
             total_amount += item_total
@@ -205,21 +218,16 @@ def create_sale():
             )
             sale.items.append(sale_item)
             
-            # Déduire le stock du produit
-            product.stock_quantity -= item_data['quantity']
+            if line not in decremented:
+                continue
             
             # FEFO: Sélectionner les meilleurs lots et enregistrer les mouvements
-            batches_to_use = get_best_batch_fefo(
-                product.id,
-                primary_pharmacy.id if primary_pharmacy else None,
-                item_data['quantity']
-            )
+            batches_to_use = allocator.allocate(product.id, item_data['quantity'])
             
             if batches_to_use:
-                # Déduire des lots selon FEFO
+                # Déduire des lots selon FEFO (statut 'depleted' si épuisé)
                 for batch, quantity_from_batch in batches_to_use:
-                    batch.quantity -= quantity_from_batch
-                    batch.update_status()  # Mettre à jour le statut si épuisé
+                    ledger.decrement_batch(line, batch, quantity_from_batch, product.name)
                     
                     # Enregistrer mouvement de lot
                     batch_movement = BatchMovement(
@@ -227,11 +235,12 @@ def create_sale():
                         movement_type='sale',
                         quantity=quantity_from_batch,
                         reference_type='sale',
-                        reference_id=None,  # Sera mis à jour après commit
+                        reference_id=None,  # Sera mis à jour après flush
                         user_id=current_user.id,
                         notes=f'Vente {invoice_number} - {product.name}'
                     )
                     db.session.add(batch_movement)
+                    batch_movements.append(batch_movement)
             
             # Créer mouvement de stock global
             movement = StockMovement(
@@ -244,6 +253,14 @@ def create_sale():
             )
             db.session.add(movement)
         
+        if not ledger.ok:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': ledger.failures[0]['message'],
+                'failures': ledger.failures
+            }), 409
+        
         sale.total_amount = total_amount - discount
         sale.paid_amount = paid_amount
         sale.payment_type = payment_type
@@ -269,15 +286,11 @@ def create_sale():
         
         db.session.add(sale)
         db.session.flush()
+        apply_sale_change(None, sale_snapshot(sale))
         
         # Mettre à jour les reference_id des mouvements de lots avec le sale.id
-        BatchMovement.query.filter(
-            and_(
-                BatchMovement.reference_type == 'sale',
-                BatchMovement.reference_id == None,
-                BatchMovement.user_id == current_user.id
-            )
-        ).update({'reference_id': sale.id}, synchronize_session='fetch')
+        for batch_movement in batch_movements:
+            batch_movement.reference_id = sale.id
         
         if paid_amount > 0:
             payment = Payment(
@@ -288,15 +301,15 @@ def create_sale():
             )
             db.session.add(payment)
         
-        audit = Audit(
-            user_id=current_user.id,
+        ActivityLogger.log(
             action='create_sale',
+            module='pos',
             entity_type='sale',
             entity_id=sale.id,
             details=f'Vente créée: {invoice_number}, Total: {sale.total_amount}',
-            ip_address=request.remote_addr
+            user_id=current_user.id,
+            on_commit=True
         )
-        db.session.add(audit)
         
         db.session.commit()
         
@@ -1,13 +1,22 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from app.decorators import require_permission
 from flask_login import login_required, current_user
-from app.models import db, Product, ProductBatch, Audit, Pharmacy
+from app.models import db, Product, ProductBatch, Pharmacy
+from app.helpers import ActivityLogger
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel, parse_csv_file, validate_import_data
+from app.export_utils import export_response, iter_query
+from app.product_import import ProductImport, iter_csv_rows, iter_excel_rows
+from app.jobs import enqueue, enqueue_export, job_started_response, register_export, results_dir, wants_async
+from app.search import search as text_search
 from datetime import datetime
+import os
+import uuid
 
 products_bp = Blueprint('products', __name__, url_prefix='/products')
 
+# Erreurs de lignes affichées après un import (messages flash : cookie de session)
+IMPORT_ERRORS_SHOWN = 10
+
 @products_bp.route('/quick-view/<int:id>')
 @login_required
 def quick_view(id):
@@ -46,13 +55,7 @@ def index():
     query = filter_by_pharmacy(query, Product, pharmacy_filter)
     
     if search:
-        query = query.filter(
-            db.or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.barcode.ilike(f'%{search}%'),
-                Product.category.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(text_search(Product, search))
     
     products = query.order_by(Product.created_at.desc()).paginate(
         page=page, per_page=6, error_out=False
@@ -97,15 +100,15 @@ def add():
             db.session.add(product)
             db.session.flush()
             
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='create_product',
+                module='products',
                 entity_type='product',
                 entity_id=product.id,
                 details=f'Produit créé: {product.name}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             
@@ -170,15 +173,15 @@ def add_multiple():
                     db.session.flush()
                     
                     # Audit
-                    audit = Audit(
-                        user_id=current_user.id,
+                    ActivityLogger.log(
                         action='create_product',
+                        module='products',
                         entity_type='product',
                         entity_id=product.id,
                         details=f'Produit créé (ajout multiple): {product.name}',
-                        ip_address=request.remote_addr
+                        user_id=current_user.id,
+                        on_commit=True
                     )
-                    db.session.add(audit)
                     
                     added_count += 1
                     
@@ -226,15 +229,15 @@ def edit(id):
             if expiry_date_str:
                 product.expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
             
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='update_product',
+                module='products',
                 entity_type='product',
                 entity_id=product.id,
                 details=f'Produit modifié: {product.name}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             
@@ -254,15 +257,15 @@ def delete(id):
     try:
         product.is_active = False
         
-        audit = Audit(
-            user_id=current_user.id,
+        ActivityLogger.log(
             action='delete_product',
+            module='products',
             entity_type='product',
             entity_id=product.id,
             details=f'Produit supprimé: {product.name}',
-            ip_address=request.remote_addr
+            user_id=current_user.id,
+            on_commit=True
         )
-        db.session.add(audit)
         
         db.session.commit()
         flash('Produit supprimé avec succès!', 'success')
@@ -302,56 +305,60 @@ def alerts():
                          pharmacies=pharmacies,
                          pharmacy_filter=pharmacy_filter)
 
-@products_bp.route('/export/<format>')
-@require_permission('manage_products')
-def export(format):
-    """Exporte la liste des produits en CSV ou Excel"""
-    pharmacy_filter = request.args.get('pharmacy_id', 'all')
-    search = request.args.get('search', '')
-    
-    query = Product.query.filter_by(is_active=True)
+@register_export('products')
+def products_export(args):
+    """Produits actifs visibles par l'utilisateur (filtres pharmacy_id, search)"""
+    pharmacy_filter = args.get('pharmacy_id', 'all')
+    search = args.get('search', '')
+    
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Product.id, Product.name, Product.barcode, Product.category, Product.purchase_price,
+        Product.selling_price, Product.wholesale_price, Product.stock_quantity,
+        Product.min_stock_level, Product.unit, Product.manufacturer,
+        Pharmacy.name.label('pharmacy_name')
+    ).outerjoin(Pharmacy, Pharmacy.id == Product.pharmacy_id).filter(Product.is_active == True)
     query = filter_by_pharmacy(query, Product, pharmacy_filter)
     
     if search:
-        query = query.filter(
-            db.or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.barcode.ilike(f'%{search}%'),
-                Product.category.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(text_search(Product, search))
     
-    products = query.order_by(Product.name).all()
+    query = query.order_by(Product.name)
     
     # Préparer les données
     headers = ['ID', 'Nom', 'Code-barres', 'Forme', 'Prix Achat', 'Prix Vente', 
                'Prix Gros', 'Stock', 'Stock Min', 'Unité', 'Fabricant', 'Pharmacie']
     
-    data = []
-    for p in products:
-        pharmacy_name = p.pharmacy.name if p.pharmacy else 'N/A'
-        data.append({
-            'ID': p.id,
-            'Nom': p.name,
-            'Code-barres': p.barcode or '',
-            'Forme': p.category or '',
-            'Prix Achat': p.purchase_price,
-            'Prix Vente': p.selling_price,
-            'Prix Gros': p.wholesale_price,
-            'Stock': p.stock_quantity,
-            'Stock Min': p.min_stock_level,
-            'Unité': p.unit,
-            'Fabricant': p.manufacturer or '',
-            'Pharmacie': pharmacy_name
-        })
-    
-    if format == 'csv':
-        return export_to_csv(data, 'produits', headers)
-    elif format == 'excel':
-        return export_to_excel(data, 'produits', headers, 'Produits')
-    else:
+    data = ({
+        'ID': p.id,
+        'Nom': p.name,
+        'Code-barres': p.barcode or '',
+        'Forme': p.category or '',
+        'Prix Achat': p.purchase_price,
+        'Prix Vente': p.selling_price,
+        'Prix Gros': p.wholesale_price,
+        'Stock': p.stock_quantity,
+        'Stock Min': p.min_stock_level,
+        'Unité': p.unit,
+        'Fabricant': p.manufacturer or '',
+        'Pharmacie': p.pharmacy_name or 'N/A'
+    } for p in iter_query(query))
+    
+    return {'filename': 'produits', 'headers': headers, 'rows': data, 'sheet_name': 'Produits'}
+
+@products_bp.route('/export/<format>')
+@require_permission('manage_products')
+def export(format):
+    """Exporte la liste des produits en CSV ou Excel (async=1 : en tâche de fond)"""
+    if format not in ('csv', 'excel'):
         flash('Format non supporté', 'danger')
         return redirect(url_for('products.index'))
+    
+    if wants_async():
+        job = enqueue_export('products', format, request.args, f'Export des produits ({format.upper()})', current_user.id)
+        return job_started_response(job)
+    
+    return export_response(products_export(request.args), format)
 
 @products_bp.route('/import/template')
 @require_permission('manage_products')
@@ -499,208 +506,65 @@ def import_products():
             flash('Seuls les fichiers CSV et Excel sont acceptés', 'danger')
             return redirect(url_for('products.import_products'))
         
+        upsert = request.form.get('upsert') == '1'
+        if wants_async():
+            # Fichier gardé jusqu'à l'exécution de la tâche (supprimé ensuite)
+            upload = f'{uuid.uuid4().hex}.{file_ext}'
+            upload_dir = os.path.join(results_dir(), 'uploads')
+            os.makedirs(upload_dir, exist_ok=True)
+            file.save(os.path.join(upload_dir, upload))
+            job = enqueue('import_products', {
+                'upload': upload,
+                'file_ext': file_ext,
+                'pharmacy_id': current_user.auth_context.primary_pharmacy_id,
+                'upsert': upsert
+            }, f'Import de produits ({file.filename})', current_user.id)
+            return job_started_response(job)
+        
+        if file_ext == 'csv':
+            rows = iter_csv_rows(file)
+        else:
+            rows = iter_excel_rows(file)
+        
+        importer = ProductImport(current_user.auth_context.primary_pharmacy_id, upsert=upsert)
+        failed = False
         try:
-            # Parser le fichier
-            if file_ext == 'csv':
-                data = parse_csv_file(file)
-            else:
-                # Parser Excel avec gestion d'erreurs améliorée
-                try:
-                    from openpyxl import load_workbook
-                    from openpyxl.utils.exceptions import InvalidFileException
-                except ImportError:
-                    flash('Le module openpyxl n\'est pas installé. Veuillez l\'installer pour importer des fichiers Excel.', 'danger')
-                    return redirect(url_for('products.import_products'))
-                
-                try:
-                    wb = load_workbook(file, read_only=True, data_only=True)
-                    ws = wb.active
-                except InvalidFileException:
-                    flash('Le fichier Excel est corrompu ou dans un format non supporté.', 'danger')
-                    return redirect(url_for('products.import_products'))
-                except Exception as e:
-                    flash(f'Erreur lors de la lecture du fichier Excel: {str(e)}', 'danger')
-                    return redirect(url_for('products.import_products'))
-                
-                # Vérifier que la feuille n'est pas vide
-                if ws.max_row == 0:
-                    flash('Le fichier Excel est vide.', 'danger')
-                    return redirect(url_for('products.import_products'))
-                
-                # Lire les en-têtes (chercher dans les premières lignes)
-                headers = None
-                start_row = 1
-                try:
-                    for row_idx in range(1, min(10, ws.max_row + 1)):
-                        row_values = [cell.value for cell in ws[row_idx]]
-                        if any(val and ('Nom' in str(val) or 'nom' in str(val)) for val in row_values):
-                            headers = [str(cell.value).strip() for cell in ws[row_idx] if cell.value]
-                            start_row = row_idx + 1
-                            break
-                except Exception as e:
-                    flash(f'Erreur lors de la lecture des en-têtes: {str(e)}', 'danger')
-                    return redirect(url_for('products.import_products'))
-                
-                if not headers:
-                    flash('Format de fichier Excel invalide. Veuillez utiliser le template fourni.', 'danger')
-                    return redirect(url_for('products.import_products'))
-                
-                # Mapping des noms de colonnes (normalisation)
-                column_mapping = {
-                    'Nom': 'Nom',
-                    'nom': 'Nom',
-                    'Description': 'Description',
-                    'description': 'Description',
-                    'Code-barres': 'Code-barres',
-                    'Code barres': 'Code-barres',
-                    'Forme': 'Forme',
-                    'forme': 'Forme',
-                    'Unité': 'Unité',
-                    'Unite': 'Unité',
-                    'Prix Achat (USD)': 'Prix Achat',
-                    'Prix Achat': 'Prix Achat',
-                    'Prix Vente (USD)': 'Prix Vente',
-                    'Prix Vente': 'Prix Vente',
-                    'Prix Gros (USD)': 'Prix Gros',
-                    'Prix Gros': 'Prix Gros',
-                    'Stock': 'Stock',
-                    'Stock Min': 'Stock Min',
-                    'Fabricant': 'Fabricant',
-                    'Fournisseur': 'Fournisseur'
-                }
-                
-                # Normaliser les en-têtes
-                normalized_headers = []
-                for header in headers:
-                    header_clean = header.replace(' *', '').strip()
-                    normalized_headers.append(column_mapping.get(header_clean, header_clean))
-                
-                # Lire les données avec gestion d'erreurs
-                data = []
-                try:
-                    for row in ws.iter_rows(min_row=start_row, values_only=False):
-                        try:
-                            if not any(cell.value for cell in row):
-                                continue
-                            
-                            row_dict = {}
-                            for col_idx, original_header in enumerate(headers):
-                                if col_idx < len(normalized_headers):
-                                    normalized_header = normalized_headers[col_idx]
-                                    if col_idx < len(row):
-                                        cell_value = row[col_idx].value
-                                        if cell_value is not None:
-                                            # Convertir les nombres en chaînes pour la cohérence
-                                            if isinstance(cell_value, (int, float)):
-                                                row_dict[normalized_header] = str(cell_value)
-                                            else:
-                                                row_dict[normalized_header] = str(cell_value).strip()
-                                        else:
-                                            row_dict[normalized_header] = ''
-                            
-                            if any(row_dict.values()):
-                                data.append(row_dict)
-                        except Exception as row_error:
-                            # Continuer avec la ligne suivante en cas d'erreur
-                            continue
-                except Exception as e:
-                    flash(f'Erreur lors de la lecture des données Excel: {str(e)}', 'danger')
-                    return redirect(url_for('products.import_products'))
-                finally:
-                    # Fermer le workbook proprement
-                    try:
-                        wb.close()
-                    except:
-                        pass
-            
-            if data is None:
-                return redirect(url_for('products.import_products'))
-            
-            # Valider les données
-            required_fields = ['Nom', 'Prix Vente']
-            valid, errors = validate_import_data(data, required_fields)
-            
-            if not valid:
-                for error in errors:
-                    flash(error, 'danger')
-                return redirect(url_for('products.import_products'))
-            
-            # Importer les produits
-            primary_pharmacy = current_user.get_primary_pharmacy()
-            imported_count = 0
-            
-            for row in data:
-                try:
-                    # Validation des champs numériques avec gestion d'erreurs
-                    try:
-                        purchase_price = float(row.get('Prix Achat', 0) or 0)
-                    except (ValueError, TypeError):
-                        purchase_price = 0.0
-                    
-                    try:
-                        selling_price = float(row.get('Prix Vente', 0) or 0)
-                        if selling_price <= 0:
-                            raise ValueError('Le prix de vente doit être supérieur à 0')
-                    except (ValueError, TypeError) as e:
-                        flash(f'Erreur prix ligne "{row.get("Nom", "?")}": {str(e)}', 'warning')
-                        continue
-                    
-                    try:
-                        wholesale_price = float(row.get('Prix Gros', 0) or 0)
-                    except (ValueError, TypeError):
-                        wholesale_price = 0.0
-                    
-                    try:
-                        stock_quantity = int(row.get('Stock', 0) or 0)
-                    except (ValueError, TypeError):
-                        stock_quantity = 0
-                    
-                    try:
-                        min_stock_level = int(row.get('Stock Min', 10) or 10)
-                    except (ValueError, TypeError):
-                        min_stock_level = 10
-                    
-                    product = Product(
-                        name=row['Nom'],
-                        description=row.get('Description', ''),
-                        barcode=row.get('Code-barres', ''),
-                        category=row.get('Forme', ''),
-                        unit=row.get('Unité', 'piece'),
-                        purchase_price=purchase_price,
-                        selling_price=selling_price,
-                        wholesale_price=wholesale_price,
-                        stock_quantity=stock_quantity,
-                        min_stock_level=min_stock_level,
-                        manufacturer=row.get('Fabricant', ''),
-                        supplier=row.get('Fournisseur', ''),
-                        pharmacy_id=primary_pharmacy.id if primary_pharmacy else None
-                    )
-                    
-                    db.session.add(product)
-                    imported_count += 1
-                except KeyError as e:
-                    flash(f'Champ manquant ligne "{row.get("Nom", "?")}": {str(e)}', 'warning')
-                    continue
-                except Exception as e:
-                    flash(f'Erreur ligne "{row.get("Nom", "?")}": {str(e)}', 'warning')
-                    continue
-            
-            # Audit
-            audit = Audit(
-                user_id=current_user.id,
-                action='import_products',
-                entity_type='product',
-                details=f'{imported_count} produits importés',
-                ip_address=request.remote_addr
-            )
-            db.session.add(audit)
-            
-            db.session.commit()
-            flash(f'{imported_count} produits importés avec succès!', 'success')
-            
+            importer.run(rows)
+        except ValueError as e:
+            # Fichier illisible ou en-têtes manquants (les paquets déjà écrits restent)
+            db.session.rollback()
+            flash(str(e), 'danger')
+            failed = True
         except Exception as e:
             db.session.rollback()
             flash(f'Erreur lors de l\'import: {str(e)}', 'danger')
+            failed = True
+        
+        for error in importer.errors[:IMPORT_ERRORS_SHOWN]:
+            flash(f'Ligne {error["line"]} ("{error["product"]}"): {error["message"]}', 'warning')
+        if len(importer.errors) > IMPORT_ERRORS_SHOWN:
+            flash(f'... et {len(importer.errors) - IMPORT_ERRORS_SHOWN} autres lignes ignorées', 'warning')
+        
+        if not importer.inserted and not importer.updated:
+            if not failed and not importer.errors:
+                flash('Le fichier est vide', 'danger')
+            return redirect(url_for('products.import_products'))
+        
+        # Audit
+        ActivityLogger.log(
+            action='import_products',
+            module='products',
+            entity_type='product',
+            details=importer.summary(),
+            user_id=current_user.id,
+            on_commit=True
+        )
+        db.session.commit()
+        
+        message = f'{importer.inserted} produits importés avec succès!'
+        if importer.updated:
+            message += f' {importer.updated} produits mis à jour.'
+        flash(message, 'success')
         
         return redirect(url_for('products.index'))
     
@@ -712,15 +576,15 @@ def toggle_status(id):
     product = Product.query.get_or_404(id)
     product.is_active = not product.is_active
     
-    audit = Audit(
-        user_id=current_user.id,
+    ActivityLogger.log(
         action='toggle_product_status',
+        module='products',
         entity_type='product',
         entity_id=product.id,
         details=f'Statut produit changé: {product.name} -> {"Actif" if product.is_active else "Inactif"}',
-        ip_address=request.remote_addr
+        user_id=current_user.id,
+        on_commit=True
     )
-    db.session.add(audit)
     
     db.session.commit()
     
@@ -811,17 +675,18 @@ def duplicate(id):
             )
             
             db.session.add(new_product)
+            db.session.flush()
             
             # Audit
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='duplicate_product',
+                module='products',
                 entity_type='product',
                 entity_id=new_product.id,
                 details=f'Produit dupliqué: {original_product.name} -> {new_product.name}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             flash('Produit dupliqué avec succès!', 'success')
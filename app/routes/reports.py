@@ -1,14 +1,18 @@
-from flask import Blueprint, render_template, request, send_file
+from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
 from app.models import db, Sale, Product, Expense, Payment, Customer
 from app.decorators import require_permission
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies
+from app.sales_summary import summary_totals
+from app.pharmacy_metrics import pharmacy_metrics
 from sqlalchemy import func, extract
 from datetime import datetime, timedelta
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
-from openpyxl import Workbook
-import io
+from app.export_utils import export_response, export_to_excel, iter_query
+from app.jobs import enqueue_export, job_started_response, register_export, wants_async
+from app.customer_ledger import ledger_query, ledger_totals
+from app.stock_snapshots import month_ends, stock_as_of, summarize_stock, valuation_as_of
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
@@ -29,16 +33,21 @@ def sales():
     if not date_to:
         date_to = datetime.now().strftime('%Y-%m-%d')
     
+    start_date = datetime.strptime(date_from, '%Y-%m-%d')
+    end_date = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    
     query = Sale.query.filter(
-        Sale.sale_date >= datetime.strptime(date_from, '%Y-%m-%d'),
-        Sale.sale_date <= datetime.strptime(date_to, '%Y-%m-%d')
+        Sale.sale_date >= start_date,
+        Sale.sale_date < end_date
     )
     
     query = filter_by_pharmacy(query, Sale, pharmacy_filter)
-    sales_data = query.all()
+    sales_data = query.order_by(Sale.sale_date.desc()).all()
     
-    total_sales = sum(sale.total_amount for sale in sales_data)
-    total_paid = sum(sale.paid_amount for sale in sales_data)
+    # Totaux lus dans le récapitulatif journalier
+    totals = summary_totals(start_date.date(), end_date.date() - timedelta(days=1), pharmacy_filter)
+    total_sales = totals['total_amount']
+    total_paid = totals['paid_amount']
     total_due = total_sales - total_paid
     
     pharmacies = get_accessible_pharmacies()
@@ -98,14 +107,17 @@ def monthly():
     else:
         end_date = datetime(year, month + 1, 1)
     
+    # Totaux lus dans le récapitulatif journalier, seules les 10 dernières ventes sont chargées
+    totals = summary_totals(start_date.date(), end_date.date() - timedelta(days=1), pharmacy_filter)
+    total_revenue = totals['total_amount']
+    sales_count = totals['sales_count']
+    
     sales_query = Sale.query.filter(
         Sale.sale_date >= start_date,
         Sale.sale_date < end_date
     )
     sales_query = filter_by_pharmacy(sales_query, Sale, pharmacy_filter)
-    sales_data = sales_query.all()
-    
-    total_revenue = sum(sale.total_amount for sale in sales_data)
+    sales_data = sales_query.order_by(Sale.sale_date.desc()).limit(10).all()
     
     expenses_query = Expense.query.filter(
         Expense.expense_date >= start_date.date(),
@@ -122,6 +134,7 @@ def monthly():
     
     return render_template('reports/monthly.html',
                          sales=sales_data,
+                         sales_count=sales_count,
                          expenses=expenses_data,
                          total_revenue=total_revenue,
                          total_expenses=total_expenses,
@@ -152,84 +165,79 @@ def stock():
                          pharmacies=pharmacies,
                          pharmacy_filter=pharmacy_filter)
 
+def valuation_date(value):
+    """Date du rapport de valorisation (défaut : dernier jour du mois précédent)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return month_ends(1)[0]
+
+@reports_bp.route('/stock-valuation')
+@require_permission('view_reports')
+def stock_valuation():
+    """Stock et valeur du stock à une date passée, et valeur des fins de mois"""
+    from app.models import Pharmacy
+    pharmacy_filter = request.args.get('pharmacy_id', 'all')
+    as_of = valuation_date(request.args.get('date'))
+    
+    scoped = filter_by_pharmacy(Product.query, Product, pharmacy_filter)
+    stock = stock_as_of(as_of, scoped)
+    totals = summarize_stock(stock)
+    
+    # Photo de fin de mois la plus proche + mouvements suivants, par mois
+    history = [(day, valuation_as_of(day, scoped)) for day in month_ends(12)]
+    
+    names = {product.id: product for product in scoped.with_entities(
+        Product.id, Product.name, Product.category
+    )}
+    lines = sorted(
+        ({'name': names[product_id].name, 'category': names[product_id].category, **entry}
+         for product_id, entry in stock.items() if entry['quantity'] and product_id in names),
+        key=lambda line: line['value'], reverse=True
+    )
+    
+    pharmacy_names = dict(db.session.query(Pharmacy.id, Pharmacy.name).filter(
+        Pharmacy.id.in_([pharmacy_id for pharmacy_id in totals['pharmacies'] if pharmacy_id])
+    ).all()) if totals['pharmacies'] else {}
+    
+    return render_template('reports/stock_valuation.html',
+                         as_of=as_of,
+                         totals=totals,
+                         lines=lines,
+                         history=history,
+                         pharmacy_names=pharmacy_names,
+                         pharmacies=get_accessible_pharmacies(),
+                         pharmacy_filter=pharmacy_filter)
+
 @reports_bp.route('/customers')
 @login_required
 def customers():
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
+    page = request.args.get('page', 1, type=int)
+    sort = request.args.get('sort', 'total_purchases')
+    direction = request.args.get('direction', 'desc')
     
-    customers_data = Customer.query.filter_by(is_active=True).all()
-    
-    customer_stats = []
-    for customer in customers_data:
-        sales_query = Sale.query.filter_by(customer_id=customer.id)
-        sales_query = filter_by_pharmacy(sales_query, Sale, pharmacy_filter)
-        sales = sales_query.all()
-        
-        if not sales:
-            continue
-        
-        total_purchases = sum(sale.total_amount for sale in sales)
-        total_paid = sum(sale.paid_amount for sale in sales)
-        balance = total_purchases - total_paid
-        
-        customer_stats.append({
-            'customer': customer,
-            'total_purchases': total_purchases,
-            'total_paid': total_paid,
-            'balance': balance
-        })
-    
-    customer_stats.sort(key=lambda x: x['total_purchases'], reverse=True)
+    # Totaux par client calculés, triés et paginés par la base
+    customer_stats = ledger_query(pharmacy_filter, sort, direction).paginate(
+        page=page, per_page=50, error_out=False
+    )
+    totals = ledger_totals(pharmacy_filter)
     
     pharmacies = get_accessible_pharmacies()
     
     return render_template('reports/customers.html', 
                          customer_stats=customer_stats,
+                         totals=totals,
+                         sort=sort,
+                         direction=direction,
                          pharmacies=pharmacies,
                          pharmacy_filter=pharmacy_filter)
 
 @reports_bp.route('/pharmacies')
 @require_permission('view_reports')
 def pharmacies():
-    from app.models import Pharmacy
-    
-    pharmacies_list = Pharmacy.query.filter_by(is_active=True).all()
-    
-    pharmacy_stats = []
-    for pharmacy in pharmacies_list:
-        total_sales = db.session.query(func.sum(Sale.total_amount)).filter_by(pharmacy_id=pharmacy.id).scalar() or 0
-        sales_count = Sale.query.filter_by(pharmacy_id=pharmacy.id).count()
-        total_paid = db.session.query(func.sum(Sale.paid_amount)).filter_by(pharmacy_id=pharmacy.id).scalar() or 0
-        total_pending = total_sales - total_paid
-        
-        products_count = Product.query.filter_by(pharmacy_id=pharmacy.id, is_active=True).count()
-        low_stock_count = Product.query.filter(
-            Product.pharmacy_id == pharmacy.id,
-            Product.is_active == True,
-            Product.stock_quantity <= Product.min_stock_level
-        ).count()
-        
-        stock_value = db.session.query(
-            func.sum(Product.stock_quantity * Product.purchase_price)
-        ).filter_by(pharmacy_id=pharmacy.id, is_active=True).scalar() or 0
-        
-        progress = (total_sales / pharmacy.revenue_target * 100) if pharmacy.revenue_target > 0 else 0
-        
-        pharmacy_stats.append({
-            'pharmacy': pharmacy,
-            'total_sales': total_sales,
-            'sales_count': sales_count,
-            'total_paid': total_paid,
-            'total_pending': total_pending,
-            'products_count': products_count,
-            'low_stock_count': low_stock_count,
-            'stock_value': stock_value,
-            'target_progress': progress
-        })
-    
-    pharmacy_stats.sort(key=lambda x: x['total_sales'], reverse=True)
-    
-    grand_total = sum(p['total_sales'] for p in pharmacy_stats)
+    pharmacy_stats = pharmacy_metrics()
+    grand_total = sum(stat.total_sales for stat in pharmacy_stats)
     
     return render_template('reports/pharmacies.html', 
                          pharmacy_stats=pharmacy_stats,
@@ -288,48 +296,33 @@ def products():
 @reports_bp.route('/export/pharmacies-excel')
 @require_permission('view_reports')
 def export_pharmacies_excel():
-    from app.models import Pharmacy
-    
-    pharmacies_list = Pharmacy.query.filter_by(is_active=True).all()
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Pharmacies"
+    headers = ['Pharmacie', 'Type', 'Ventes', 'CA Total ($)', 'Produits', 'Valeur Stock ($)', 'Objectif ($)', 'Progression %']
+    
+    def rows():
+        for stat in pharmacy_metrics():
+            yield [
+                stat.pharmacy.name,
+                stat.pharmacy.type,
+                stat.sales_count,
+                stat.total_sales,
+                stat.products_count,
+                stat.stock_value,
+                stat.pharmacy.revenue_target or 0,
+                stat.target_ratio
+            ]
     
-    ws.append(['Pharmacie', 'Type', 'Ventes', 'CA Total ($)', 'Produits', 'Valeur Stock ($)', 'Objectif ($)', 'Progression %'])
-    
-    for pharmacy in pharmacies_list:
-        total_sales = db.session.query(func.sum(Sale.total_amount)).filter_by(pharmacy_id=pharmacy.id).scalar() or 0
-        sales_count = Sale.query.filter_by(pharmacy_id=pharmacy.id).count()
-        products_count = Product.query.filter_by(pharmacy_id=pharmacy.id, is_active=True).count()
-        stock_value = db.session.query(func.sum(Product.stock_quantity * Product.purchase_price)).filter_by(pharmacy_id=pharmacy.id, is_active=True).scalar() or 0
-        progress = (total_sales / pharmacy.revenue_target * 100) if pharmacy.revenue_target > 0 else 0
-        
-        ws.append([
-            pharmacy.name,
-            pharmacy.type,
-            sales_count,
-            total_sales,
-            products_count,
-            stock_value,
-            pharmacy.revenue_target,
-            f'{progress:.1f}%'
-        ])
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'rapport_pharmacies_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    return export_to_excel(
+        rows(),
+        'rapport_pharmacies',
+        headers,
+        'Pharmacies',
+        download_name=f'rapport_pharmacies_{datetime.now().strftime("%Y%m%d")}.xlsx',
+        number_formats={'Progression %': '0.0%'}
     )
 
-@reports_bp.route('/export/products-excel')
-@require_permission('view_reports')
-def export_products_excel():
+@register_export('reports.products')
+def products_report_export(args):
+    """Produits actifs avec quantités vendues et CA (une requête groupée)"""
     from app.models import SaleItem
     
     products_sales = db.session.query(
@@ -343,138 +336,196 @@ def export_products_excel():
     ).join(SaleItem, Product.id == SaleItem.product_id, isouter=True)\
      .filter(Product.is_active == True)\
      .group_by(Product.id)\
-     .order_by(func.sum(SaleItem.total).desc())\
-     .all()
+     .order_by(func.sum(SaleItem.total).desc())
+    
+    headers = ['Produit', 'Catégorie', 'Stock', 'Prix Vente ($)', 'Prix Achat ($)', 'Qté Vendue', 'CA Total ($)', 'Marge %']
+    
+    def rows():
+        for p in iter_query(products_sales):
+            margin = p.selling_price - p.purchase_price
+            yield [
+                p.name,
+                p.category or '-',
+                p.stock_quantity,
+                p.selling_price,
+                p.purchase_price,
+                p.total_sold or 0,
+                p.total_revenue or 0,
+                (margin / p.purchase_price) if p.purchase_price > 0 else 0
+            ]
+    
+    return {
+        'filename': 'rapport_produits',
+        'headers': headers,
+        'rows': rows(),
+        'sheet_name': 'Produits',
+        'download_name': f'rapport_produits_{datetime.now().strftime("%Y%m%d")}.xlsx',
+        'number_formats': {'Marge %': '0.0%'}
+    }
+
+@reports_bp.route('/export/products-excel')
+@require_permission('view_reports')
+def export_products_excel():
+    if wants_async():
+        job = enqueue_export('reports.products', 'excel', request.args, 'Rapport des produits (Excel)', current_user.id)
+        return job_started_response(job)
+    return export_response(products_report_export(request.args))
+
+@register_export('reports.sales')
+def sales_report_export(args):
+    """Toutes les ventes (numéro, client, montants, pharmacie), lues par lots"""
+    from app.models import Pharmacy
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Produits"
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Sale.invoice_number, Sale.sale_date, Sale.total_amount, Sale.paid_amount, Sale.payment_status,
+        Customer.name.label('customer_name'), Pharmacy.name.label('pharmacy_name')
+    ).outerjoin(Customer, Customer.id == Sale.customer_id).outerjoin(
+        Pharmacy, Pharmacy.id == Sale.pharmacy_id
+    ).order_by(Sale.sale_date.desc())
+    
+    data = ({
+        'Numéro': sale.invoice_number,
+        'Date': sale.sale_date or '',
+        'Client': sale.customer_name or 'Anonyme',
+        'Total': sale.total_amount,
+        'Payé': sale.paid_amount,
+        'Solde': max(0, (sale.total_amount or 0) - (sale.paid_amount or 0)),
+        'Statut': sale.payment_status,
+        'Pharmacie': sale.pharmacy_name or 'N/A'
+    } for sale in iter_query(query))
     
-    ws.append(['Produit', 'Catégorie', 'Stock', 'Prix Vente ($)', 'Prix Achat ($)', 'Qté Vendue', 'CA Total ($)', 'Marge %'])
+    headers = ['Numéro', 'Date', 'Client', 'Total', 'Payé', 'Solde', 'Statut', 'Pharmacie']
     
-    for p in products_sales:
-        total_sold = p.total_sold or 0
-        total_revenue = p.total_revenue or 0
-        margin = p.selling_price - p.purchase_price
-        margin_percent = (margin / p.purchase_price * 100) if p.purchase_price > 0 else 0
-        
-        ws.append([
-            p.name,
-            p.category or '-',
-            p.stock_quantity,
-            p.selling_price,
-            p.purchase_price,
-            total_sold,
-            total_revenue,
-            f'{margin_percent:.1f}%'
-        ])
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'rapport_produits_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+    return {
+        'filename': 'rapport_ventes',
+        'headers': headers,
+        'rows': data,
+        'sheet_name': 'Ventes',
+        'download_name': f'rapport_ventes_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    }
 
 @reports_bp.route('/export/sales-excel')
 @require_permission('view_reports')
 def export_sales_excel():
-    from app.export_utils import export_to_excel
-    
-    # Récupérer les ventes
-    sales = Sale.query.order_by(Sale.sale_date.desc()).all()
-    
-    # Préparer les données
-    data = []
-    for sale in sales:
-        data.append({
-            'Numéro': sale.invoice_number,
-            'Date': sale.sale_date.strftime('%d/%m/%Y %H:%M') if sale.sale_date else '',
-            'Client': sale.customer.name if sale.customer else 'Anonyme',
-            'Total': sale.total_amount,
-            'Payé': sale.paid_amount,
-            'Solde': sale.balance_due,
-            'Statut': sale.payment_status,
-            'Pharmacie': sale.pharmacy.name if sale.pharmacy else 'N/A'
-        })
-    
-    headers = ['Numéro', 'Date', 'Client', 'Total', 'Payé', 'Solde', 'Statut', 'Pharmacie']
-    
-    return export_to_excel(
-        data, 
-        'rapport_ventes', 
-        headers, 
-        'Ventes',
-        download_name=f'rapport_ventes_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+    if wants_async():
+        job = enqueue_export('reports.sales', 'excel', request.args, 'Rapport des ventes (Excel)', current_user.id)
+        return job_started_response(job)
+    return export_response(sales_report_export(request.args))
+
+@register_export('reports.customers')
+def customers_report_export(args):
+    """Clients avec leurs totaux d'achats (filtre pharmacy_id)"""
+    pharmacy_filter = args.get('pharmacy_id', 'all')
+    
+    # Tous les clients avec leurs totaux (une requête groupée), lus par lots
+    query = ledger_query(pharmacy_filter, sort='name', direction='asc', with_inactive=True, without_sales=True)
+    
+    data = ({
+        'Nom': customer.name,
+        'Type': customer.customer_type,
+        'Email': customer.email or '',
+        'Téléphone': customer.phone or '',
+        'Adresse': customer.address or '',
+        'Ventes': int(customer.sales_count or 0),
+        'Total Achats': float(customer.total_purchases or 0),
+        'Total Payé': float(customer.total_paid or 0),
+        'Solde Dû': float(customer.balance or 0),
+        'Statut': 'Actif' if customer.is_active else 'Inactif'
+    } for customer in iter_query(query))
+    
+    headers = ['Nom', 'Type', 'Email', 'Téléphone', 'Adresse', 'Ventes', 'Total Achats', 'Total Payé', 'Solde Dû', 'Statut']
+    
+    return {
+        'filename': 'rapport_clients',
+        'headers': headers,
+        'rows': data,
+        'sheet_name': 'Clients',
+        'download_name': f'rapport_clients_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    }
 
 @reports_bp.route('/export/customers-excel')
 @require_permission('view_reports')
 def export_customers_excel():
-    from app.export_utils import export_to_excel
-    
-    # Récupérer les clients
-    customers = Customer.query.order_by(Customer.name).all()
-    
-    # Préparer les données
-    data = []
-    for customer in customers:
-        # Calculer le total des achats
-        total_purchases = db.session.query(func.sum(Sale.total_amount)).filter_by(customer_id=customer.id).scalar() or 0
-        
-        data.append({
-            'Nom': customer.name,
-            'Type': customer.customer_type,
-            'Email': customer.email or '',
-            'Téléphone': customer.phone or '',
-            'Adresse': customer.address or '',
-            'Total Achats': total_purchases,
-            'Statut': 'Actif' if customer.is_active else 'Inactif'
-        })
+    export_format = 'csv' if request.args.get('format') == 'csv' else 'excel'
+    if wants_async():
+        job = enqueue_export('reports.customers', export_format, request.args,
+                             f'Rapport des clients ({export_format.upper()})', current_user.id)
+        return job_started_response(job)
+    return export_response(customers_report_export(request.args), export_format)
+
+@register_export('reports.stock')
+def stock_report_export(args):
+    """Stock des produits actifs"""
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Product.name, Product.barcode, Product.category, Product.stock_quantity,
+        Product.min_stock_level, Product.purchase_price, Product.selling_price, Product.wholesale_price
+    ).filter(Product.is_active == True).order_by(Product.name)
+    
+    data = ({
+        'Nom': product.name,
+        'Code-barres': product.barcode or '',
+        'Catégorie': product.category or '',
+        'Stock': product.stock_quantity,
+        'Stock Min': product.min_stock_level,
+        'Prix Achat': product.purchase_price,
+        'Prix Vente': product.selling_price,
+        'Prix Gros': product.wholesale_price,
+        'Statut Stock': 'Faible' if product.stock_quantity <= product.min_stock_level else 'Normal'
+    } for product in iter_query(query))
     
-    headers = ['Nom', 'Type', 'Email', 'Téléphone', 'Adresse', 'Total Achats', 'Statut']
+    headers = ['Nom', 'Code-barres', 'Catégorie', 'Stock', 'Stock Min', 'Prix Achat', 'Prix Vente', 'Prix Gros', 'Statut Stock']
     
-    return export_to_excel(
-        data, 
-        'rapport_clients', 
-        headers, 
-        'Clients',
-        download_name=f'rapport_clients_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+    return {
+        'filename': 'rapport_stock',
+        'headers': headers,
+        'rows': data,
+        'sheet_name': 'Stock',
+        'download_name': f'rapport_stock_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    }
+
+@register_export('reports.stock_valuation')
+def stock_valuation_export(args):
+    """Stock et valeur par produit à une date passée"""
+    as_of = valuation_date(args.get('date'))
+    scoped = filter_by_pharmacy(Product.query, Product, args.get('pharmacy_id', 'all'))
+    stock = stock_as_of(as_of, scoped)
+    query = scoped.with_entities(Product.id, Product.name, Product.barcode, Product.category).order_by(Product.name)
+    
+    data = ({
+        'Nom': product.name,
+        'Code-barres': product.barcode or '',
+        'Catégorie': product.category or '',
+        'Stock': stock[product.id]['quantity'],
+        'Prix Achat': stock[product.id]['unit_cost'],
+        'Valeur': stock[product.id]['value']
+    } for product in iter_query(query) if stock.get(product.id, {}).get('quantity'))
+    
+    headers = ['Nom', 'Code-barres', 'Catégorie', 'Stock', 'Prix Achat', 'Valeur']
+    
+    return {
+        'filename': 'valorisation_stock',
+        'headers': headers,
+        'rows': data,
+        'sheet_name': 'Valorisation',
+        'download_name': f'valorisation_stock_{as_of.strftime("%Y%m%d")}.xlsx'
+    }
+
+@reports_bp.route('/export/stock-valuation')
+@require_permission('view_reports')
+def export_stock_valuation():
+    export_format = 'csv' if request.args.get('format') == 'csv' else 'excel'
+    if wants_async():
+        job = enqueue_export('reports.stock_valuation', export_format, request.args,
+                             f'Valorisation du stock ({export_format.upper()})', current_user.id)
+        return job_started_response(job)
+    return export_response(stock_valuation_export(request.args), export_format)
 
 @reports_bp.route('/export/stock-excel')
 @require_permission('view_reports')
 def export_stock_excel():
-    from app.export_utils import export_to_excel
-    
-    # Récupérer les produits
-    products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
-    
-    # Préparer les données
-    data = []
-    for product in products:
-        data.append({
-            'Nom': product.name,
-            'Code-barres': product.barcode or '',
-            'Catégorie': product.category or '',
-            'Stock': product.stock_quantity,
-            'Stock Min': product.min_stock_level,
-            'Prix Achat': product.purchase_price,
-            'Prix Vente': product.selling_price,
-            'Prix Gros': product.wholesale_price,
-            'Statut Stock': 'Faible' if product.stock_quantity <= product.min_stock_level else 'Normal'
-        })
-    
-    headers = ['Nom', 'Code-barres', 'Catégorie', 'Stock', 'Stock Min', 'Prix Achat', 'Prix Vente', 'Prix Gros', 'Statut Stock']
-    
-    return export_to_excel(
-        data, 
-        'rapport_stock', 
-        headers, 
-        'Stock',
-        download_name=f'rapport_stock_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+    if wants_async():
+        job = enqueue_export('reports.stock', 'excel', request.args, 'Rapport du stock (Excel)', current_user.id)
+        return job_started_response(job)
+    return export_response(stock_report_export(request.args))
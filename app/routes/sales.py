@@ -1,88 +1,37 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import Sale, SaleItem, Product, Audit, TempSale, StockMovement, Payment, Proforma, ProformaItem, Customer
+from app.models import Sale, SaleItem, Product, Audit, TempSale, StockMovement, Payment, Proforma, ProformaItem, Customer, BatchMovement, Pharmacy
 from app.decorators import require_permission
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel
+from app.export_utils import export_to_csv, export_to_excel, iter_query
+from app.sales_summary import sale_snapshot, apply_sale_change
+from app.stock_utils import FefoAllocator, StockLedger
+from app.numbering import generate_invoice_number, generate_proforma_number
+from app.sales_list import fetch_sales_page, count_sales
+from app.search import search as text_search
 from datetime import datetime, timedelta
+from sqlalchemy import update
 import json
-import random
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 
 @sales_bp.route('/')
 @require_permission('manage_sales')
 def index():
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     status_filter = request.args.get('status', '')
     view_type = request.args.get('view', 'all')
     
-    # Récupérer les ventes finales
-    final_sales_query = Sale.query
-    final_sales_query = filter_by_pharmacy(final_sales_query, Sale, pharmacy_filter)
-    
-    if search:
-        final_sales_query = final_sales_query.filter(Sale.invoice_number.ilike(f'%{search}%'))
-    
-    if status_filter:
-        final_sales_query = final_sales_query.filter(Sale.payment_status == status_filter)
-    
-    # Récupérer les ventes temporaires
-    temp_sales_query = TempSale.query
-    temp_sales_query = filter_by_pharmacy(temp_sales_query, TempSale, pharmacy_filter)
-    
-    if search:
-        temp_sales_query = temp_sales_query.filter(TempSale.reference.ilike(f'%{search}%'))
-    
-    # Combiner les résultats
-    final_sales = final_sales_query.order_by(Sale.sale_date.desc()).all()
-    temp_sales = temp_sales_query.order_by(TempSale.created_at.desc()).all()
-    
-    # Créer une liste unifiée avec métadonnées
-    all_sales = []
-    
-    if view_type in ['all', 'temp']:
-        for ts in temp_sales:
-            all_sales.append({
-                'type': 'temp',
-                'id': ts.id,
-                'reference': ts.reference,
-                'date': ts.created_at,
-                'customer': ts.customer.name if ts.customer else 'Anonyme',
-                'total': ts.total_amount,
-                'paid': 0,
-                'status': ts.status,
-                'seller': ts.creator.full_name,
-                'data': ts
-            })
-    
-    if view_type in ['all', 'final']:
-        for s in final_sales:
-            all_sales.append({
-                'type': 'final',
-                'id': s.id,
-                'reference': s.invoice_number,
-                'date': s.sale_date,
-                'customer': s.customer.name if s.customer else 'Anonyme',
-                'total': s.total_amount,
-                'paid': s.paid_amount,
-                'status': s.payment_status,
-                'seller': s.seller.full_name if s.seller else 'N/A',
-                'data': s
-            })
-    
-    # Trier par date décroissante
-    all_sales.sort(key=lambda x: x['date'], reverse=True)
-    
-    # Paginer manuellement
+    after = request.args.get('after')
+    before = request.args.get('before')
     per_page = 10
-    total = len(all_sales)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_sales = all_sales[start:end]
+    
+    # UNION ventes finales + temporaires en base, pagination par curseur
+    result = fetch_sales_page(view_type, search, status_filter, pharmacy_filter,
+                              after=after, before=before, per_page=per_page)
+    total, total_capped = count_sales(view_type, search, status_filter, pharmacy_filter)
     
     pharmacies = get_accessible_pharmacies() if is_admin() else []
     
@@ -91,11 +40,11 @@ def index():
     }
     
     return render_template('sales/index.html', 
-                         sales=paginated_sales,
-                         page=page,
-                         total_pages=(total // per_page) + (1 if total % per_page > 0 else 0),
-                         has_prev=page > 1,
-                         has_next=end < total,
+                         sales=result['sales'],
+                         next_cursor=result['next_cursor'],
+                         prev_cursor=result['prev_cursor'],
+                         total=total,
+                         total_capped=total_capped,
                          search=search,
                          pharmacies=pharmacies,
                          pharmacy_filter=pharmacy_filter,
@@ -109,28 +58,30 @@ def export(format):
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     search = request.args.get('search', '')
     
-    query = Sale.query
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        Sale.invoice_number, Sale.sale_date, Sale.total_amount, Sale.paid_amount,
+        Sale.payment_status, Customer.name.label('customer_name'), Pharmacy.name.label('pharmacy_name')
+    ).outerjoin(Customer, Customer.id == Sale.customer_id).outerjoin(Pharmacy, Pharmacy.id == Sale.pharmacy_id)
     query = filter_by_pharmacy(query, Sale, pharmacy_filter)
     
     if search:
         query = query.filter(Sale.invoice_number.ilike(f'%{search}%'))
     
-    sales = query.order_by(Sale.sale_date.desc()).all()
+    query = query.order_by(Sale.sale_date.desc())
     
     headers = ['Facture', 'Date', 'Client', 'Montant Total', 'Payé', 'Solde Dû', 'Statut', 'Pharmacie']
     
-    data = []
-    for s in sales:
-        data.append({
-            'Facture': s.invoice_number,
-            'Date': s.sale_date.strftime('%d/%m/%Y %H:%M'),
-            'Client': s.customer.name if s.customer else 'Anonyme',
-            'Montant Total': s.total_amount,
-            'Payé': s.paid_amount,
-            'Solde Dû': s.balance_due,
-            'Statut': s.payment_status,
-            'Pharmacie': s.pharmacy.name if s.pharmacy else 'N/A'
-        })
+    data = ({
+        'Facture': s.invoice_number,
+        'Date': s.sale_date,
+        'Client': s.customer_name or 'Anonyme',
+        'Montant Total': s.total_amount,
+        'Payé': s.paid_amount,
+        'Solde Dû': max(0, (s.total_amount or 0) - (s.paid_amount or 0)),
+        'Statut': s.payment_status,
+        'Pharmacie': s.pharmacy_name or 'N/A'
+    } for s in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'ventes', headers)
@@ -167,6 +118,49 @@ def quick_view(id):
         } for item in sale.items]
     })
 
+def sale_quantities(items):
+    """Quantité vendue par produit ({product_id: quantité})"""
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+def adjust_sale_stock(ledger, sale, before, after, label):
+    """
+    Appliquer au stock la différence entre deux versions d'une vente
+
+    Une seule écriture par produit (UPDATE atomique de StockLedger, par id
+    croissant) et son StockMovement : 'out' si la vente prend plus de
+    stock, 'in' si elle en rend. L'historique des mouvements reste ainsi
+    cohérent avec products.stock_quantity (stock_as_of, rapports). Les lots
+    ne sont pas modifiés. Un décrément refusé est noté dans ledger.failures.
+
+    Args:
+        before, after: {product_id: quantité} avant et après la modification
+    """
+    product_ids = set(before) | set(after)
+    products = Product.query.filter(Product.id.in_(product_ids)).all() if product_ids else []
+    for product in sorted(products, key=lambda p: p.id):
+        delta = after.get(product.id, 0) - before.get(product.id, 0)
+        if delta > 0:
+            if not ledger.decrement_product(product.id, product, delta):
+                continue
+            movement_type = 'out'
+        elif delta < 0:
+            ledger.increment_product(product, -delta)
+            movement_type = 'in'
+        else:
+            continue
+        db.session.add(StockMovement(
+            product_id=product.id,
+            movement_type=movement_type,
+            quantity=abs(delta),
+            reference=sale.invoice_number,
+            notes=f'{label} {sale.invoice_number}',
+            created_by=current_user.id,
+            pharmacy_id=sale.pharmacy_id
+        ))
+
 @sales_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 @require_permission('edit_sales')
@@ -185,7 +179,8 @@ def edit(id):
                 return redirect(url_for('sales.edit', id=id))
             
             old_total = sale.total_amount
-            old_items = {item.product_id: item.quantity for item in sale.items}
+            old_quantities = sale_quantities(sale.items)
+            summary_before = sale_snapshot(sale)
             
             sale.discount = float(request.form.get('discount', 0))
             sale.tax = float(request.form.get('tax', 0))
@@ -195,14 +190,10 @@ def edit(id):
             quantities = request.form.getlist('quantity[]')
             prices = request.form.getlist('price[]')
             
-            for item in sale.items:
-                product = Product.query.get(item.product_id)
-                if product:
-                    product.stock_quantity += item.quantity
-            
             db.session.query(SaleItem).filter_by(sale_id=sale.id).delete()
             
             new_total = 0
+            new_quantities = {}
             for pid, qty, price in zip(product_ids, quantities, prices):
                 if pid and qty and price:
                     product = Product.query.get(int(pid))
@@ -211,13 +202,7 @@ def edit(id):
                     
                     quantity = int(qty)
                     unit_price = float(price)
-                    
-                    if product.stock_quantity < quantity:
-                        flash(f'Stock insuffisant pour {product.name}', 'danger')
-                        db.session.rollback()
-                        return redirect(url_for('sales.edit', id=id))
-                    
-                    product.stock_quantity -= quantity
+                    new_quantities[product.id] = new_quantities.get(product.id, 0) + quantity
                     
                     item_total = quantity * unit_price
                     new_total += item_total
@@ -231,6 +216,14 @@ def edit(id):
                     )
                     db.session.add(sale_item)
             
+            # Seule la différence avec l'ancienne vente touche le stock
+            ledger = StockLedger()
+            adjust_sale_stock(ledger, sale, old_quantities, new_quantities, 'Modification vente')
+            if not ledger.ok:
+                db.session.rollback()
+                flash(ledger.failures[0]['message'], 'danger')
+                return redirect(url_for('sales.edit', id=id))
+            
             sale.total_amount = new_total - sale.discount + sale.tax
             sale.remaining_amount = sale.total_amount - sale.paid_amount
             
@@ -245,11 +238,14 @@ def edit(id):
             sale.edited_by = current_user.id
             sale.edited_at = datetime.utcnow()
             sale.edit_reason = edit_reason
+            apply_sale_change(summary_before, sale_snapshot(sale))
             
             audit = Audit(
                 user_id=current_user.id,
                 action='edit_sale',
-                description=f'Modification de la vente {sale.invoice_number}. Raison: {edit_reason}. Ancien total: ${old_total:.2f}, Nouveau total: ${sale.total_amount:.2f}',
+                entity_type='sale',
+                entity_id=sale.id,
+                details=f'Modification de la vente {sale.invoice_number}. Raison: {edit_reason}. Ancien total: ${old_total:.2f}, Nouveau total: ${sale.total_amount:.2f}',
                 ip_address=request.remote_addr
             )
             db.session.add(audit)
@@ -280,15 +276,16 @@ def delete(id):
     try:
         delete_reason = request.form.get('delete_reason', 'Suppression de vente')
         
-        for item in sale.items:
-            product = Product.query.get(item.product_id)
-            if product:
-                product.stock_quantity += item.quantity
+        adjust_sale_stock(StockLedger(), sale, sale_quantities(sale.items), {}, 'Suppression vente')
+        
+        apply_sale_change(sale_snapshot(sale), None)
         
         audit = Audit(
             user_id=current_user.id,
             action='delete_sale',
-            description=f'Suppression de la vente {sale.invoice_number}. Montant: ${sale.total_amount:.2f}. Raison: {delete_reason}',
+            entity_type='sale',
+            entity_id=sale.id,
+            details=f'Suppression de la vente {sale.invoice_number}. Montant: ${sale.total_amount:.2f}. Raison: {delete_reason}',
             ip_address=request.remote_addr
         )
         db.session.add(audit)
@@ -304,6 +301,22 @@ def delete(id):
         flash(f'Erreur: {str(e)}', 'danger')
         return redirect(url_for('sales.view', id=id))
 
+def claim_temp_sale(temp_sale, status):
+    """
+    Passer une vente temporaire de 'pending' à `status` (UPDATE conditionnel)
+
+    Deux validateurs simultanés : le second attend le verrou de la ligne puis
+    ne la trouve plus en attente, il ne crée donc ni vente ni décrément.
+    Annulé avec la transaction si la validation échoue.
+    """
+    result = db.session.execute(
+        update(TempSale)
+        .where(TempSale.id == temp_sale.id, TempSale.status == 'pending')
+        .values(status=status)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
 @sales_bp.route('/temp/<int:id>/validate', methods=['POST'])
 @login_required
 @require_permission('manage_cashier')
@@ -314,17 +327,28 @@ def validate_temp_sale(id):
         return jsonify({'success': False, 'message': 'Vente déjà traitée'}), 400
     
     try:
+        # Réserver la vente avant de toucher au stock (verrou pris en premier)
+        if not claim_temp_sale(temp_sale, 'validating'):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Vente déjà traitée'}), 400
+        
         items_data = json.loads(temp_sale.items_data)
         
-        # Vérifier stock
-        for item_data in items_data:
-            product = Product.query.get(item_data['product_id'])
-            if not product or product.stock_quantity < item_data['quantity']:
-                return jsonify({'success': False, 'message': f'Stock insuffisant'}), 400
+        # Charger produits et lots de la vente en deux requêtes
+        allocator = FefoAllocator([item['product_id'] for item in items_data], temp_sale.pharmacy_id)
+        if any(not allocator.get_product(item['product_id']) for item in items_data):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': f'Produit introuvable'}), 404
+        ledger = StockLedger()
+        
+        # Déduire le stock des produits (UPDATE conditionnels atomiques, par id croissant)
+        decremented = ledger.decrement_products([
+            (line, allocator.get_product(item['product_id']), item['quantity'])
+            for line, item in enumerate(items_data, start=1)
+        ])
         
         # Créer la vente finale
-        from app.routes.pos import generate_invoice_number
-        invoice_number = generate_invoice_number()
+        invoice_number = generate_invoice_number(temp_sale.pharmacy_id)
         
         sale = Sale(
             invoice_number=invoice_number,
@@ -342,10 +366,11 @@ def validate_temp_sale(id):
         
         db.session.add(sale)
         db.session.flush()
+        apply_sale_change(None, sale_snapshot(sale))
         
         # Créer items et déduire stock
-        for item_data in items_data:
-            product = Product.query.get(item_data['product_id'])
+        for line, item_data in enumerate(items_data, start=1):
+            product = allocator.get_product(item_data['product_id'])
             
             sale_item = SaleItem(
                 sale_id=sale.id,
@@ -356,7 +381,21 @@ def validate_temp_sale(id):
             )
             db.session.add(sale_item)
             
-            product.stock_quantity -= item_data['quantity']
+            # Lots selon FEFO pour les lignes dont le stock a été déduit
+            if line not in decremented:
+                continue
+            
+            for batch, quantity_from_batch in allocator.allocate(product.id, item_data['quantity']) or []:
+                if ledger.decrement_batch(line, batch, quantity_from_batch, product.name):
+                    db.session.add(BatchMovement(
+                        batch_id=batch.id,
+                        movement_type='sale',
+                        quantity=quantity_from_batch,
+                        reference_type='sale',
+                        reference_id=sale.id,
+                        user_id=current_user.id,
+                        notes=f'Vente validée {invoice_number} - {product.name}'
+                    ))
             
             movement = StockMovement(
                 product_id=product.id,
@@ -369,6 +408,14 @@ def validate_temp_sale(id):
             )
             db.session.add(movement)
         
+        if not ledger.ok:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': ledger.failures[0]['message'],
+                'failures': ledger.failures
+            }), 409
+        
         # Paiement
         payment = Payment(
             sale_id=sale.id,
@@ -402,6 +449,10 @@ def reject_temp_sale(id):
         return jsonify({'success': False, 'message': 'Vente déjà traitée'}), 400
     
     try:
+        if not claim_temp_sale(temp_sale, 'rejected'):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Vente déjà traitée'}), 400
+        
         data = request.get_json()
         rejection_reason = data.get('reason', 'Aucune raison fournie')
         
@@ -420,13 +471,6 @@ def reject_temp_sale(id):
 
 # ==================== ROUTES PROFORMA ====================
 
-def generate_proforma_number():
-    year = datetime.now().year
-    count = Proforma.query.filter(
-        db.extract('year', Proforma.issue_date) == year
-    ).count() + 1
-    return f'PROFORMA-{year}-{str(count).zfill(3)}'
-
 @sales_bp.route('/proforma/')
 @require_permission('manage_sales')
 def proforma_index():
@@ -695,7 +739,8 @@ def proforma_convert_to_sale(id):
     try:
         from app.models import Sale, SaleItem
         
-        invoice_number = f'INV-{datetime.now().strftime("%Y%m%d")}-{random.randint(1000, 9999)}'
+        primary_pharmacy = current_user.get_primary_pharmacy()
+        invoice_number = generate_invoice_number(primary_pharmacy.id if primary_pharmacy else None)
         
         sale = Sale(
             invoice_number=invoice_number,
@@ -721,6 +766,8 @@ def proforma_convert_to_sale(id):
         proforma.status = 'accepted'
         
         db.session.add(sale)
+        db.session.flush()
+        apply_sale_change(None, sale_snapshot(sale))
         db.session.commit()
         
         flash(f'Proforma convertie en vente {invoice_number}!', 'success')
@@ -740,10 +787,7 @@ def proforma_search_products():
     
     products = Product.query.filter(
         Product.is_active == True,
-        db.or_(
-            Product.name.ilike(f'%{query}%'),
-            Product.barcode.ilike(f'%{query}%')
-        )
+        text_search(Product, query)
     ).limit(20).all()
     
     return jsonify([{
@@ -6,9 +6,10 @@ from app.models import (
     Employee, Absence, SalaryPayment, LeaveRequest, CreditRequest, CashTransaction,
     Expense, Proforma, ProformaItem, Pharmacy, UserPharmacy, Notification,
     ValidationCode, EmployeeEvaluation, EvaluationCriteria, Task, Approval,
-    Supplier, SaleCredit, CreditPayment, CreditTerms, TempSale
+    Supplier, SaleCredit, CreditPayment, CreditTerms, TempSale, DailySalesSummary, AuditArchive
 )
 from app.decorators import require_permission
+from app.currency_utils import invalidate_exchange_rate
 
 settings_bp = Blueprint('settings', __name__, url_prefix='/settings')
 
@@ -222,6 +223,7 @@ def update_exchange_rate():
         db.session.add(audit)
         
         db.session.commit()
+        invalidate_exchange_rate()
         return jsonify({'success': True, 'message': 'Taux de change mis à jour avec succès!'})
         
     except Exception as e:
@@ -266,6 +268,7 @@ def activate_rate(rate_id):
         db.session.add(audit)
         
         db.session.commit()
+        invalidate_exchange_rate()
         return jsonify({'success': True, 'message': 'Taux activé avec succès!'})
         
     except Exception as e:
@@ -295,6 +298,7 @@ def delete_rate(rate_id):
         
         db.session.delete(rate)
         db.session.commit()
+        invalidate_exchange_rate()
         return jsonify({'success': True, 'message': 'Taux supprimé avec succès!'})
         
     except Exception as e:
@@ -346,6 +350,7 @@ def exchange_rates():
             db.session.add(audit)
             
             db.session.commit()
+            invalidate_exchange_rate()
             flash(f'Taux de change mis à jour et activé: 1 {from_currency} = {rate} {to_currency}', 'success')
             # Pattern PRG: éviter re-soumission et garantir l'état mis à jour
             return redirect(url_for('settings.exchange_rates'))
@@ -394,6 +399,7 @@ def update_system_config():
         )
         db.session.add(audit)
         db.session.commit()
+        SystemConfig.invalidate_cache()
         
         return jsonify({'success': True, 'message': 'Configurations mises à jour avec succès!'})
     except Exception as e:
@@ -429,6 +435,7 @@ def reset_database():
         # Supprimer toutes les données dans l'ordre correct (en respectant les foreign keys)
         # Supprimer tous les audits sauf celui que nous venons de créer
         Audit.query.filter(Audit.id != reset_audit.id).delete()
+        AuditArchive.query.delete()
         
         # Supprimer les notifications
         Notification.query.delete()
@@ -438,6 +445,7 @@ def reset_database():
         SalePayment.query.delete()
         Payment.query.delete()
         Sale.query.delete()
+        DailySalesSummary.query.delete()
         
         # Supprimer les proformas
         ProformaItem.query.delete()
@@ -1,9 +1,11 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from app.decorators import require_permission
 from flask_login import login_required, current_user
-from app.models import db, Product, StockMovement, ProductBatch, BatchMovement, Audit, Supplier
+from app.models import db, Product, StockMovement, ProductBatch, BatchMovement, Supplier, Pharmacy
+from app.helpers import ActivityLogger
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
-from app.export_utils import export_to_csv, export_to_excel
+from app.export_utils import export_to_csv, export_to_excel, iter_query
+from app.batch_stats import batch_stats, scope_pharmacy_ids
 from datetime import datetime, timedelta
 from sqlalchemy import or_, and_
 
@@ -67,15 +69,15 @@ def product_adjust(product_id):
             db.session.add(movement)
             
             # Audit
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='adjust_stock',
+                module='stock',
                 entity_type='product',
                 entity_id=product.id,
                 details=f'Stock ajusté: {adjustment_type} {quantity} unités. Raison: {reason}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             flash(f'Stock ajusté avec succès!', 'success')
@@ -94,26 +96,31 @@ def product_adjust(product_id):
 def export_movements(format):
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     
-    query = StockMovement.query.join(Product)
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        StockMovement.created_at, StockMovement.movement_type, StockMovement.quantity,
+        StockMovement.reference, StockMovement.notes,
+        Product.name.label('product_name'), Pharmacy.name.label('pharmacy_name')
+    ).join(Product, Product.id == StockMovement.product_id).outerjoin(
+        Pharmacy, Pharmacy.id == Product.pharmacy_id
+    )
     
     if is_admin():
         if pharmacy_filter and pharmacy_filter != 'all':
             query = query.filter(Product.pharmacy_id == pharmacy_filter)
     
-    movements = query.order_by(StockMovement.created_at.desc()).all()
+    query = query.order_by(StockMovement.created_at.desc())
     
     headers = ['Date', 'Produit', 'Type', 'Quantité', 'Référence', 'Notes', 'Pharmacie']
-    data = []
-    for m in movements:
-        data.append({
-            'Date': m.created_at.strftime('%d/%m/%Y %H:%M'),
-            'Produit': m.product.name,
-            'Type': 'Entrée' if m.movement_type == 'in' else 'Sortie',
-            'Quantité': m.quantity,
-            'Référence': m.reference or '',
-            'Notes': m.notes or '',
-            'Pharmacie': m.product.pharmacy.name if m.product.pharmacy else 'N/A'
-        })
+    data = ({
+        'Date': m.created_at,
+        'Produit': m.product_name,
+        'Type': 'Entrée' if m.movement_type == 'in' else 'Sortie',
+        'Quantité': m.quantity,
+        'Référence': m.reference or '',
+        'Notes': m.notes or '',
+        'Pharmacie': m.pharmacy_name or 'N/A'
+    } for m in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'mouvements_stock', headers)
@@ -153,14 +160,14 @@ def manual_adjust():
                                      created_by=current_user.id)
             db.session.add(movement)
 
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='stock_adjustment',
+                module='stock',
                 entity_type='stock',
-                details=
-                f'Ajustement stock: {product.name}, {movement_type}, {quantity}',
-                ip_address=request.remote_addr)
-            db.session.add(audit)
+                details=f'Ajustement stock: {product.name}, {movement_type}, {quantity}',
+                user_id=current_user.id,
+                on_commit=True
+            )
 
             db.session.commit()
 
@@ -206,30 +213,14 @@ def batches():
             )
         )
     
-    # Mettre à jour le statut de tous les lots avant affichage
-    all_batches_for_update = query.all()
-    for batch in all_batches_for_update:
-        batch.update_status()
-    db.session.commit()
-    
+    # Statuts tenus à jour par la maintenance périodique (app.maintenance)
     batches = query.order_by(ProductBatch.expiry_date.asc()).paginate(
         page=page, per_page=6, error_out=False
     )
     
-    # Statistiques
-    stats = {
-        'total': ProductBatch.query.count(),
-        'active': ProductBatch.query.filter_by(status='active').count(),
-        'expiring_soon': ProductBatch.query.filter(
-            and_(
-                ProductBatch.expiry_date <= datetime.now().date() + timedelta(days=90),
-                ProductBatch.expiry_date > datetime.now().date(),
-                ProductBatch.status == 'active'
-            )
-        ).count(),
-        'expired': ProductBatch.query.filter_by(status='expired').count(),
-        'depleted': ProductBatch.query.filter_by(status='depleted').count()
-    }
+    # Statistiques (une requête groupée, en cache par pharmacie)
+    counts = batch_stats.get(scope_pharmacy_ids(pharmacy_filter))
+    stats = {name: counts[name] for name in ('total', 'active', 'expiring_soon', 'expired', 'depleted')}
     
     pharmacies = get_accessible_pharmacies() if is_admin() else []
     return render_template('stock/batches.html', 
@@ -321,14 +312,14 @@ def add_batch():
             db.session.add(movement)
 
             # Audit
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='add_batch',
+                module='stock',
                 entity_type='batch',
                 details=f'Lot ajouté: {batch_number} pour {product.name} ({quantity} unités)',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
 
             db.session.commit()
 
@@ -435,14 +426,14 @@ def transfer():
             )
             db.session.add(movement_in)
             
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='stock_transfer',
+                module='stock',
                 entity_type='stock',
                 details=f'Transfert: {product.name} x{quantity} de {from_pharmacy.name} vers {to_pharmacy.name}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             
@@ -467,8 +458,6 @@ def transfer():
 def batch_view(id):
     """Vue détaillée d'un lot"""
     batch = ProductBatch.query.get_or_404(id)
-    batch.update_status()
-    db.session.commit()
     
     # Récupérer l'historique des mouvements
     movements = BatchMovement.query.filter_by(batch_id=id).order_by(
@@ -502,14 +491,14 @@ def batch_edit(id):
             batch.update_status()
             
             # Audit
-            audit = Audit(
-                user_id=current_user.id,
+            ActivityLogger.log(
                 action='edit_batch',
+                module='stock',
                 entity_type='batch',
                 details=f'Lot modifié: {batch.batch_number}',
-                ip_address=request.remote_addr
+                user_id=current_user.id,
+                on_commit=True
             )
-            db.session.add(audit)
             
             db.session.commit()
             flash('Lot modifié avec succès!', 'success')
@@ -585,45 +574,18 @@ def batches_expiring():
         if accessible_ids:
             query = query.filter(ProductBatch.pharmacy_id.in_(accessible_ids))
     
-    # Mettre à jour le statut
-    all_batches = query.all()
-    for batch in all_batches:
-        batch.update_status()
-    db.session.commit()
-    
+    # Statuts tenus à jour par la maintenance périodique (app.maintenance)
     batches = query.order_by(ProductBatch.expiry_date.asc()).paginate(
         page=page, per_page=20, error_out=False
     )
     
-    # Statistiques
+    # Statistiques (une requête groupée, en cache par pharmacie)
+    counts = batch_stats.get(scope_pharmacy_ids(pharmacy_filter))
     stats = {
-        'expired': ProductBatch.query.filter(
-            and_(
-                ProductBatch.expiry_date < datetime.now().date(),
-                ProductBatch.quantity > 0
-            )
-        ).count(),
-        'expiring_30': ProductBatch.query.filter(
-            and_(
-                ProductBatch.expiry_date <= datetime.now().date() + timedelta(days=30),
-                ProductBatch.expiry_date > datetime.now().date(),
-                ProductBatch.quantity > 0
-            )
-        ).count(),
-        'expiring_60': ProductBatch.query.filter(
-            and_(
-                ProductBatch.expiry_date <= datetime.now().date() + timedelta(days=60),
-                ProductBatch.expiry_date > datetime.now().date() + timedelta(days=30),
-                ProductBatch.quantity > 0
-            )
-        ).count(),
-        'expiring_90': ProductBatch.query.filter(
-            and_(
-                ProductBatch.expiry_date <= datetime.now().date() + timedelta(days=90),
-                ProductBatch.expiry_date > datetime.now().date() + timedelta(days=60),
-                ProductBatch.quantity > 0
-            )
-        ).count()
+        'expired': counts['expired_stock'],
+        'expiring_30': counts['expiring_30'],
+        'expiring_60': counts['expiring_60'],
+        'expiring_90': counts['expiring_90']
     }
     
     pharmacies = get_accessible_pharmacies() if is_admin() else []
@@ -642,7 +604,15 @@ def export_batches(format):
     pharmacy_filter = request.args.get('pharmacy_id', 'all')
     status_filter = request.args.get('status', 'all')
     
-    query = ProductBatch.query.join(Product)
+    # Seulement les colonnes exportées, lues par lots
+    query = db.session.query(
+        ProductBatch.batch_number, ProductBatch.quantity, ProductBatch.initial_quantity,
+        ProductBatch.purchase_price, ProductBatch.supplier, ProductBatch.manufacture_date,
+        ProductBatch.expiry_date, ProductBatch.status,
+        Product.name.label('product_name'), Pharmacy.name.label('pharmacy_name')
+    ).join(Product, Product.id == ProductBatch.product_id).outerjoin(
+        Pharmacy, Pharmacy.id == ProductBatch.pharmacy_id
+    )
     
     # Filtres
     if is_admin():
@@ -652,29 +622,29 @@ def export_batches(format):
     if status_filter and status_filter != 'all':
         query = query.filter(ProductBatch.status == status_filter)
     
-    batches = query.order_by(ProductBatch.expiry_date.asc()).all()
+    query = query.order_by(ProductBatch.expiry_date.asc())
     
     headers = ['Produit', 'N° Lot', 'Pharmacie', 'Quantité Actuelle', 'Quantité Initiale', 
                'Prix Achat', 'Fournisseur', 'Date Fabrication', 'Date Expiration', 
                'Jours Restants', 'Statut']
     
-    data = []
-    for batch in batches:
-        data.append({
-            'Produit': batch.product.name,
-            'N° Lot': batch.batch_number,
-            'Pharmacie': batch.pharmacy.name if batch.pharmacy else 'N/A',
-            'Quantité Actuelle': batch.quantity,
-            'Quantité Initiale': batch.initial_quantity,
-            'Prix Achat': f'${batch.purchase_price:.2f}',
-            'Fournisseur': batch.supplier or 'N/A',
-            'Date Fabrication': batch.manufacture_date.strftime('%d/%m/%Y') if batch.manufacture_date else 'N/A',
-            'Date Expiration': batch.expiry_date.strftime('%d/%m/%Y') if batch.expiry_date else 'N/A',
-            'Jours Restants': batch.days_until_expiry if batch.days_until_expiry is not None else 'N/A',
-            'Statut': batch.status.upper()
-        })
+    today = datetime.now().date()
+    data = ({
+        'Produit': b.product_name,
+        'N° Lot': b.batch_number,
+        'Pharmacie': b.pharmacy_name or 'N/A',
+        'Quantité Actuelle': b.quantity,
+        'Quantité Initiale': b.initial_quantity,
+        'Prix Achat': b.purchase_price,
+        'Fournisseur': b.supplier or 'N/A',
+        'Date Fabrication': b.manufacture_date or 'N/A',
+        'Date Expiration': b.expiry_date or 'N/A',
+        'Jours Restants': (b.expiry_date - today).days if b.expiry_date else 'N/A',
+        'Statut': (b.status or '').upper()
+    } for b in iter_query(query))
     
     if format == 'csv':
         return export_to_csv(data, 'lots_stock', headers)
     else:
-        return export_to_excel(data, 'lots_stock', headers, 'Lots')
+        return export_to_excel(data, 'lots_stock', headers, 'Lots',
+                               number_formats={'Prix Achat': '"$"#,##0.00'})
@@ -4,6 +4,8 @@ from flask_login import login_required, current_user
 from app.models import db, User, Audit, Pharmacy, UserPharmacy, Employee
 from app.pharmacy_utils import filter_by_pharmacy, get_accessible_pharmacies, is_admin
 from app.export_utils import export_to_csv, export_to_excel
+from app.audit_store import recent_audits
+from app.user_cache import user_cache
 from datetime import datetime, date
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
@@ -367,6 +369,7 @@ def edit(id):
             db.session.add(audit)
             
             db.session.commit()
+            user_cache.invalidate()
             
             flash('Utilisateur modifié avec succès!', 'success')
             return redirect(url_for('users.index'))
@@ -451,6 +454,7 @@ def delete(id):
         db.session.add(audit)
         
         db.session.commit()
+        user_cache.invalidate()
         flash('Utilisateur supprimé avec succès!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -485,6 +489,7 @@ def toggle_status(id):
     db.session.add(audit)
     
     db.session.commit()
+    user_cache.invalidate()
     
     flash(f'Utilisateur {"activé" if user.is_active else "désactivé"} avec succès!', 'success')
     return redirect(url_for('users.index'))
@@ -502,7 +507,7 @@ def login_history(id):
 def activity_log(id):
     """View user activity log"""
     user = User.query.get_or_404(id)
-    audits = Audit.query.filter_by(user_id=user.id).order_by(Audit.created_at.desc()).limit(50).all()
+    audits = recent_audits(user.id, limit=50)
     return render_template('users/activity_log.html', user=user, audits=audits)
 
 @users_bp.route('/reset-password/<int:id>', methods=['GET', 'POST'])
@@ -531,6 +536,7 @@ def reset_password(id):
         )
         db.session.add(audit)
         db.session.commit()
+        user_cache.invalidate()
         
         flash('Mot de passe réinitialisé avec succès!', 'success')
         return redirect(url_for('users.index'))
@@ -561,6 +567,7 @@ def manage_permissions(id):
         )
         db.session.add(audit)
         db.session.commit()
+        user_cache.invalidate()
         
         flash('Permissions modifiées avec succès!', 'success')
         return redirect(url_for('users.index'))
@@ -602,6 +609,7 @@ def assign_pharmacies(id):
         )
         db.session.add(audit)
         db.session.commit()
+        user_cache.invalidate()
         
         flash('Pharmacies assignées avec succès!', 'success')
         return redirect(url_for('users.index'))
@@ -633,6 +641,7 @@ def change_role(id):
         )
         db.session.add(audit)
         db.session.commit()
+        user_cache.invalidate()
         
         flash('Rôle changé avec succès!', 'success')
         return redirect(url_for('users.index'))
@@ -0,0 +1,210 @@
+"""
+Liste unifiée des ventes finales et temporaires (page sales.index)
+
+Les deux tables sont combinées par un UNION ALL exécuté en base et la
+pagination se fait par curseur (keyset) sur (date, type, id) : chaque page
+lit au plus `per_page + 1` lignes de chaque table en suivant les index sur
+sale_date / created_at, quelle que soit la profondeur de la page. Les noms
+du client et du vendeur sont joints dans la même requête.
+"""
+from datetime import datetime
+from sqlalchemy import and_, func, literal, or_, select, union_all
+from app.models import db, Sale, TempSale, Customer, User
+from app.pharmacy_utils import filter_by_pharmacy
+
+# Au-delà, le total affiché devient « N+ » au lieu d'un comptage exact
+COUNT_CAP = 1000
+
+
+def encode_cursor(row):
+    """Curseur d'une ligne de la liste: '<date ISO>~<type>~<id>'"""
+    return f"{row['date'].isoformat()}~{row['type']}~{row['id']}"
+
+
+def decode_cursor(cursor):
+    """Inverse de encode_cursor; None si le curseur est absent ou invalide"""
+    if not cursor:
+        return None
+    try:
+        date_str, kind, row_id = cursor.split('~')
+        if kind not in ('final', 'temp'):
+            return None
+        return datetime.fromisoformat(date_str), kind, int(row_id)
+    except ValueError:
+        return None
+
+
+def _seek(date_col, id_col, kind, cursor, backward=False):
+    """Condition keyset pour une branche de l'UNION
+
+    L'ordre est (date, type, id) décroissant. Le type étant constant dans
+    chaque branche, la comparaison de tuples se réduit à une condition sur
+    la date (et l'id à date égale), ce qui laisse la base utiliser l'index
+    sur la date.
+    """
+    c_date, c_kind, c_id = cursor
+    if backward:
+        # Lignes situées avant le curseur dans l'ordre d'affichage
+        if kind > c_kind:
+            return date_col >= c_date
+        if kind < c_kind:
+            return date_col > c_date
+        return or_(date_col > c_date, and_(date_col == c_date, id_col > c_id))
+
+    if kind < c_kind:
+        return date_col <= c_date
+    if kind > c_kind:
+        return date_col < c_date
+    return or_(date_col < c_date, and_(date_col == c_date, id_col < c_id))
+
+
+def _final_branch(search, status_filter, pharmacy_filter, cursor, backward, limit):
+    date_col = Sale.sale_date
+    stmt = select(
+        literal('final').label('type'),
+        Sale.id.label('id'),
+        Sale.invoice_number.label('reference'),
+        date_col.label('date'),
+        Customer.name.label('customer_name'),
+        User.first_name.label('seller_first_name'),
+        User.last_name.label('seller_last_name'),
+        Sale.total_amount.label('total'),
+        Sale.paid_amount.label('paid'),
+        Sale.payment_status.label('status'),
+        literal(None).label('sale_id'),
+    ).select_from(Sale).outerjoin(
+        Customer, Customer.id == Sale.customer_id
+    ).outerjoin(User, User.id == Sale.user_id)
+
+    stmt = filter_by_pharmacy(stmt, Sale, pharmacy_filter)
+    if search:
+        stmt = stmt.filter(Sale.invoice_number.ilike(f'%{search}%'))
+    if status_filter:
+        stmt = stmt.filter(Sale.payment_status == status_filter)
+    if cursor:
+        stmt = stmt.filter(_seek(date_col, Sale.id, 'final', cursor, backward))
+
+    order = (date_col.asc(), Sale.id.asc()) if backward else (date_col.desc(), Sale.id.desc())
+    return stmt.order_by(*order).limit(limit)
+
+
+def _temp_branch(search, pharmacy_filter, cursor, backward, limit):
+    date_col = TempSale.created_at
+    stmt = select(
+        literal('temp').label('type'),
+        TempSale.id.label('id'),
+        TempSale.reference.label('reference'),
+        date_col.label('date'),
+        Customer.name.label('customer_name'),
+        User.first_name.label('seller_first_name'),
+        User.last_name.label('seller_last_name'),
+        TempSale.total_amount.label('total'),
+        literal(0.0).label('paid'),
+        TempSale.status.label('status'),
+        TempSale.sale_id.label('sale_id'),
+    ).select_from(TempSale).outerjoin(
+        Customer, Customer.id == TempSale.customer_id
+    ).outerjoin(User, User.id == TempSale.created_by)
+
+    stmt = filter_by_pharmacy(stmt, TempSale, pharmacy_filter)
+    if search:
+        stmt = stmt.filter(TempSale.reference.ilike(f'%{search}%'))
+    if cursor:
+        stmt = stmt.filter(_seek(date_col, TempSale.id, 'temp', cursor, backward))
+
+    order = (date_col.asc(), TempSale.id.asc()) if backward else (date_col.desc(), TempSale.id.desc())
+    return stmt.order_by(*order).limit(limit)
+
+
+def _branches(view_type, search, status_filter, pharmacy_filter, cursor=None, backward=False, limit=None):
+    branches = []
+    if view_type in ('all', 'temp'):
+        branches.append(_temp_branch(search, pharmacy_filter, cursor, backward, limit))
+    if view_type in ('all', 'final'):
+        branches.append(_final_branch(search, status_filter, pharmacy_filter, cursor, backward, limit))
+    return branches
+
+
+def _to_dict(row):
+    seller = f"{row.seller_first_name or ''} {row.seller_last_name or ''}".strip()
+    return {
+        'type': row.type,
+        'id': row.id,
+        'reference': row.reference,
+        'date': row.date,
+        'customer': row.customer_name or 'Anonyme',
+        'seller': seller or 'N/A',
+        'total': row.total or 0.0,
+        'paid': row.paid or 0.0,
+        'status': row.status,
+        'sale_id': row.sale_id,
+    }
+
+
+def fetch_sales_page(view_type='all', search='', status_filter='', pharmacy_filter='all',
+                     after=None, before=None, per_page=10):
+    """
+    Charger une page de la liste unifiée
+
+    Args:
+        after: Curseur de la dernière ligne de la page précédente (page suivante)
+        before: Curseur de la première ligne de la page courante (page précédente)
+
+    Returns:
+        dict avec 'sales' (liste de dicts), 'next_cursor' et 'prev_cursor'
+        (None quand il n'y a pas de page dans ce sens)
+    """
+    backward = before is not None and after is None
+    cursor = decode_cursor(before if backward else after)
+    if cursor is None:
+        backward = False
+
+    branches = _branches(view_type, search, status_filter, pharmacy_filter,
+                         cursor, backward, per_page + 1)
+    if not branches:
+        return {'sales': [], 'next_cursor': None, 'prev_cursor': None}
+
+    # Chaque branche garde son ORDER BY/LIMIT : l'envelopper dans une sous-requête
+    combined = union_all(*[select(branch.subquery()) for branch in branches]).subquery()
+    if backward:
+        order = (combined.c.date.asc(), combined.c.type.asc(), combined.c.id.asc())
+    else:
+        order = (combined.c.date.desc(), combined.c.type.desc(), combined.c.id.desc())
+    rows = db.session.execute(
+        select(combined).order_by(*order).limit(per_page + 1)
+    ).all()
+
+    has_more = len(rows) > per_page
+    sales = [_to_dict(row) for row in rows[:per_page]]
+    if backward:
+        sales.reverse()
+
+    if not sales:
+        return {'sales': [], 'next_cursor': None, 'prev_cursor': None}
+
+    if backward:
+        # On vient d'une page plus récente : il y a forcément une page suivante
+        prev_cursor = encode_cursor(sales[0]) if has_more else None
+        next_cursor = encode_cursor(sales[-1])
+    else:
+        prev_cursor = encode_cursor(sales[0]) if cursor else None
+        next_cursor = encode_cursor(sales[-1]) if has_more else None
+
+    return {'sales': sales, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+def count_sales(view_type='all', search='', status_filter='', pharmacy_filter='all', cap=COUNT_CAP):
+    """
+    Nombre de lignes de la liste, plafonné à `cap`
+
+    Le comptage s'arrête après `cap` lignes par table : au-delà, la valeur
+    exacte n'apporte rien à l'écran et coûterait un parcours complet.
+
+    Returns:
+        Tuple (total, is_capped)
+    """
+    total = 0
+    for branch in _branches(view_type, search, status_filter, pharmacy_filter, limit=cap):
+        sub = branch.order_by(None).subquery()
+        total += db.session.execute(select(func.count()).select_from(sub)).scalar() or 0
+    return min(total, cap), total >= cap
@@ -0,0 +1,174 @@
+"""
+Récapitulatif journalier des ventes (table daily_sales_summary)
+
+Chaque route qui crée, modifie, supprime ou encaisse une vente prend une
+photo de la contribution de la vente avant la modification (sale_snapshot)
+puis appelle apply_sale_change(avant, après) avant le commit. Les compteurs
+sont mis à jour par UPDATE atomique (x = x + delta) dans la transaction de
+l'appelant, ce qui évite de relire les ventes.
+
+Les rapports sur plusieurs jours ou mois lisent ensuite quelques centaines
+de lignes agrégées au lieu de toutes les ventes.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Sale, DailySalesSummary
+
+
+def sale_snapshot(sale):
+    """Contribution d'une vente au récapitulatif: (clé, nb, total, payé, remise)"""
+    if sale is None or sale.sale_date is None:
+        return None
+    key = (sale.sale_date.date(), sale.pharmacy_id, sale.user_id, sale.payment_status)
+    return (key, 1, sale.total_amount or 0.0, sale.paid_amount or 0.0, sale.discount or 0.0)
+
+
+def _apply_delta(snapshot, sign):
+    """Ajouter (sign=1) ou retirer (sign=-1) une contribution"""
+    (summary_date, pharmacy_id, user_id, payment_status), count, total, paid, discount = snapshot
+    key = dict(summary_date=summary_date, pharmacy_id=pharmacy_id,
+               user_id=user_id, payment_status=payment_status)
+    values = {
+        DailySalesSummary.sales_count: DailySalesSummary.sales_count + sign * count,
+        DailySalesSummary.total_amount: DailySalesSummary.total_amount + sign * total,
+        DailySalesSummary.paid_amount: DailySalesSummary.paid_amount + sign * paid,
+        DailySalesSummary.discount_amount: DailySalesSummary.discount_amount + sign * discount,
+        DailySalesSummary.updated_at: datetime.utcnow(),
+    }
+
+    for _ in range(2):
+        row = db.session.query(DailySalesSummary.id).filter_by(**key).first()
+        if row:
+            DailySalesSummary.query.filter_by(id=row.id).update(values, synchronize_session=False)
+            return
+
+        # Première vente de la journée pour cette clé : insertion protégée par
+        # un savepoint, un autre worker a pu créer la ligne entre-temps
+        try:
+            with db.session.begin_nested():
+                db.session.add(DailySalesSummary(
+                    sales_count=sign * count,
+                    total_amount=sign * total,
+                    paid_amount=sign * paid,
+                    discount_amount=sign * discount,
+                    **key
+                ))
+            return
+        except IntegrityError:
+            continue
+
+
+def apply_sale_change(before, after):
+    """Répercuter le passage d'une vente de l'état `before` à l'état `after`
+
+    `before` vaut None pour une création, `after` vaut None pour une suppression.
+    """
+    if before == after:
+        return
+    if before is not None:
+        _apply_delta(before, -1)
+    if after is not None:
+        _apply_delta(after, 1)
+
+
+def rebuild_sales_summary(date_from=None, date_to=None):
+    """Reconstruire le récapitulatif depuis la table sales (dates incluses)
+
+    Returns:
+        Nombre de lignes de récapitulatif écrites
+    """
+    day = func.date(Sale.sale_date)
+    sales_query = db.session.query(
+        day.label('summary_date'),
+        Sale.pharmacy_id,
+        Sale.user_id,
+        Sale.payment_status,
+        func.count(Sale.id).label('sales_count'),
+        func.coalesce(func.sum(Sale.total_amount), 0).label('total_amount'),
+        func.coalesce(func.sum(Sale.paid_amount), 0).label('paid_amount'),
+        func.coalesce(func.sum(Sale.discount), 0).label('discount_amount'),
+    ).filter(Sale.sale_date != None)
+    delete_query = DailySalesSummary.query
+
+    if date_from:
+        sales_query = sales_query.filter(Sale.sale_date >= datetime.combine(date_from, datetime.min.time()))
+        delete_query = delete_query.filter(DailySalesSummary.summary_date >= date_from)
+    if date_to:
+        sales_query = sales_query.filter(Sale.sale_date < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+        delete_query = delete_query.filter(DailySalesSummary.summary_date <= date_to)
+
+    rows = sales_query.group_by(day, Sale.pharmacy_id, Sale.user_id, Sale.payment_status).all()
+
+    delete_query.delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    summaries = []
+    for row in rows:
+        summary_date = row.summary_date
+        if isinstance(summary_date, str):
+            summary_date = date.fromisoformat(summary_date)
+        summaries.append({
+            'summary_date': summary_date,
+            'pharmacy_id': row.pharmacy_id,
+            'user_id': row.user_id,
+            'payment_status': row.payment_status,
+            'sales_count': row.sales_count,
+            'total_amount': float(row.total_amount),
+            'paid_amount': float(row.paid_amount),
+            'discount_amount': float(row.discount_amount),
+            'updated_at': now,
+        })
+
+    if summaries:
+        db.session.execute(insert(DailySalesSummary), summaries)
+    db.session.commit()
+    return len(summaries)
+
+
+def summary_query(date_from=None, date_to=None, *columns):
+    """Requête sur le récapitulatif bornée à [date_from, date_to] (dates incluses)"""
+    query = db.session.query(*columns)
+    if date_from:
+        query = query.filter(DailySalesSummary.summary_date >= date_from)
+    if date_to:
+        query = query.filter(DailySalesSummary.summary_date <= date_to)
+    return query
+
+
+def summary_totals(date_from=None, date_to=None, pharmacy_filter='all'):
+    """Totaux des ventes sur une période selon le scope de l'utilisateur"""
+    from app.pharmacy_utils import filter_by_pharmacy
+
+    query = summary_query(
+        date_from, date_to,
+        func.coalesce(func.sum(DailySalesSummary.sales_count), 0).label('sales_count'),
+        func.coalesce(func.sum(DailySalesSummary.total_amount), 0).label('total_amount'),
+        func.coalesce(func.sum(DailySalesSummary.paid_amount), 0).label('paid_amount'),
+    )
+    row = filter_by_pharmacy(query, DailySalesSummary, pharmacy_filter).one()
+    return {
+        'sales_count': int(row.sales_count or 0),
+        'total_amount': float(row.total_amount or 0),
+        'paid_amount': float(row.paid_amount or 0),
+    }
+
+
+def summary_by_pharmacy(date_from=None, date_to=None):
+    """Totaux des ventes groupés par pharmacie: {pharmacy_id: dict}"""
+    rows = summary_query(
+        date_from, date_to,
+        DailySalesSummary.pharmacy_id,
+        func.coalesce(func.sum(DailySalesSummary.sales_count), 0).label('sales_count'),
+        func.coalesce(func.sum(DailySalesSummary.total_amount), 0).label('total_amount'),
+        func.coalesce(func.sum(DailySalesSummary.paid_amount), 0).label('paid_amount'),
+    ).group_by(DailySalesSummary.pharmacy_id).all()
+
+    return {
+        row.pharmacy_id: {
+            'sales_count': int(row.sales_count or 0),
+            'total_amount': float(row.total_amount or 0),
+            'paid_amount': float(row.paid_amount or 0),
+        }
+        for row in rows
+    }
@@ -0,0 +1,388 @@
+"""
+Recherche texte : produits, clients, journal d'audit
+
+Un ILIKE '%q%' ne peut pas utiliser les index B-tree sur name/barcode :
+chaque frappe dans la recherche de la caisse parcourait toute la table.
+search(Model, q) renvoie une condition à passer à query.filter(), produite
+par le moteur disponible pour la base :
+
+- MySQL : index FULLTEXT (parser ngram), tenu à jour par InnoDB ;
+- SQLite : table FTS5 (tokenizer trigram) tenue à jour par des triggers ;
+- sinon : index de trigrammes en mémoire pour les produits et les clients,
+  mis à jour après chaque commit et reconstruit toutes les SEARCH_INDEX_TTL
+  secondes (modifications faites par les autres workers).
+
+Les trois moteurs cherchent une sous-chaîne, comme l'ancien ILIKE. Les
+termes trop courts pour l'index sont cherchés en préfixe (LIKE 'q%'), ce
+qui utilise les index B-tree.
+
+Les index FULLTEXT / FTS5 sont créés par `flask create-search-indexes`
+(jamais au démarrage des workers : un ALTER TABLE concurrent pouvait échouer
+dans un worker seulement). Au démarrage, chaque worker vérifie seulement
+qu'ils existent ; s'il en manque un, tous les workers utilisent l'index en
+mémoire et un avertissement est affiché.
+
+MySQL : les mots vides (stopwords) InnoDB doivent être désactivés
+(innodb_ft_enable_stopword=OFF dans my.cnf), sinon le parser ngram écarte
+les n-grammes qui en contiennent et certaines sous-chaînes ne sont pas
+trouvées. La commande crée l'index avec la variable de session à OFF.
+"""
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from sqlalchemy import event, false, inspect, literal_column, or_, select, table as sql_table, text
+from sqlalchemy.orm import Session, object_session
+from app.models import db
+
+# Colonnes indexées par table (un index texte par table)
+SEARCH_FIELDS = {
+    'products': ('name', 'barcode', 'category'),
+    'customers': ('name', 'email', 'phone'),
+    'audits': ('action', 'details'),
+    'audits_archive': ('action', 'details'),
+}
+
+_PENDING_KEY = 'pending_search'
+
+
+class LikeSearch:
+    """Recherche ILIKE, sans index (dernier recours)"""
+    name = 'like'
+    min_length = 1
+
+    def ready(self, conn, table, fields):
+        return True
+
+    def setup(self, conn, table, fields):
+        pass
+
+    def clause(self, table, fields, value):
+        return or_(*(table.c[field].ilike(f'%{value}%') for field in fields))
+
+
+class MySQLFulltextSearch:
+    """Index FULLTEXT InnoDB avec le parser ngram (sous-chaînes)"""
+    name = 'mysql-fulltext'
+    # ngram_token_size par défaut
+    min_length = 2
+
+    @staticmethod
+    def stopwords_enabled(conn):
+        return bool(conn.execute(text("SELECT @@GLOBAL.innodb_ft_enable_stopword")).scalar())
+
+    def ready(self, conn, table, fields):
+        index_name = f'ft_{table.name}_search'
+        return index_name in {index['name'] for index in inspect(conn).get_indexes(table.name)}
+
+    def setup(self, conn, table, fields):
+        if self.ready(conn, table, fields):
+            return
+        index_name = f'ft_{table.name}_search'
+        print(f"Création de l'index FULLTEXT {index_name}...")
+        # Sans mots vides : le parser ngram écarterait les n-grammes qui en contiennent
+        conn.execute(text("SET SESSION innodb_ft_enable_stopword = OFF"))
+        conn.execute(text(
+            f"ALTER TABLE {table.name} ADD FULLTEXT INDEX {index_name} "
+            f"({', '.join(fields)}) WITH PARSER ngram"
+        ))
+
+    def clause(self, table, fields, value):
+        from sqlalchemy.dialects.mysql import match
+        # Phrase entre guillemets : les ngrams doivent se suivre (= sous-chaîne)
+        phrase = '"' + value.replace('"', ' ') + '"'
+        return match(*(table.c[field] for field in fields), against=phrase).in_boolean_mode()
+
+
+class SQLiteFTSSearch:
+    """Table FTS5 à contenu externe, tokenizer trigram (SQLite >= 3.34)"""
+    name = 'sqlite-fts5'
+    min_length = 3
+
+    @staticmethod
+    def available(conn):
+        try:
+            conn.execute(text("CREATE VIRTUAL TABLE temp.search_probe USING fts5(value, tokenize='trigram')"))
+            conn.execute(text("DROP TABLE temp.search_probe"))
+            return True
+        except Exception:
+            return False
+
+    def ready(self, conn, table, fields):
+        fts = f'{table.name}_fts'
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': fts}
+        ).first() is not None
+
+    def setup(self, conn, table, fields):
+        if self.ready(conn, table, fields):
+            return
+        fts = f'{table.name}_fts'
+
+        print(f"Création de l'index FTS5 {fts}...")
+        columns = ', '.join(fields)
+        new_values = ', '.join(f'new.{field}' for field in fields)
+        old_values = ', '.join(f'old.{field}' for field in fields)
+        delete_old = (
+            f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+        )
+        insert_new = f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});"
+
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, "
+            f"content='{table.name}', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table.name} BEGIN {insert_new} END"))
+        conn.execute(text(f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table.name} BEGIN {delete_old} END"))
+        conn.execute(text(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table.name} BEGIN {delete_old} {insert_new} END"
+        ))
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+    def clause(self, table, fields, value):
+        fts = f'{table.name}_fts'
+        phrase = '"' + value.replace('"', '""') + '"'
+        return table.c.id.in_(
+            select(literal_column('rowid')).select_from(sql_table(fts))
+            .where(literal_column(fts).op('MATCH')(phrase))
+        )
+
+
+# ----------------------------------------------------------------------
+# Index de trigrammes en mémoire
+# ----------------------------------------------------------------------
+
+def normalize(value):
+    """Minuscules sans accents"""
+    value = unicodedata.normalize('NFKD', str(value or '').lower())
+    return ''.join(char for char in value if not unicodedata.combining(char))
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex:
+    """Trigramme -> ids des documents qui le contiennent"""
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        self.built_at = 0
+
+    def add(self, doc_id, values):
+        self.remove(doc_id)
+        # Séparateur : aucun trigramme ne chevauche deux colonnes
+        document = '\x1f'.join(normalize(value) for value in values)
+        self.documents[doc_id] = document
+        for gram in trigrams(document):
+            self.postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        for gram in trigrams(document):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def lookup(self, value):
+        value = normalize(value)
+        # Intersection en commençant par le trigramme le plus rare
+        grams = sorted(trigrams(value), key=lambda gram: len(self.postings.get(gram, ())))
+        if not grams:
+            return []
+        candidates = set(self.postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self.postings.get(gram, set())
+        # Les trigrammes ne garantissent pas l'ordre : vérifier la sous-chaîne
+        return [doc_id for doc_id in candidates if value in self.documents[doc_id]]
+
+
+class TrigramSearch:
+    """Index de trigrammes en mémoire pour les petites tables (produits, clients)"""
+    name = 'trigram'
+    min_length = 3
+    indexed_tables = ('products', 'customers')
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def ready(self, conn, table, fields):
+        return True
+
+    def setup(self, conn, table, fields):
+        pass
+
+    def clause(self, table, fields, value):
+        if table.name not in self.indexed_tables:
+            return LikeSearch().clause(table, fields, value)
+        ids = self._index(table, fields).lookup(value)
+        return table.c.id.in_(ids) if ids else false()
+
+    def _index(self, table, fields):
+        with self._lock:
+            index = self._indexes.get(table.name)
+            if index is None or time.time() - index.built_at > self.ttl:
+                index = TrigramIndex()
+                with db.engine.connect() as conn:
+                    rows = conn.execute(select(table.c.id, *(table.c[field] for field in fields)))
+                    for row in rows:
+                        index.add(row[0], row[1:])
+                index.built_at = time.time()
+                self._indexes[table.name] = index
+            return index
+
+    def invalidate(self, table_name):
+        """Reconstruire l'index de la table à la prochaine recherche"""
+        with self._lock:
+            self._indexes.pop(table_name, None)
+
+    def apply(self, changes):
+        """Reporter les modifications validées dans les index déjà construits"""
+        with self._lock:
+            for table_name, doc_id, values in changes:
+                index = self._indexes.get(table_name)
+                if index is None:
+                    continue
+                if values is None:
+                    index.remove(doc_id)
+                else:
+                    index.add(doc_id, values)
+
+
+# ----------------------------------------------------------------------
+# Choix du moteur
+# ----------------------------------------------------------------------
+
+class SearchIndex:
+    """Moteur de recherche de l'application (choisi selon la base)"""
+
+    def __init__(self):
+        self.backend = LikeSearch()
+        self.ttl = 60
+
+    def init_app(self, app):
+        """
+        Choisir le moteur (contexte d'application requis), sans créer d'index
+
+        Le choix ne dépend que de l'état de la base : tous les workers
+        utilisent le même moteur.
+        """
+        self.ttl = app.config.get('SEARCH_INDEX_TTL', 60)
+        with db.engine.connect() as conn:
+            backend = self._database_backend(conn)
+            missing = [table_name for table_name, fields in SEARCH_FIELDS.items()
+                       if not backend.ready(conn, db.metadata.tables[table_name], fields)]
+            if isinstance(backend, MySQLFulltextSearch) and backend.stopwords_enabled(conn):
+                print("ATTENTION recherche: innodb_ft_enable_stopword=ON, certaines sous-chaînes "
+                      "ne seront pas trouvées (mettre OFF dans la configuration MySQL)")
+
+        if missing:
+            print(f"ATTENTION recherche: index {backend.name} manquant(s) ({', '.join(missing)}), "
+                  f"index en mémoire utilisé ; exécuter `flask create-search-indexes` puis redémarrer")
+            backend = TrigramSearch(self.ttl)
+
+        self.backend = backend
+        if isinstance(backend, TrigramSearch):
+            _listen_changes()
+        return backend
+
+    def create_indexes(self):
+        """
+        Créer les index FULLTEXT / FTS5 manquants (`flask create-search-indexes`)
+
+        Une erreur (verrou, droits) est remontée telle quelle.
+        """
+        with db.engine.begin() as conn:
+            backend = self._database_backend(conn)
+            for table_name, fields in SEARCH_FIELDS.items():
+                backend.setup(conn, db.metadata.tables[table_name], fields)
+        return backend
+
+    def _database_backend(self, conn):
+        dialect = conn.dialect.name
+        if dialect == 'mysql':
+            return MySQLFulltextSearch()
+        if dialect == 'sqlite' and SQLiteFTSSearch.available(conn):
+            return SQLiteFTSSearch()
+        return TrigramSearch(self.ttl)
+
+    def invalidate(self, table_name):
+        """
+        À appeler après les écritures qui ne passent pas par l'ORM
+        (INSERT/UPDATE groupés). FULLTEXT et FTS5 suivent la table d'eux-mêmes.
+        """
+        if isinstance(self.backend, TrigramSearch):
+            self.backend.invalidate(table_name)
+
+
+search_index = SearchIndex()
+
+
+def search(target, value):
+    """
+    Condition de recherche texte sur un modèle ou une table de SEARCH_FIELDS
+
+    Exemple: Product.query.filter(search(Product, q))
+    """
+    table = getattr(target, '__table__', target)
+    fields = SEARCH_FIELDS[table.name]
+    value = (value or '').strip()
+    backend = search_index.backend
+
+    if len(value) < backend.min_length:
+        # Trop court pour l'index : recherche en préfixe (index B-tree)
+        return or_(*(table.c[field].like(f'{value}%') for field in fields))
+    return backend.clause(table, fields, value)
+
+
+# ----------------------------------------------------------------------
+# Synchronisation de l'index en mémoire
+# ----------------------------------------------------------------------
+
+def _record_change(mapper, connection, target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    table = mapper.local_table
+    values = None if deleted else [getattr(target, field) for field in SEARCH_FIELDS[table.name]]
+    session.info.setdefault(_PENDING_KEY, []).append((table.name, target.id, values))
+
+
+def _after_insert_or_update(mapper, connection, target):
+    _record_change(mapper, connection, target)
+
+
+def _after_delete(mapper, connection, target):
+    _record_change(mapper, connection, target, deleted=True)
+
+
+def _after_commit(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if changes and isinstance(search_index.backend, TrigramSearch):
+        search_index.backend.apply(changes)
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def _listen_changes():
+    from app.models import Product, Customer
+    if event.contains(Session, 'after_commit', _after_commit):
+        return
+    for model in (Product, Customer):
+        event.listen(model, 'after_insert', _after_insert_or_update)
+        event.listen(model, 'after_update', _after_insert_or_update)
+        event.listen(model, 'after_delete', _after_delete)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_transaction_end', _after_transaction_end)
@@ -0,0 +1,201 @@
+"""
+Photos périodiques du stock et stock à une date passée (table stock_snapshots)
+
+reports.stock ne connaît que Product.stock_quantity : pour connaître le stock
+ou sa valeur à une date passée, il fallait rejouer tout l'historique de
+stock_movements. Une photo (quantité, prix d'achat, valeur) de chaque produit
+est maintenant écrite une fois par jour par la maintenance périodique ; après
+STOCK_SNAPSHOT_DAILY_RETENTION_DAYS, seule la dernière photo de chaque mois
+est gardée.
+
+Le stock à une date part de la photo la plus proche avant la date et rejoue
+seulement les mouvements enregistrés depuis (un jour au plus pour les dates
+récentes, un mois au plus pour les fins de mois anciennes). Les produits
+créés après la photo partent du stock actuel en retirant les mouvements
+postérieurs à la date.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import case, delete, func, insert, literal, or_, select
+from app.models import db, Product, StockMovement, StockSnapshot
+
+# Mouvements qui ajoutent du stock (les autres en retirent)
+INCOMING_TYPES = ('in', 'transfer_in', 'return')
+
+# Au-delà, les mouvements des produits sans photo sont filtrés par la portée
+# plutôt que par une liste d'identifiants
+_MAX_ID_FILTER = 500
+
+
+def take_snapshot(now=None):
+    """
+    Photo du stock de tous les produits (INSERT ... SELECT), une par jour
+
+    Returns:
+        Nombre de produits photographiés (0 si la photo du jour existe déjà)
+    """
+    now = now or datetime.utcnow()
+    snapshot_date = now.date()
+    if db.session.query(StockSnapshot.id).filter(StockSnapshot.snapshot_date == snapshot_date).first():
+        return 0
+
+    products = Product.__table__.c
+    quantity = func.coalesce(products.stock_quantity, 0)
+    unit_cost = func.coalesce(products.purchase_price, 0.0)
+    columns = ['snapshot_date', 'product_id', 'pharmacy_id', 'quantity', 'unit_cost', 'value', 'taken_at']
+    with db.engine.begin() as conn:
+        result = conn.execute(insert(StockSnapshot.__table__).from_select(columns, select(
+            literal(snapshot_date, db.Date), products.id, products.pharmacy_id,
+            quantity, unit_cost, quantity * unit_cost, literal(now, db.DateTime)
+        )))
+    return result.rowcount
+
+
+def purge_snapshots(before):
+    """
+    Supprimer les photos journalières antérieures à `before`, sauf la
+    dernière photo de chaque mois
+
+    Returns:
+        Nombre de lignes supprimées
+    """
+    dates = [row[0] for row in db.session.query(StockSnapshot.snapshot_date)
+             .filter(StockSnapshot.snapshot_date < before).distinct()]
+    month_ends = {}
+    for snapshot_date in dates:
+        key = (snapshot_date.year, snapshot_date.month)
+        month_ends[key] = max(month_ends.get(key, snapshot_date), snapshot_date)
+    dropped = [snapshot_date for snapshot_date in dates
+               if month_ends[(snapshot_date.year, snapshot_date.month)] != snapshot_date]
+    if not dropped:
+        return 0
+    table = StockSnapshot.__table__
+    with db.engine.begin() as conn:
+        return conn.execute(delete(table).where(table.c.snapshot_date.in_(dropped))).rowcount
+
+
+def _signed_quantity():
+    return case(
+        (StockMovement.movement_type.in_(INCOMING_TYPES), StockMovement.quantity),
+        else_=-StockMovement.quantity
+    )
+
+
+def _movement_totals(scope, since=None, after=None, until=None, product_ids=None):
+    """Somme signée des mouvements par produit (depuis `since` inclus ou
+    après `after`, jusqu'à `until` exclu)"""
+    query = db.session.query(StockMovement.product_id, func.sum(_signed_quantity()))
+    if since is not None:
+        query = query.filter(StockMovement.created_at >= since)
+    if after is not None:
+        query = query.filter(StockMovement.created_at > after)
+    if until is not None:
+        query = query.filter(StockMovement.created_at < until)
+    if product_ids is not None:
+        query = query.filter(StockMovement.product_id.in_(product_ids))
+    else:
+        query = scope(query, StockMovement.product_id)
+    return {product_id: int(total or 0) for product_id, total in query.group_by(StockMovement.product_id)}
+
+
+def stock_as_of(as_of, product_query=None):
+    """
+    Stock de chaque produit à la fin du jour `as_of`
+
+    Args:
+        as_of: date
+        product_query: requête Product déjà filtrée (portée de l'utilisateur),
+            tous les produits par défaut
+
+    Returns:
+        {product_id: {'pharmacy_id', 'quantity', 'unit_cost', 'value'}}
+    """
+    instant = datetime.combine(as_of + timedelta(days=1), time.min)
+
+    def scope(query, column):
+        if product_query is None:
+            return query
+        ids = product_query.with_entities(Product.id).order_by(None).statement
+        return query.filter(column.in_(ids))
+
+    products = scope(db.session.query(
+        Product.id, Product.pharmacy_id, Product.stock_quantity, Product.purchase_price
+    ), Product.id)
+
+    def current(product):
+        return {'pharmacy_id': product.pharmacy_id,
+                'quantity': product.stock_quantity or 0,
+                'unit_cost': product.purchase_price or 0.0}
+
+    stock = {}
+    if instant > datetime.utcnow():
+        # Date du jour ou future : stock actuel
+        stock = {product.id: current(product) for product in products}
+    else:
+        base_date = db.session.query(func.max(StockSnapshot.snapshot_date)).filter(
+            StockSnapshot.snapshot_date <= as_of
+        ).scalar()
+        if base_date is not None:
+            rows = scope(db.session.query(
+                StockSnapshot.product_id, StockSnapshot.pharmacy_id, StockSnapshot.quantity,
+                StockSnapshot.unit_cost, StockSnapshot.taken_at
+            ).filter(StockSnapshot.snapshot_date == base_date), StockSnapshot.product_id)
+            taken_at = None
+            for row in rows:
+                stock[row.product_id] = {'pharmacy_id': row.pharmacy_id,
+                                         'quantity': row.quantity,
+                                         'unit_cost': row.unit_cost}
+                taken_at = row.taken_at
+            # Mouvements entre la photo et la fin du jour demandé
+            if taken_at is not None:
+                for product_id, delta in _movement_totals(scope, after=taken_at, until=instant).items():
+                    if product_id in stock:
+                        stock[product_id]['quantity'] += delta
+
+        # Produits sans photo (créés depuis, ou date antérieure à la première
+        # photo) : stock actuel moins les mouvements postérieurs à la date
+        created = products.filter(or_(Product.created_at == None, Product.created_at < instant))
+        missing = {product.id: current(product) for product in created if product.id not in stock}
+        if missing:
+            ids = list(missing) if len(missing) <= _MAX_ID_FILTER else None
+            for product_id, delta in _movement_totals(scope, since=instant, product_ids=ids).items():
+                if product_id in missing:
+                    missing[product_id]['quantity'] -= delta
+            stock.update(missing)
+
+    for entry in stock.values():
+        entry['value'] = entry['quantity'] * (entry['unit_cost'] or 0.0)
+    return stock
+
+
+def summarize_stock(stock):
+    """
+    Totaux d'un résultat de stock_as_of (produits en stock seulement)
+
+    Returns:
+        {'quantity', 'value', 'products', 'pharmacies': {pharmacy_id: {'quantity', 'value', 'products'}}}
+    """
+    totals = {'quantity': 0, 'value': 0.0, 'products': 0, 'pharmacies': {}}
+    for entry in stock.values():
+        if not entry['quantity']:
+            continue
+        pharmacy = totals['pharmacies'].setdefault(entry['pharmacy_id'], {'quantity': 0, 'value': 0.0, 'products': 0})
+        for bucket in (totals, pharmacy):
+            bucket['quantity'] += entry['quantity']
+            bucket['value'] += entry['value']
+            bucket['products'] += 1
+    return totals
+
+
+def valuation_as_of(as_of, product_query=None):
+    """Valeur du stock (prix d'achat) à la fin du jour `as_of` (voir summarize_stock)"""
+    return summarize_stock(stock_as_of(as_of, product_query))
+
+
+def month_ends(count, today=None):
+    """Derniers jours des `count` mois terminés, du plus récent au plus ancien"""
+    day = (today or date.today()).replace(day=1) - timedelta(days=1)
+    result = []
+    for _ in range(count):
+        result.append(day)
+        day = day.replace(day=1) - timedelta(days=1)
+    return result
@@ -0,0 +1,185 @@
+"""
+Outils de stock partagés par le POS et la validation des ventes temporaires
+"""
+from datetime import datetime
+from sqlalchemy import or_, update, case
+from app.models import db, Product, ProductBatch
+from app.catalog_index import catalog_index
+from app.batch_stats import batch_stats
+
+
+class FefoAllocator:
+    """
+    Allocation FEFO (First Expired First Out) pour tout un panier
+
+    Les produits et tous leurs lots candidats sont chargés en deux requêtes,
+    quel que soit le nombre de lignes : les lots expirés, épuisés ou inactifs
+    sont exclus en SQL et les lots sont verrouillés (SELECT ... FOR UPDATE)
+    jusqu'à la fin de la transaction. L'allocation se fait ensuite en mémoire,
+    sans modifier les objets : les décréments passent par StockLedger.
+    """
+
+    def __init__(self, product_ids, pharmacy_id, lock=True):
+        product_ids = sorted({int(pid) for pid in product_ids})
+        self.pharmacy_id = pharmacy_id
+        self.taken = {}
+
+        products_query = Product.query.filter(Product.id.in_(product_ids))
+        self.products = {p.id: p for p in products_query.all()} if product_ids else {}
+
+        self.batches = {pid: [] for pid in product_ids}
+        if not product_ids:
+            return
+
+        today = datetime.now().date()
+        batches_query = ProductBatch.query.filter(
+            ProductBatch.product_id.in_(product_ids),
+            ProductBatch.pharmacy_id == pharmacy_id,
+            ProductBatch.status == 'active',
+            ProductBatch.quantity > 0,
+            ProductBatch.is_active == True,
+            or_(ProductBatch.expiry_date == None, ProductBatch.expiry_date >= today)
+        ).order_by(
+            ProductBatch.product_id.asc(),
+            ProductBatch.expiry_date.asc(),  # Plus ancien expire en premier
+            ProductBatch.received_date.asc(),  # Si même expiration, plus ancien reçu en premier
+            ProductBatch.id.asc()
+        )
+        if lock:
+            # Ordre de verrouillage stable (produit, expiration, id) pour éviter les interblocages
+            batches_query = batches_query.with_for_update()
+
+        for batch in batches_query.all():
+            self.batches[batch.product_id].append(batch)
+
+    def get_product(self, product_id):
+        """Produit chargé pour le panier (None si introuvable)"""
+        return self.products.get(int(product_id))
+
+    def remaining(self, batch):
+        """Quantité du lot non encore allouée dans ce panier"""
+        return batch.quantity - self.taken.get(batch.id, 0)
+
+    def available(self, product_id):
+        """Quantité disponible dans les lots non expirés"""
+        return sum(self.remaining(batch) for batch in self.batches.get(int(product_id), []))
+
+    def allocate(self, product_id, quantity_needed):
+        """
+        Répartir une quantité sur les lots selon FEFO
+
+        Les quantités déjà allouées par les lignes précédentes du même panier
+        sont prises en compte.
+
+        Returns:
+            Liste de tuples (batch, quantity_to_take) ou None si stock insuffisant
+        """
+        batches = self.batches.get(int(product_id), [])
+        if self.available(product_id) < quantity_needed:
+            return None
+
+        batches_to_use = []
+        remaining_quantity = quantity_needed
+        for batch in batches:
+            if remaining_quantity <= 0:
+                break
+            batch_remaining = self.remaining(batch)
+            if batch_remaining <= 0:
+                continue
+
+            quantity_from_batch = min(batch_remaining, remaining_quantity)
+            batches_to_use.append((batch, quantity_from_batch))
+            self.taken[batch.id] = self.taken.get(batch.id, 0) + quantity_from_batch
+            remaining_quantity -= quantity_from_batch
+
+        return batches_to_use
+
+
+class StockLedger:
+    """
+    Décréments de stock atomiques pour les ventes
+
+    Chaque décrément est un UPDATE conditionnel exécuté par la base :
+        UPDATE products SET stock_quantity = stock_quantity - :q
+        WHERE id = :id AND stock_quantity >= :q
+    Deux caisses qui vendent le même produit en même temps ne peuvent donc
+    pas perdre de mise à jour ni vendre plus que le stock, sans sérialiser
+    les caisses. Les lignes refusées sont collectées dans `failures` ; c'est
+    à l'appelant d'annuler la transaction s'il y en a.
+    """
+
+    def __init__(self):
+        self.failures = []
+
+    def _fail(self, line, product_name, message):
+        self.failures.append({'line': line, 'product': product_name, 'message': message})
+        return False
+
+    def decrement_product(self, line, product, quantity):
+        """Retirer `quantity` du stock global du produit"""
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id == product.id, Product.stock_quantity >= quantity)
+            .values(stock_quantity=Product.stock_quantity - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            return self._fail(line, product.name, f'Stock insuffisant pour {product.name}')
+        catalog_index.note_stock_change(product.id, -quantity)
+        return True
+
+    def decrement_products(self, lines):
+        """
+        Retirer le stock de toutes les lignes d'un panier, par id de produit croissant
+
+        Dans l'ordre du panier, deux caisses vendant A,B et B,A verrouilleraient
+        les lignes products dans des ordres opposés (interblocage MySQL) ;
+        comme pour les lots (FefoAllocator), l'ordre de verrouillage est stable.
+
+        Args:
+            lines: liste de (ligne, produit, quantité)
+
+        Returns:
+            Ensemble des numéros de ligne décrémentés
+        """
+        done = set()
+        for line, product, quantity in sorted(lines, key=lambda entry: (entry[1].id, entry[0])):
+            if self.decrement_product(line, product, quantity):
+                done.add(line)
+        return done
+
+    def increment_product(self, product, quantity):
+        """Remettre `quantity` dans le stock global du produit (vente modifiée ou supprimée)"""
+        db.session.execute(
+            update(Product)
+            .where(Product.id == product.id)
+            .values(stock_quantity=Product.stock_quantity + quantity)
+            .execution_options(synchronize_session=False)
+        )
+        catalog_index.note_stock_change(product.id, quantity)
+
+    def decrement_batch(self, line, batch, quantity, product_name=None):
+        """Retirer `quantity` d'un lot et le marquer épuisé s'il tombe à zéro"""
+        # Le statut est calculé avant la quantité : MySQL évalue les SET de gauche à droite
+        result = db.session.execute(
+            update(ProductBatch)
+            .where(ProductBatch.id == batch.id, ProductBatch.quantity >= quantity)
+            .ordered_values(
+                (ProductBatch.status, case(
+                    (ProductBatch.quantity - quantity <= 0, 'depleted'),
+                    else_=ProductBatch.status
+                )),
+                (ProductBatch.quantity, ProductBatch.quantity - quantity),
+                (ProductBatch.updated_at, datetime.utcnow()),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            name = product_name or f'lot {batch.batch_number}'
+            return self._fail(line, name, f'Lot {batch.batch_number} insuffisant pour {name}')
+        batch_stats.note_change(batch.pharmacy_id)
+        return True
+
+    @property
+    def ok(self):
+        return not self.failures
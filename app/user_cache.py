@@ -0,0 +1,143 @@
+"""
+Chargement de l'utilisateur connecté
+
+load_user faisait User.query.get à chaque requête, puis presque chaque route
+chargeait pharmacy_assignments et les pharmacies une par une. L'utilisateur,
+ses affectations et leurs pharmacies sont maintenant lus en une seule
+requête (jointures), dans une session à part, et gardés dans un cache LRU
+du worker (USER_CACHE_SIZE entrées, USER_CACHE_TTL secondes) avec leur
+AuthContext. À chaque requête, la copie en cache est rattachée à la session
+par merge(load=False), sans aucune requête SQL.
+
+Toute modification d'un utilisateur, d'une affectation ou d'une pharmacie
+par l'ORM incrémente après le commit le compteur 'users' de cache_versions ;
+chaque worker relit ce compteur au plus toutes les USER_CACHE_CHECK_INTERVAL
+secondes et vide son cache s'il a changé. Les suppressions en masse
+(Query.delete, comme dans users.assign_pharmacies) ne déclenchent aucun
+événement ORM : les routes de app/routes/users.py appellent donc
+user_cache.invalidate() explicitement après chaque commit.
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, joinedload, object_session
+from app.models import db, User, UserPharmacy, Pharmacy, AuthContext, CacheVersion
+
+USERS_VERSION_NAME = 'users'
+_PENDING_KEY = 'pending_users'
+
+
+class UserCache:
+    """Utilisateurs récemment chargés par le worker (LRU)"""
+
+    def __init__(self):
+        self.ttl = 30
+        self.max_size = 256
+        self.check_interval = 2
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', 30)
+        self.max_size = app.config.get('USER_CACHE_SIZE', 256)
+        self.check_interval = app.config.get('USER_CACHE_CHECK_INTERVAL', 2)
+        if not event.contains(Session, 'after_commit', _after_commit):
+            for model in (User, UserPharmacy, Pharmacy):
+                event.listen(model, 'after_insert', _user_changed)
+                event.listen(model, 'after_update', _user_changed)
+                event.listen(model, 'after_delete', _user_changed)
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_transaction_end', _after_transaction_end)
+
+    def load(self, user_id):
+        """Utilisateur attaché à la session courante (None s'il n'existe pas)"""
+        version = self._current_version()
+        now = time.monotonic()
+        entry = None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (entry[0] != version or now - entry[1] > self.ttl):
+                del self._entries[user_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+
+        if entry is None:
+            cached, context = self._fetch(user_id)
+            if cached is None:
+                return None
+            entry = (version, now, cached, context)
+            with self._lock:
+                self._entries[user_id] = entry
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        # Copie attachée à la session de la requête, état repris tel quel
+        user = db.session.merge(entry[2], load=False)
+        user._auth_context = entry[3]
+        return user
+
+    def _fetch(self, user_id):
+        """Utilisateur, affectations et pharmacies en une requête, détachés"""
+        session = Session(db.engine)
+        try:
+            user = session.execute(
+                select(User)
+                .options(joinedload(User.pharmacy_assignments).joinedload(UserPharmacy.pharmacy))
+                .where(User.id == user_id)
+            ).unique().scalar_one_or_none()
+            if user is None:
+                return None, None
+            context = AuthContext.build(
+                user, [(assignment.pharmacy_id, assignment.is_primary) for assignment in user.pharmacy_assignments]
+            )
+        finally:
+            # close() détache les objets sans les expirer
+            session.close()
+        return user, context
+
+    def _current_version(self):
+        """Compteur 'users', relu au plus toutes les check_interval secondes"""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version
+        version = CacheVersion.current(USERS_VERSION_NAME)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+            self._version = version
+            self._checked_at = now
+        return version
+
+    def invalidate(self):
+        """Incrémenter le compteur 'users' (après un commit) et vider le cache local"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+        try:
+            CacheVersion.bump(USERS_VERSION_NAME)
+        except Exception as e:
+            # Connexion séparée, le commit de la route a déjà eu lieu : ne pas le transformer en erreur
+            print(f"Erreur invalidation cache utilisateurs: {str(e)}")
+
+
+user_cache = UserCache()
+
+
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_PENDING_KEY] = True
+
+
+def _after_commit(session):
+    if session.info.pop(_PENDING_KEY, None):
+        user_cache.invalidate()
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
@@ -110,17 +110,21 @@ def validate_code(code, reference_type, reference_id, used_by):
         return False
 
 def clean_expired_codes():
-    """Nettoyer les codes expirés (à appeler périodiquement)"""
+    """Marquer les codes expirés (exécuté périodiquement, voir app.maintenance)
+    
+    Returns:
+        Nombre de codes marqués, None si erreur
+    """
     try:
-        ValidationCode.query.filter(
+        count = ValidationCode.query.filter(
             ValidationCode.expires_at < datetime.utcnow(),
             ValidationCode.status == 'active'
-        ).update({'status': 'expired'})
+        ).update({'status': 'expired'}, synchronize_session=False)
         
         db.session.commit()
-        return True
+        return count
     except Exception as e:
         db.session.rollback()
         print(f"Erreur nettoyage codes: {e}")
-        return False
+        return None
 
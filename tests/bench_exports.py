@@ -0,0 +1,114 @@
+"""
+Banc d'essai des exports (app.export_utils) : débit et mémoire maximale
+
+    python tests/bench_exports.py --rows 100000
+    python tests/bench_exports.py --rows 100000 --formats excel
+
+Chaque mesure tourne dans un processus neuf : la mémoire maximale (RSS,
+resource.getrusage) est celle de l'écriture seule. Le même export est
+mesuré pour --rows et pour --rows / 10 : avec l'écriture en flux (classeur
+write-only enregistré dans un fichier temporaire), la mémoire ne doit pas
+suivre le nombre de lignes.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEADERS = ['Code', 'Produit', 'Catégorie', 'Quantité', 'Prix achat', 'Prix vente', 'Marge %',
+           'Expiration', 'Mis à jour']
+CATEGORIES = ('comprime', 'gelule', 'sirop', 'injectable', 'pommade')
+
+
+def iter_rows(count):
+    """Lignes d'export générées à la volée, comme iter_query"""
+    rng = random.Random(42)
+    today = date.today()
+    now = datetime.now()
+    for index in range(count):
+        purchase = round(rng.uniform(0.5, 50), 2)
+        selling = round(purchase * rng.uniform(1.1, 1.8), 2)
+        yield {
+            'Code': f'{4006000000000 + index}',
+            'Produit': f'Produit {index} {rng.choice(CATEGORIES)} {rng.choice((100, 250, 500))}mg',
+            'Catégorie': rng.choice(CATEGORIES),
+            'Quantité': rng.randint(0, 500),
+            'Prix achat': purchase,
+            'Prix vente': selling,
+            'Marge %': (selling - purchase) / selling,
+            'Expiration': today + timedelta(days=rng.randint(-30, 900)),
+            'Mis à jour': now - timedelta(minutes=index),
+        }
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets sous Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(export_format, rows):
+    """Processus fils : un export, résultat en JSON sur la sortie standard"""
+    from app.export_utils import write_csv, write_excel
+    if export_format == 'excel':
+        # Imports d'openpyxl hors mesure
+        import openpyxl  # noqa: F401
+        from openpyxl.cell import WriteOnlyCell  # noqa: F401
+
+    baseline = peak_rss_mb()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'export.{export_format}')
+        started = time.perf_counter()
+        if export_format == 'csv':
+            with open(path, 'w', newline='', encoding='utf-8-sig') as output:
+                write_csv(iter_rows(rows), HEADERS, output)
+        else:
+            with open(path, 'wb') as output:
+                write_excel(iter_rows(rows), HEADERS, 'Produits', {'Marge %': '0.0%'}, output=output)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+
+    print(json.dumps({'seconds': elapsed, 'baseline_mb': baseline, 'peak_mb': peak_rss_mb(),
+                      'size_mb': size / (1024 * 1024)}))
+
+
+def measure(export_format, rows):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', export_format, '--rows', str(rows)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--formats', default='csv,excel', help='formats mesurés (csv, excel)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.rows)
+        return
+
+    print(f"{'format':<8}{'lignes':>10}{'durée':>10}{'lignes/s':>12}{'fichier':>10}"
+          f"{'RSS départ':>13}{'RSS max':>10}{'écart':>9}")
+    for export_format in args.formats.split(','):
+        for rows in (max(args.rows // 10, 1), args.rows):
+            result = measure(export_format, rows)
+            growth = result['peak_mb'] - result['baseline_mb']
+            print(f"{export_format:<8}{rows:>10}{result['seconds']:>9.1f}s"
+                  f"{rows / result['seconds']:>12.0f}{result['size_mb']:>8.1f}Mo"
+                  f"{result['baseline_mb']:>11.0f}Mo{result['peak_mb']:>8.0f}Mo{growth:>7.0f}Mo")
+
+
+if __name__ == '__main__':
+    main()
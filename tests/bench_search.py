@@ -0,0 +1,112 @@
+"""
+Banc d'essai de la recherche texte (app.search) sur un grand catalogue
+
+    python tests/bench_search.py --products 100000
+    python tests/bench_search.py --database mysql+pymysql://root:@localhost:3306/marphar_bench
+
+Remplit la table products (base SQLite temporaire par défaut), puis mesure
+pour chaque moteur disponible (FTS5 ou FULLTEXT, trigrammes en mémoire,
+ILIKE) le temps d'une recherche produit comme celle de la caisse.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ('paracetamol', 'amoxicilline', 'ibuprofene', 'metformine', 'omeprazole', 'azithromycine',
+         'ciprofloxacine', 'doliprane', 'vitamine', 'artesunate', 'quinine', 'cotrimoxazole',
+         'diclofenac', 'loratadine', 'salbutamol', 'fer', 'acide', 'folique', 'zinc', 'sirop')
+FORMS = ('comprime', 'gelule', 'sirop', 'injectable', 'pommade', 'suspension')
+QUERIES = ('para', 'amoxi', 'cilline', '500mg', 'sirop', 'zzzz', '4006')
+CHUNK = 5000
+
+
+def create_app(database_url):
+    from app.config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        MAINTENANCE_IN_PROCESS = False
+
+    from app import create_app as factory
+    return factory(BenchConfig)
+
+
+def fill_products(count):
+    from sqlalchemy import insert
+    from app.models import db, Product
+    existing = Product.query.count()
+    rng = random.Random(42)
+    for start in range(existing, count, CHUNK):
+        rows = [{
+            'name': f'{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {rng.choice((100, 250, 500, 1000))}mg',
+            'barcode': f'{4006000000000 + index}',
+            'category': rng.choice(FORMS),
+            'stock_quantity': rng.randint(0, 500),
+            'purchase_price': 1.0,
+            'selling_price': 1.5,
+            'is_active': True,
+        } for index in range(start, min(start + CHUNK, count))]
+        with db.engine.begin() as conn:
+            conn.execute(insert(Product.__table__), rows)
+    return Product.query.count()
+
+
+def measure(repeats):
+    from app.models import Product
+    from app.search import search
+    results = {}
+    for query in QUERIES:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            matches = Product.query.filter(search(Product, query)).limit(20).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[query] = (statistics.median(timings), len(matches))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--database', default=None, help='URL de la base (SQLite temporaire par défaut)')
+    args = parser.parse_args()
+
+    database_url = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app = create_app(database_url)
+    with app.app_context():
+        from app.search import LikeSearch, TrigramSearch, search_index
+
+        started = time.perf_counter()
+        total = fill_products(args.products)
+        print(f'{total} produits ({time.perf_counter() - started:.1f} s)')
+
+        started = time.perf_counter()
+        indexed = search_index.create_indexes()
+        print(f'Index {indexed.name} ({time.perf_counter() - started:.1f} s)')
+
+        backends = [indexed]
+        if not isinstance(indexed, TrigramSearch):
+            backends.append(TrigramSearch(ttl=3600))
+        backends.append(LikeSearch())
+
+        print(f"\n{'moteur':<16}" + ''.join(f'{query:>12}' for query in QUERIES))
+        for backend in backends:
+            search_index.backend = backend
+            if isinstance(backend, TrigramSearch):
+                # Construction de l'index en mémoire hors mesure
+                started = time.perf_counter()
+                measure(1)
+                print(f'(construction index trigrammes: {time.perf_counter() - started:.1f} s)')
+            results = measure(args.repeats)
+            print(f'{backend.name:<16}' + ''.join(f'{results[query][0]:>10.1f}ms' for query in QUERIES))
+
+
+if __name__ == '__main__':
+    main()
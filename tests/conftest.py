@@ -0,0 +1,41 @@
+"""
+Fixtures des tests
+
+L'application tourne sur une base SQLite fichier (partagée entre threads) ou
+sur la base donnée par TEST_DATABASE_URL, par exemple
+mysql+pymysql://root:@localhost:3306/marphar_test pour les tests de
+concurrence sur MySQL.
+"""
+import os
+import pytest
+from app.config import Config
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    spool_dir = str(tmp_path_factory.mktemp('audit_spool'))
+    url = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = url
+        # Attente du verrou d'écriture SQLite entre threads
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}} if url.startswith('sqlite') else {}
+        MAINTENANCE_IN_PROCESS = False
+        AUDIT_SPOOL_DIR = spool_dir
+
+    from app import create_app
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def pharmacy(app):
+    """Pharmacie créée pour le test"""
+    import uuid
+    from app.models import db, Pharmacy
+    with app.app_context():
+        pharmacy = Pharmacy(name='Pharmacie test', code=f'T-{uuid.uuid4().hex[:8]}')
+        db.session.add(pharmacy)
+        db.session.commit()
+        return pharmacy.id
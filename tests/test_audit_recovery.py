@@ -0,0 +1,140 @@
+"""
+Reprise des spools d'audit : un fichier n'est rejoué que par un seul processus,
+et les spools d'un worker arrêté sont repris même si son pid a été réattribué
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import uuid
+import pytest
+from app.models import db, Audit
+from app.helpers.audit_writer import audit_writer, fcntl
+
+RECORDS = 25
+
+
+def dead_pid():
+    """Identifiant d'un processus terminé"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def spool_path(pid, token=None, segment=1):
+    """Spool d'une vie de processus (pid, jeton), avec son fichier de verrou"""
+    token = token or uuid.uuid4().hex[:12]
+    open(os.path.join(audit_writer.spool_dir, f'audit-{pid}-{token}.lock'), 'a').close()
+    return os.path.join(audit_writer.spool_dir, f'audit-{pid}-{token}-{segment}.jsonl')
+
+
+def write_spool(path, marker, count):
+    with open(path, 'w', encoding='utf-8') as spool:
+        for index in range(count):
+            spool.write(json.dumps({'action': marker, 'details': str(index)}) + '\n')
+
+
+def test_spool_replayed_once(app):
+    marker = f'recover-{uuid.uuid4().hex[:8]}'
+    path = spool_path(dead_pid())
+    write_spool(path, marker, RECORDS)
+    with open(path, 'a', encoding='utf-8') as spool:
+        spool.write('{"action": "tronqu')
+
+    barrier = threading.Barrier(4)
+    counts = []
+
+    def worker():
+        barrier.wait()
+        counts.append(audit_writer.recover())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(counts) == RECORDS
+    assert not glob.glob(path + '*')
+    with app.app_context():
+        assert Audit.query.filter_by(action=marker).count() == RECORDS
+
+
+def test_claim_left_by_dead_worker_is_recovered(app):
+    marker = f'recover-{uuid.uuid4().hex[:8]}'
+    claimer_token = uuid.uuid4().hex[:12]
+    spool_path(os.getpid(), claimer_token)
+    path = spool_path(dead_pid()) + f'.recovering-{os.getpid()}-{claimer_token}'
+    write_spool(path, marker, 1)
+
+    assert audit_writer.recover() == 1
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert Audit.query.filter_by(action=marker).count() == 1
+
+
+def test_previous_lifetime_with_same_pid_is_recovered(app):
+    """Worker redémarré avec le pid du worker arrêté (cas courant en conteneur)"""
+    marker = f'recover-{uuid.uuid4().hex[:8]}'
+    path = spool_path(os.getpid())
+    write_spool(path, marker, RECORDS)
+
+    # Le nouveau worker écrit ailleurs que dans le spool de l'ancien
+    with app.app_context():
+        audit_writer.enqueue({'action': f'{marker}-new'})
+    assert audit_writer._spool.name != path
+
+    assert audit_writer.recover() == RECORDS
+    assert not glob.glob(path + '*')
+    assert not os.path.exists(path.rsplit('-', 1)[0] + '.lock')
+    with app.app_context():
+        assert Audit.query.filter_by(action=marker).count() == RECORDS
+
+
+@pytest.mark.skipif(fcntl is None, reason='flock indisponible')
+def test_spool_of_live_lifetime_is_left_alone(app):
+    marker = f'recover-{uuid.uuid4().hex[:8]}'
+    path = spool_path(dead_pid())
+    write_spool(path, marker, 3)
+
+    # Verrou tenu : la vie de processus propriétaire est active, quel que soit son pid
+    with open(path.rsplit('-', 1)[0] + '.lock') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert audit_writer.recover() == 0
+        assert os.path.exists(path)
+    assert audit_writer.recover() == 3
+
+
+CRASHING_WORKER = '''
+import os, sys
+from app.config import Config
+
+class CrashConfig(Config):
+    SQLALCHEMY_DATABASE_URI = sys.argv[1]
+    AUDIT_SPOOL_DIR = sys.argv[2]
+    AUDIT_FLUSH_INTERVAL = 3600
+    AUDIT_BATCH_SIZE = 10000
+    MAINTENANCE_IN_PROCESS = False
+
+from app import create_app
+from app.helpers.audit_writer import audit_writer
+app = create_app(CrashConfig)
+for index in range(int(sys.argv[4])):
+    audit_writer.enqueue({'action': sys.argv[3], 'details': str(index)})
+os._exit(1)  # arrêt brutal : ni flush, ni atexit
+'''
+
+
+def test_records_of_crashed_worker_are_recovered(app):
+    marker = f'recover-{uuid.uuid4().hex[:8]}'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', CRASHING_WORKER, app.config['SQLALCHEMY_DATABASE_URI'],
+                    audit_writer.spool_dir, marker, str(RECORDS)], cwd=root, capture_output=True)
+    with app.app_context():
+        assert Audit.query.filter_by(action=marker).count() == 0
+
+    assert audit_writer.recover() >= RECORDS
+    with app.app_context():
+        assert Audit.query.filter_by(action=marker).count() == RECORDS
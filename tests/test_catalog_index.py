@@ -0,0 +1,110 @@
+"""
+Catalogue en mémoire de la caisse : un scan de code-barres exact ne fait
+aucune requête et répond en bien moins d'une milliseconde ; une modification
+de produit ou une incrémentation du compteur 'catalog' (autre worker)
+invalide la copie
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from sqlalchemy import event, update
+from app.models import db, Product, CacheVersion
+from app.catalog_index import catalog_index, CATALOG_VERSION_NAME
+from app.user_cache import user_cache
+
+PASSWORD = 'secret123'
+LOOKUPS = 10000
+
+
+@contextmanager
+def counted_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def make_products(pharmacy_id, count=200):
+    codes = []
+    for index in range(count):
+        code = uuid.uuid4().hex
+        db.session.add(Product(name=f'Produit {index} {code[:6]}', barcode=code, pharmacy_id=pharmacy_id,
+                               stock_quantity=10, purchase_price=1.0, selling_price=2.0))
+        codes.append(code)
+    db.session.commit()
+    return codes
+
+
+def test_barcode_hit_without_sql(app, pharmacy, monkeypatch):
+    # Le compteur 'catalog' n'est relu que toutes les check_interval secondes :
+    # intervalle allongé pour que la mesure n'en contienne pas
+    monkeypatch.setattr(catalog_index, 'check_interval', 3600)
+    with app.app_context():
+        codes = make_products(pharmacy)
+        catalog_index.get(pharmacy)
+
+        with counted_statements() as statements:
+            started = time.perf_counter()
+            for index in range(LOOKUPS):
+                code = codes[index % len(codes)]
+                assert catalog_index.get(pharmacy).barcode(code)['barcode'] == code
+            per_lookup_ms = (time.perf_counter() - started) * 1000 / LOOKUPS
+
+    assert statements == []
+    assert per_lookup_ms < 0.1
+
+
+def test_search_route_barcode_without_sql(app, pharmacy, monkeypatch):
+    monkeypatch.setattr(catalog_index, 'check_interval', 3600)
+    monkeypatch.setattr(user_cache, 'check_interval', 3600)
+    with app.app_context():
+        code = make_products(pharmacy, 5)[0]
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    # Premier scan : utilisateur et catalogue mis en cache hors mesure
+    client.get(f'/pos/search-product?q={code}')
+
+    with app.app_context(), counted_statements() as statements:
+        response = client.get(f'/pos/search-product?q={code}')
+    assert [product['barcode'] for product in response.get_json()] == [code]
+    assert statements == []
+
+
+def test_product_edit_invalidates_entry(app, pharmacy, monkeypatch):
+    monkeypatch.setattr(catalog_index, 'check_interval', 3600)
+    with app.app_context():
+        code = make_products(pharmacy, 3)[0]
+        assert catalog_index.get(pharmacy).barcode(code) is not None
+
+        product = Product.query.filter_by(barcode=code).one()
+        product.barcode = f'{code}-new'
+        db.session.commit()
+
+        catalog = catalog_index.get(pharmacy)
+        assert catalog.barcode(code) is None
+        assert catalog.barcode(f'{code}-new')['id'] == product.id
+
+
+def test_version_bump_from_other_worker_invalidates_entry(app, pharmacy, monkeypatch):
+    monkeypatch.setattr(catalog_index, 'check_interval', 3600)
+    with app.app_context():
+        code = make_products(pharmacy, 3)[0]
+        assert catalog_index.get(pharmacy).barcode(code)['price'] == 2.0
+
+        # Autre worker : UPDATE hors ORM de ce processus, puis compteur incrémenté
+        with db.engine.begin() as conn:
+            conn.execute(update(Product.__table__).where(Product.__table__.c.barcode == code)
+                         .values(selling_price=3.0))
+        CacheVersion.bump(CATALOG_VERSION_NAME)
+        # Tant que le compteur n'est pas relu, la copie du worker est servie
+        assert catalog_index.get(pharmacy).barcode(code)['price'] == 2.0
+
+        monkeypatch.setattr(catalog_index, 'check_interval', 0)
+        assert catalog_index.get(pharmacy).barcode(code)['price'] == 3.0
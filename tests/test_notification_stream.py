@@ -0,0 +1,28 @@
+"""
+Flux SSE des notifications : désactivé par défaut (workers gunicorn synchrones)
+"""
+
+
+def login(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+
+def test_stream_disabled_by_default(app):
+    client = app.test_client()
+    login(client)
+    assert client.get('/notifications/stream').status_code == 204
+    page = client.get('/dashboard/').get_data(as_text=True)
+    assert 'new EventSource' not in page
+    assert 'setInterval(loadNotifications, 30000)' in page
+
+
+def test_stream_enabled(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'NOTIFICATION_SSE_ENABLED', True)
+    monkeypatch.setitem(app.config, 'NOTIFICATION_STREAM_TIMEOUT', 0)
+    client = app.test_client()
+    login(client)
+    response = client.get('/notifications/stream')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith('retry: 5000')
+    assert 'new EventSource' in client.get('/dashboard/').get_data(as_text=True)
@@ -0,0 +1,66 @@
+"""
+Numérotation : aucun numéro attribué deux fois, même entre processus
+
+Plusieurs processus (démarrés à neuf, comme des workers gunicorn) tirent
+des numéros par next_number pour plusieurs pharmacies, jour après jour, en
+même temps et avec des tailles de bloc différentes ; les compteurs de chaque
+jour sont créés pendant la course (premier numéro de la période).
+NUMBERING_STRESS_TOTAL règle le nombre total de numéros (un million par
+défaut).
+"""
+import multiprocessing
+import os
+import random
+import uuid
+
+PROCESSES = 8
+PHARMACIES = 3
+DAYS = ('20261017', '20261018')
+BLOCK_SIZES = (20, 50, 100)
+TOTAL = int(os.environ.get('NUMBERING_STRESS_TOTAL', 1_000_000))
+
+
+def draw_numbers(database_url, spool_dir, name, count, seed):
+    """Processus fils : `count` numéros, jour après jour, pharmacie au hasard"""
+    from app.config import Config
+
+    class StressConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}} if database_url.startswith('sqlite') else {}
+        MAINTENANCE_IN_PROCESS = False
+        AUDIT_SPOOL_DIR = spool_dir
+
+    from app import create_app
+    from app.numbering import next_number
+
+    rng = random.Random(seed)
+    block_size = BLOCK_SIZES[seed % len(BLOCK_SIZES)]
+    drawn = {}
+    with create_app(StressConfig).app_context():
+        for period in DAYS:
+            for _ in range(count // len(DAYS)):
+                scope = f'pharmacy-{rng.randrange(PHARMACIES)}'
+                number = next_number(name, scope, period, block_size)
+                drawn.setdefault((scope, period), []).append(number)
+    return drawn
+
+
+def test_numbers_unique_across_processes(app):
+    name = f'S{uuid.uuid4().hex[:8]}'
+    per_process = TOTAL // PROCESSES // len(DAYS) * len(DAYS)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(PROCESSES) as pool:
+        results = pool.starmap(draw_numbers, [
+            (app.config['SQLALCHEMY_DATABASE_URI'], app.config['AUDIT_SPOOL_DIR'], name, per_process, seed) for seed in range(PROCESSES)
+        ])
+
+    by_counter = {}
+    for drawn in results:
+        for key, numbers in drawn.items():
+            by_counter.setdefault(key, []).extend(numbers)
+
+    assert sum(len(numbers) for numbers in by_counter.values()) == per_process * PROCESSES
+    assert len(by_counter) == PHARMACIES * len(DAYS)
+    for key, numbers in by_counter.items():
+        assert len(numbers) == len(set(numbers)), f'numéros en double pour {key}'
+        assert min(numbers) >= 1
@@ -0,0 +1,82 @@
+"""
+Encaissement POS : nombre de lectures indépendant de la taille du panier
+
+Les produits et leurs lots (SELECT ... FOR UPDATE sur MySQL) sont chargés en
+une requête chacun par FefoAllocator ; seules les écritures (UPDATE de
+stock, mouvements) suivent le nombre de lignes.
+"""
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from sqlalchemy import event
+from app.models import db, Product, ProductBatch, User, UserPharmacy
+
+PASSWORD = 'secret123'
+CART_SIZES = (1, 10, 40)
+
+
+@contextmanager
+def captured_statements(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(' '.join(statement.split()))
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def reads(statements):
+    """SELECT du panier ; les relectures périodiques des compteurs de cache (cache_versions)
+    dépendent de l'horloge, pas du panier"""
+    selects = [s for s in statements if s.upper().startswith('SELECT') and 'FROM cache_versions' not in s]
+    return len(selects), sum('FOR UPDATE' in s.upper() for s in selects)
+
+
+def test_checkout_reads_do_not_grow_with_cart(app, pharmacy):
+    with app.app_context():
+        name = f'caisse-{uuid.uuid4().hex[:8]}'
+        user = User(username=name, email=f'{name}@test.local', role='pharmacien')
+        user.set_password(PASSWORD)
+        user.set_permissions({'manage_sales': True})
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(UserPharmacy(user_id=user.id, pharmacy_id=pharmacy, is_primary=True))
+        product_ids = []
+        for index in range(max(CART_SIZES)):
+            product = Product(name=f'Produit {index} {name}', barcode=f'{name}-{index}', pharmacy_id=pharmacy,
+                              stock_quantity=100, purchase_price=1.0, selling_price=2.0)
+            db.session.add(product)
+            db.session.flush()
+            product_ids.append(product.id)
+            # Deux lots par produit : l'allocation FEFO en entame un
+            for days in (30, 90):
+                db.session.add(ProductBatch(product_id=product.id, pharmacy_id=pharmacy,
+                                            batch_number=f'L-{product.id}-{days}', quantity=50,
+                                            initial_quantity=50, purchase_price=1.0,
+                                            expiry_date=date.today() + timedelta(days=days)))
+        db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': name, 'password': PASSWORD})
+
+    def checkout(size):
+        items = [{'product_id': product_id, 'quantity': 2, 'price': 2.0} for product_id in product_ids[:size]]
+        response = client.post('/pos/create-sale', json={'items': items, 'paid_amount': 4.0 * size})
+        assert response.get_json()['success'], response.get_json()
+
+    # Premier encaissement : caches du worker et compteur de factures créés hors mesure
+    checkout(1)
+
+    counts = {}
+    for size in CART_SIZES:
+        with captured_statements(app) as statements:
+            checkout(size)
+        counts[size] = reads(statements)
+
+    assert len(set(counts.values())) == 1, counts
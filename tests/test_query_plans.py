@@ -0,0 +1,142 @@
+"""
+Plans d'exécution des requêtes chaudes
+
+Les pages (tableau de bord, recherche POS, liste des crédits, compteurs de
+notifications) et l'allocation FEFO sont exécutées sur une base SQLite
+remplie ; chaque SELECT émis est rejoué avec EXPLAIN QUERY PLAN. Un
+`SCAN <table>` sans index (parcours complet) fait échouer le test : il
+signale un index de app/models.py supprimé ou une requête qui ne peut plus
+l'utiliser.
+"""
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app.models import db, Product, ProductBatch, Sale, Customer, Notification, User, UserPharmacy
+from app.stock_utils import FefoAllocator
+
+PASSWORD = 'secret123'
+
+
+@pytest.fixture
+def sqlite_app(app):
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip('EXPLAIN QUERY PLAN : SQLite uniquement')
+    return app
+
+
+@pytest.fixture
+def seeded(sqlite_app, pharmacy):
+    """Pharmacien de la pharmacie de test, avec produits, lots, ventes et notifications"""
+    with sqlite_app.app_context():
+        name = f'plan-{uuid.uuid4().hex[:8]}'
+        user = User(username=name, email=f'{name}@test.local', role='pharmacien')
+        user.set_password(PASSWORD)
+        user.set_permissions({'view_dashboard': True, 'manage_sales': True})
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(UserPharmacy(user_id=user.id, pharmacy_id=pharmacy, is_primary=True))
+
+        customer = Customer(name=f'Client {name}')
+        db.session.add(customer)
+        db.session.flush()
+
+        products = []
+        for index in range(30):
+            product = Product(name=f'Paracetamol {index} {name}', barcode=f'{name}-{index}',
+                              pharmacy_id=pharmacy, stock_quantity=index, min_stock_level=10,
+                              purchase_price=1.0, selling_price=1.5)
+            db.session.add(product)
+            products.append(product)
+        db.session.flush()
+        for product in products:
+            for offset in (30, 200):
+                db.session.add(ProductBatch(
+                    product_id=product.id, pharmacy_id=pharmacy, batch_number=f'L-{product.id}-{offset}',
+                    quantity=5, initial_quantity=5, purchase_price=1.0,
+                    expiry_date=date.today() + timedelta(days=offset)
+                ))
+
+        for index in range(30):
+            credit = index % 2 == 0
+            db.session.add(Sale(
+                invoice_number=f'F-{name}-{index}', customer_id=customer.id, user_id=user.id,
+                pharmacy_id=pharmacy, total_amount=10.0, paid_amount=0 if credit else 10.0,
+                remaining_amount=10.0 if credit else 0, payment_type='credit' if credit else 'cash',
+                credit_status='unpaid' if credit else None,
+                payment_status='pending' if credit else 'paid',
+                sale_date=datetime.now() - timedelta(days=index)
+            ))
+            db.session.add(Notification(title=f'Notification {index}', message='Test',
+                                        target_admin_id=user.id if index % 3 else None))
+        db.session.commit()
+        return {'username': name, 'pharmacy_id': pharmacy,
+                'product_ids': [product.id for product in products]}
+
+
+@contextmanager
+def captured_selects():
+    """SELECT émis par le moteur pendant le bloc : [(sql, paramètres)]"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def full_scans(statements):
+    """Lignes `SCAN <table>` sans index des plans des requêtes capturées"""
+    found = []
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters):
+                detail = row[-1]
+                # SCAN t USING [COVERING] INDEX ... et sous-requêtes/tables temporaires acceptés
+                if detail.startswith('SCAN ') and ' USING ' not in detail and 'SUBQUERY' not in detail:
+                    found.append(f'{detail}\n    {statement}')
+    return found
+
+
+def page_selects(app, username, url):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    # Premier appel : caches du worker (utilisateur, catalogue, recherche) remplis hors mesure
+    client.get(url)
+    with app.app_context(), captured_selects() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert statements
+    return statements
+
+
+@pytest.mark.parametrize('url', [
+    '/dashboard/',
+    '/pos/search-product?q=cetam',
+    '/credit-sales/',
+    '/credit-sales/?status=unpaid',
+    '/notifications/',
+    '/notifications/unread-count',
+    '/notifications/recent',
+])
+def test_hot_pages_use_indexes(sqlite_app, seeded, url):
+    statements = page_selects(sqlite_app, seeded['username'], url)
+    with sqlite_app.app_context():
+        assert full_scans(statements) == []
+
+
+def test_fefo_allocation_uses_indexes(sqlite_app, seeded):
+    with sqlite_app.app_context():
+        with captured_selects() as statements:
+            allocator = FefoAllocator(seeded['product_ids'][:5], seeded['pharmacy_id'])
+            assert allocator.allocate(seeded['product_ids'][0], 7)
+        db.session.rollback()
+        assert statements
+        assert full_scans(statements) == []
@@ -0,0 +1,85 @@
+"""
+Modification et suppression de vente : chaque changement de stock a son mouvement
+
+Le stock reconstitué à partir des mouvements (stock_as_of) doit retrouver
+le stock d'avant la vente, quelles que soient les modifications.
+"""
+import uuid
+from datetime import date, datetime, timedelta
+from app.models import db, Product, Sale, SaleItem, StockMovement, User
+from app.stock_snapshots import INCOMING_TYPES, stock_as_of
+
+STOCK = 10
+
+
+def make_sale(pharmacy_id, quantity):
+    """Vente en attente de `quantity` unités, comme l'enregistre la caisse"""
+    product = Product(name=f'Produit {uuid.uuid4().hex[:6]}', barcode=uuid.uuid4().hex,
+                      pharmacy_id=pharmacy_id, stock_quantity=STOCK - quantity,
+                      purchase_price=1.0, selling_price=2.0,
+                      created_at=datetime.utcnow() - timedelta(days=2))
+    db.session.add(product)
+    db.session.flush()
+    sale = Sale(invoice_number=f'F-{uuid.uuid4().hex[:8]}', user_id=User.query.first().id,
+                pharmacy_id=pharmacy_id, total_amount=2.0 * quantity, remaining_amount=2.0 * quantity,
+                paid_amount=0, payment_status='pending')
+    db.session.add(sale)
+    db.session.flush()
+    db.session.add(SaleItem(sale_id=sale.id, product_id=product.id, quantity=quantity,
+                            unit_price=2.0, total=2.0 * quantity))
+    db.session.add(StockMovement(product_id=product.id, movement_type='out', quantity=quantity,
+                                 reference=sale.invoice_number, pharmacy_id=pharmacy_id))
+    db.session.commit()
+    return sale.id, product.id
+
+
+def movements_total(product_id):
+    return sum(m.quantity if m.movement_type in INCOMING_TYPES else -m.quantity
+               for m in StockMovement.query.filter_by(product_id=product_id))
+
+
+def admin_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+def edit_sale(client, sale_id, product_id, quantity):
+    return client.post(f'/sales/edit/{sale_id}', data={
+        'edit_reason': 'Correction', 'discount': 0, 'tax': 0,
+        'product_id[]': [product_id], 'quantity[]': [quantity], 'price[]': [2.0],
+    })
+
+
+def test_edit_and_delete_write_movements(app, pharmacy):
+    with app.app_context():
+        sale_id, product_id = make_sale(pharmacy, 4)
+    client = admin_client(app)
+
+    for quantity in (6, 1):
+        assert edit_sale(client, sale_id, product_id, quantity).status_code == 302
+        with app.app_context():
+            assert db.session.get(Product, product_id).stock_quantity == STOCK - quantity
+            assert movements_total(product_id) == -quantity
+
+    assert client.post(f'/sales/delete/{sale_id}', data={'delete_reason': 'Test'}).status_code == 302
+    with app.app_context():
+        assert db.session.get(Sale, sale_id) is None
+        assert db.session.get(Product, product_id).stock_quantity == STOCK
+        assert movements_total(product_id) == 0
+        assert [m.movement_type for m in StockMovement.query.filter_by(product_id=product_id)
+                .order_by(StockMovement.id)] == ['out', 'out', 'in', 'in']
+        yesterday = date.today() - timedelta(days=1)
+        assert stock_as_of(yesterday, Product.query.filter_by(id=product_id))[product_id]['quantity'] == STOCK
+
+
+def test_edit_beyond_stock_is_refused(app, pharmacy):
+    with app.app_context():
+        sale_id, product_id = make_sale(pharmacy, 4)
+    client = admin_client(app)
+
+    edit_sale(client, sale_id, product_id, STOCK + 1)
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock_quantity == STOCK - 4
+        assert movements_total(product_id) == -4
+        assert SaleItem.query.filter_by(sale_id=sale_id).one().quantity == 4
@@ -0,0 +1,29 @@
+"""
+Tâches de fond interrompues : marquées en échec par la maintenance périodique
+"""
+from datetime import datetime, timedelta
+from app.models import db, Job
+from app.helpers.maintenance_scheduler import maintenance_scheduler
+
+
+def make_job(heartbeat_age):
+    heartbeat = datetime.utcnow() - timedelta(seconds=heartbeat_age)
+    job = Job(kind='export', status='running', started_at=heartbeat, heartbeat_at=heartbeat)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_maintenance_fails_stale_jobs(app):
+    stale_after = app.config['JOB_STALE_AFTER']
+    with app.app_context():
+        stale = make_job(stale_after + 60)
+        alive = make_job(5)
+
+        results = maintenance_scheduler.run_pending(only='stale_jobs', force=True)
+        assert results['stale_jobs'] >= 1
+
+        db.session.expire_all()
+        assert db.session.get(Job, stale).status == 'failed'
+        assert db.session.get(Job, stale).message == 'Interrompu'
+        assert db.session.get(Job, alive).status == 'running'
@@ -0,0 +1,151 @@
+"""
+Ventes simultanées : pas de survente, pas de mise à jour perdue, pas d'interblocage
+
+Chaque thread rejoue le chemin de pos.checkout / sales.validate_temp_sale
+(FefoAllocator puis StockLedger) dans son propre contexte d'application.
+Les paniers alternent A,B et B,A pour vérifier l'ordre de verrouillage.
+"""
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+import pytest
+from sqlalchemy.exc import OperationalError
+from app.models import db, Product, ProductBatch, TempSale, User
+from app.stock_utils import FefoAllocator, StockLedger
+
+THREADS = 20
+STOCK = 50
+QUANTITY = 3
+
+
+def make_product(pharmacy_id, stock):
+    product = Product(name=f'Produit {uuid.uuid4().hex[:6]}', barcode=uuid.uuid4().hex,
+                      pharmacy_id=pharmacy_id, stock_quantity=stock, purchase_price=1.0)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add(ProductBatch(product_id=product.id, pharmacy_id=pharmacy_id,
+                                batch_number=f'L-{product.id}', quantity=stock, initial_quantity=stock,
+                                purchase_price=1.0, expiry_date=date.today() + timedelta(days=365)))
+    return product
+
+
+def sell(app, pharmacy_id, cart, attempts=100):
+    """Vendre un panier [(product_id, quantité)] ; True si la vente est validée"""
+    for attempt in range(attempts):
+        with app.app_context():
+            try:
+                allocator = FefoAllocator([product_id for product_id, quantity in cart], pharmacy_id)
+                ledger = StockLedger()
+                lines = [(line, allocator.get_product(product_id), quantity)
+                         for line, (product_id, quantity) in enumerate(cart, start=1)]
+                decremented = ledger.decrement_products(lines)
+                for line, product, quantity in lines:
+                    if line in decremented:
+                        for batch, taken in allocator.allocate(product.id, quantity) or []:
+                            ledger.decrement_batch(line, batch, taken, product.name)
+                if not ledger.ok:
+                    db.session.rollback()
+                    return False
+                db.session.commit()
+                return True
+            except OperationalError as e:
+                db.session.rollback()
+                # Seul le verrou d'écriture global de SQLite est réessayé :
+                # un interblocage MySQL doit faire échouer le test
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(0.005 * (attempt + 1))
+    raise AssertionError('base verrouillée trop longtemps')
+
+
+def test_concurrent_sales_never_oversell(app, pharmacy):
+    with app.app_context():
+        product_a = make_product(pharmacy, STOCK).id
+        product_b = make_product(pharmacy, STOCK).id
+        db.session.commit()
+
+    barrier = threading.Barrier(THREADS)
+    results = []
+    errors = []
+
+    def worker(index):
+        cart = [(product_a, QUANTITY), (product_b, QUANTITY)]
+        if index % 2:
+            cart.reverse()
+        barrier.wait()
+        try:
+            results.append(sell(app, pharmacy, cart))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    sold = results.count(True)
+    assert sold == STOCK // QUANTITY
+
+    with app.app_context():
+        for product_id in (product_a, product_b):
+            product = db.session.get(Product, product_id)
+            batch = ProductBatch.query.filter_by(product_id=product_id).one()
+            assert product.stock_quantity == STOCK - sold * QUANTITY
+            assert batch.quantity == product.stock_quantity
+
+
+def test_temp_sale_claimed_once(app, pharmacy):
+    from app.routes.sales import claim_temp_sale
+    with app.app_context():
+        user = User.query.first()
+        temp_sale = TempSale(reference=f'TMP-{uuid.uuid4().hex[:8]}', created_by=user.id,
+                             pharmacy_id=pharmacy, items_data='[]', status='pending')
+        db.session.add(temp_sale)
+        db.session.commit()
+        temp_sale_id = temp_sale.id
+
+    with app.app_context():
+        # Objet chargé 'pending' par le second validateur...
+        temp_sale = db.session.get(TempSale, temp_sale_id)
+        assert temp_sale.status == 'pending'
+        # ... pendant que le premier valide
+        with db.engine.begin() as conn:
+            conn.execute(TempSale.__table__.update()
+                         .where(TempSale.__table__.c.id == temp_sale_id).values(status='validated'))
+        assert not claim_temp_sale(temp_sale, 'validating')
+        db.session.rollback()
+
+    with app.app_context():
+        temp_sale = TempSale(reference=f'TMP-{uuid.uuid4().hex[:8]}', created_by=User.query.first().id,
+                             pharmacy_id=pharmacy, items_data='[]', status='pending')
+        db.session.add(temp_sale)
+        db.session.commit()
+        assert claim_temp_sale(temp_sale, 'rejected')
+        assert not claim_temp_sale(temp_sale, 'rejected')
+        db.session.commit()
+
+
+@pytest.mark.parametrize('order', [(0, 1), (1, 0)])
+def test_products_decremented_in_id_order(app, pharmacy, monkeypatch, order):
+    decrement_product = StockLedger.decrement_product
+    seen = []
+
+    def recording(self, line, product, quantity):
+        seen.append(product.id)
+        return decrement_product(self, line, product, quantity)
+
+    monkeypatch.setattr(StockLedger, 'decrement_product', recording)
+    with app.app_context():
+        products = [make_product(pharmacy, 5), make_product(pharmacy, 5)]
+        db.session.commit()
+        ids = sorted(product.id for product in products)
+        done = StockLedger().decrement_products([
+            (line, products[index], 1) for line, index in enumerate(order, start=1)
+        ])
+        db.session.rollback()
+
+    assert done == {1, 2}
+    assert seen == ids
@@ -0,0 +1,37 @@
+"""
+Cache des utilisateurs : les routes de gestion le vident après leur commit
+
+assign_pharmacies supprime les affectations par Query.delete, sans
+événement ORM ; sans invalidation explicite, l'utilisateur gardait en cache
+les pharmacies qui venaient de lui être retirées.
+"""
+import uuid
+from app.models import db, User, UserPharmacy
+from app.user_cache import user_cache
+
+
+def make_user(pharmacy_id):
+    name = f'u-{uuid.uuid4().hex[:8]}'
+    user = User(username=name, email=f'{name}@test.local', role='vendeur')
+    user.set_password('secret123')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(UserPharmacy(user_id=user.id, pharmacy_id=pharmacy_id, is_primary=True))
+    return user
+
+
+def test_assign_pharmacies_refreshes_cached_user(app, pharmacy):
+    with app.app_context():
+        user_id = make_user(pharmacy).id
+        db.session.commit()
+
+    with app.test_request_context():
+        assert user_cache.load(user_id).auth_context.pharmacy_ids == {pharmacy}
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    response = client.post(f'/users/assign-pharmacies/{user_id}', data={})
+    assert response.status_code == 302
+
+    with app.test_request_context():
+        assert user_cache.load(user_id).auth_context.pharmacy_ids == frozenset()